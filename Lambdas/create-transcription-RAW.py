@@ -1,75 +1,38 @@
-import json
-import sys, os
-from datetime import datetime
-from pip._internal import main
-from urllib.parse import unquote_plus
-import re
-import unicodedata
-# Update BOTO3 version to latest
-main(['install', 'boto3', '--target', '/tmp'])
-sys.path.insert(0, '/tmp/')
-import boto3
+import storage
+import metrics
+import submitter
 
-lastReqId = 0
+# boto3 comes pinned in the dependency layer, the clients are created on the first event
+storage.check_versions()
 
-def name_formater(a_string):
-    ''' removes / and _ from string
-    :param a_string: a string to be formated
-    :return: returns the string formated in lower case
-    '''
-    
-    a_string = re.sub('/_. ', '_', a_string)
-    return a_string.lower()
-    
-def create_transcribe_job(input_bucket, input_key, output_bucket):
-    ''' Create the transcribe job without IPA custom vocabulary
+PROFILE = 'RAW'
+
+def create_transcribe_job(input_bucket, input_key, etag=None, timeout=None):
+    ''' Queue the transcribe job without IPA custom vocabulary and submit the queued jobs
     
     :param input_bucket: Bucket from where the audio file is located
     :param input_key: Key of audio file
-    :param output_bucket: Bucket of the output file (.json formatted)
-    :return: Nothing
+    :param etag: ETag of the upload, a notification of an upload already submitted is skipped
+    :param timeout: Seconds the submission may take
+    :return: Counts of the submitted, deferred and failed jobs, see submitter.Submitter.drain
     '''
     
-    # Generate the variables used in the rest of the code
-    client = boto3.client('transcribe')
-    now_timestamp = datetime.now().timestamp()
-    path = 'levenshteinTests/RAW/'
-    file_name = os.path.basename(input_key)
-    job_name = f'{name_formater(file_name)}-{now_timestamp}-RAW' 
-    output_name = f'{path}{file_name}-{now_timestamp}-RAW.json'
-    job_uri = f's3://{input_bucket}/{input_key}'
-    
-    # Create the transcirption job with specific settings
-    client.start_transcription_job(
-        TranscriptionJobName=job_name,
-        LanguageCode='es-ES',
-        Media={
-            'MediaFileUri': job_uri
-        },
-        OutputBucketName=output_bucket,
-        OutputKey=output_name,
-        Settings={
-            'ChannelIdentification': False
-        },
-        )    
+    jobs = submitter.get_submitter(PROFILE)
+    jobs.enqueue(input_bucket, input_key, etag)
+    return jobs.drain(timeout=timeout)
         
 
+@metrics.instrument('create-transcription-RAW')
 def lambda_handler(event, context):
-    ''' AWS Lambda Handler
-    
+    ''' AWS Lambda Handler, every upload of every SNS (or SQS) record is queued, an event without
+    records retries the failed uploads and submits the queued jobs (e.g. a schedule)
+
+    :return: Counts of the jobs and 'batchItemFailures', the records to deliver again
     '''
-    global lastReqId
-    
-    if lastReqId == context.aws_request_id:
-        return True
-    else:
-        lastReqId = context.aws_request_id
-        
-    message = json.loads(event['Records'][0]['Sns']['Message'])
-    bucket = message['Records'][0]['s3']['bucket']['name']
-    key = message['Records'][0]['s3']['object']['key']
-    endpoint = f's3://{bucket}/'
-    bucket_out = 'awstranscribe-tests'
- 
-    create_transcribe_job(bucket, key, bucket_out)
-    
\ No newline at end of file
+    # retries and redeliveries are skipped by the idempotency store, see idempotency.py
+    timeout = max(1, context.get_remaining_time_in_millis() / 1000 - 10)
+    if not event.get('Records'):
+        # scheduled run, the failed and stale uploads are queued again and the queue is drained
+        return submitter.scheduled_run(PROFILE, timeout)
+
+    return submitter.submit_event(PROFILE, event, timeout)
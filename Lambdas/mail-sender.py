@@ -1,5 +1,6 @@
 import base64
-import boto3
+import storage
+import metrics
 import gzip
 import json
 import logging
@@ -64,7 +65,7 @@ def publish_message(loggroup, logstream, error_msg, lambda_func_name):
     
         
     sns_arn = os.environ[snsARN]  # SNS NEEDS TO BE CHANGED TO VARIABLE snsARN normal
-    snsclient = boto3.client('sns')
+    snsclient = storage.get_client('sns')
     try:
         z = error_msg.split("\n")
         tag = error_msg[error_msg.find("[")+1:error_msg.find("]")]
@@ -102,6 +103,7 @@ def publish_message(loggroup, logstream, error_msg, lambda_func_name):
         logger.error("An error occured: %s" % e)
 
 
+@metrics.instrument('mail-sender')
 def lambda_handler(event, context):
     pload = logpayload(event)
     lgroup, lstream, errmessage, lambdaname = error_details(pload)
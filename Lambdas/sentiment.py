@@ -1,52 +1,27 @@
 import json
 import pandas as pd
 from io import StringIO
-import boto3
+import storage
+import metrics
+from transcripts import load_transcripts
 import sys, os
 from datetime import date, timedelta, datetime, timezone
-import time 
 import numpy as np
 import random
 import tarfile
 
-def get_all_s3_objects(s3, **base_kwargs):
-    continuation_token = None
-    while True:
-        list_kwargs = dict(MaxKeys=1000, **base_kwargs)
-        if continuation_token:
-            list_kwargs['ContinuationToken'] = continuation_token
-        response = s3.list_objects_v2(**list_kwargs)
-        yield from response.get('Contents', [])
-        if not response.get('IsTruncated'):  # At the end of the list?
-            break
-        continuation_token = response.get('NextContinuationToken')
-
 def get_folder_list(bucket='socofin-output', key='output-transcribe/FinalTest/'):
-    s3 = boto3.client('s3')
-    data_loc = []
-    for obj in get_all_s3_objects(s3, Bucket=bucket, Prefix=key):
-        names = 's3://{}/{}'.format(bucket, obj['Key'])
-        data_loc.append(names)
-    return data_loc
+    return storage.list_uris(storage.to_uri(bucket, key), workers=storage.LIST_WORKERS)
     
 def get_speaker_label(key='output-transcribe/FinalTest/', bucket='socofin-output'):
     data_loc = get_folder_list(key=key, bucket=bucket)
-    container, channel = [], []
-    for file in data_loc:
-        data = pd.read_json(file)
-        file_name = os.path.basename(file)
-        results = data['results'].get('channel_labels').get('channels')
-        for channel in results:
-            label = channel.get('channel_label')
-            for items in channel.get('items'):
-                inner_container = []
-                inner_container.append(file_name)
-                inner_container.append(items.get('start_time'))
-                inner_container.append(items.get('end_time'))
-                inner_container.append(items.get('alternatives')[0].get('content'))
-                inner_container.append(label)
-                container.append(inner_container)
-    df = pd.DataFrame(container, columns=['file', 'start_time','end_time','content','channel'])
+    # all the files of the folder are fetched and parsed concurrently, broken files are skipped
+    items, errors = load_transcripts(data_loc, channels=True, dtype=np.float64)
+    df = pd.DataFrame({'file': items['file'].astype(object),
+                       'start_time': items['start'],
+                       'end_time': items['end'],
+                       'content': items['content'].astype(object),
+                       'channel': items['channel'].astype(object)})
     
     extra_ch = []
     for file in data_loc:
@@ -58,7 +33,7 @@ def get_speaker_label(key='output-transcribe/FinalTest/', bucket='socofin-output
             ch1 = (file_name, 0.1, 1.5, '', 'ch_1')
             extra_ch.append(ch1)
     extra_df = pd.DataFrame(extra_ch, columns=['file','start_time','end_time','content','channel'])
-    df = df.append(extra_df, ignore_index=True)
+    df = pd.concat([df, extra_df], ignore_index=True)
     df_final = df.dropna()
     return df_final.reset_index(drop=True)
     
@@ -164,15 +139,12 @@ def add_custom_job(content_df,
                     doc_arn='arn:aws:comprehend:us-east-1:661346392611:document-classifier/SocofinTest21', 
                     data_arn= 'arn:aws:iam::661346392611:role/ComprehendExperimentBucketAccessRole'):
 
-    client = boto3.client('comprehend')
-    region = boto3.session.Session().region_name
-    account_id = boto3.client('sts').get_caller_identity().get('Account')
+    client = storage.get_client('comprehend')
 
     # save content_df transcripts into a temp.csv file
     csv_buffer = StringIO()
     content_df['transcript'].to_csv(csv_buffer, index=False, header=False)
-    s3_resource = boto3.resource('s3')
-    s3_resource.Object(bucket, key).put(Body=csv_buffer.getvalue())
+    storage.write_bytes(storage.to_uri(bucket, key), csv_buffer.getvalue())
 
  
     # create job
@@ -193,6 +165,7 @@ def add_custom_job(content_df,
 
     
     
+@metrics.instrument('sentiment')
 def lambda_handler(event, context):
     csv_buffer = StringIO()
     bucket='socofin-output'
@@ -201,16 +174,17 @@ def lambda_handler(event, context):
     yesterday = date.today() - timedelta(days=1)
     yesterday = yesterday.strftime('%Y%m%d') ## <--- Use yesterday to set up a folder cambio a Normal
     #yesterday = '20210108'
-    t0 = time.time()
     
-    speaker_label = get_speaker_label(key=f'output-transcribe/{yesterday}')
-    speaker_label.to_csv(csv_buffer)
-    s3_resource = boto3.resource('s3')
-    s3_resource.Object(bucket, 'output-comprehend/speaker_tmp.csv').put(Body=csv_buffer.getvalue())
+    with metrics.span('speaker_label'):
+        speaker_label = get_speaker_label(key=f'output-transcribe/{yesterday}')
+        speaker_label.to_csv(csv_buffer)
+        storage.write_bytes(storage.to_uri(bucket, 'output-comprehend/speaker_tmp.csv'), csv_buffer.getvalue())
+    metrics.count('rows', len(speaker_label))
     
-    df = get_content(key=f'output-transcribe/{yesterday}', speaker_label=speaker_label)
+    with metrics.span('get_content'):
+        df = get_content(key=f'output-transcribe/{yesterday}', speaker_label=speaker_label)
+    metrics.count('calls', len(df))
     compare = [a != b for a,b in zip(df['bot_file'], df['tr_file'])]
     print("compare: ", np.any(compare))
-    t1= time.time()
-    print("get_content time: ", t1 - t0)
-    add_custom_job(df)
+    with metrics.span('classification_job'):
+        add_custom_job(df)
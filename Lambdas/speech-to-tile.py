@@ -1,63 +1,71 @@
 import json
-import pandas as pd
-from io import StringIO
-import boto3
+import storage
+import metrics
+import wordstore
 import sys, os
 from datetime import date, timedelta
+from urllib.parse import unquote_plus
 
 
-def get_all_s3_objects(s3, **base_kwargs):
-    continuation_token = None
-    while True:
-        list_kwargs = dict(MaxKeys=1000, **base_kwargs)
-        if continuation_token:
-            list_kwargs['ContinuationToken'] = continuation_token
-        response = s3.list_objects_v2(**list_kwargs)
-        yield from response.get('Contents', [])
-        if not response.get('IsTruncated'):  # At the end of the list?
-            break
-        continuation_token = response.get('NextContinuationToken')
-
-def get_data_loc(date, bucket='socofin-output'):
-    prefix=f'output-transcribe/{date}/'
-    s3 = boto3.client('s3')
-    data_loc = []
-    for file in get_all_s3_objects(s3, Bucket=bucket, Prefix=prefix):
-        names = 's3://{}/{}'.format(bucket, file['Key'])
-        data_loc.append(names)
-
-    return data_loc
-
-def process_day(date):
-    data_loc = get_data_loc(date)
-    container = []
-    for file in data_loc:
-        data = pd.read_json(file)
-        my_name = os.path.basename(file)
-        items = data['results'].get('items')
-        for item in items:
-            if item['type'] != 'punctuation':
-                values = item['alternatives'][0]
-                word = (values['confidence'], values['content'], item['start_time'], item['end_time'], my_name)
-        container.append(word)
-    # create dataframes from both sources and join them
-    df = pd.DataFrame(container, columns=['confidence', 'content', 'start_time', 'end_time', 'file'])
-    df.sort_values(by=['confidence'], ascending=True, inplace=True)
-    return df 
-
-def to_file(date):
-    csv_buffer = StringIO()
-    data_frame = process_day(date)
-    data_frame.to_csv(csv_buffer, decimal=',', sep='|', encoding='utf-8')
-    s3_resource = boto3.resource('s3')
-    s3_resource.Object('socofin-output', f'output-sagemaker/TranscribeReports/output_day_{date}.csv').put(Body=csv_buffer.getvalue())
-    
-    return f'Saved as file: output-sagemaker/TranscribeReports/output_day_{date}.csv'
+# The CSV report is still written next to the Parquet dataset for the tools that read it
+EXPORT_CSV = os.environ.get('TILE_EXPORT_CSV', '1') == '1'
+# Rebuild the whole day on scheduled runs instead of merging the new transcripts
+FULL_REBUILD = os.environ.get('TILE_FULL_REBUILD', '0') == '1'
 
 
+def to_file(date, full=FULL_REBUILD):
+    # only the transcripts that arrived since the last run are read, see wordstore.update_day
+    with metrics.span('update_day'):
+        result = wordstore.update_day(date, full=full)
+    metrics.count('rows', result['rows'])
+    metrics.count('files_merged', result['files'])
+    saved = [wordstore.partition_uri(date)]
+    if EXPORT_CSV:
+        with metrics.span('write_report'):
+            saved.append(wordstore.export_csv(date))
+    return f'Saved as files: {", ".join(saved)}'
+
+
+def event_changes(event):
+    """ {date: ({uri: ETag}, [removed uris])} of the transcripts in S3 notifications,
+        direct or wrapped in SNS messages """
+    records = []
+    for record in event.get('Records', []):
+        if 'Sns' in record:
+            records.extend(json.loads(record['Sns']['Message']).get('Records', []))
+        else:
+            records.append(record)
+    changes = {}
+    for record in records:
+        if 's3' not in record:
+            continue
+        key = unquote_plus(record['s3']['object']['key'])
+        folders = key.split('/')
+        if len(folders) < 3 or folders[0] != 'output-transcribe':
+            continue
+        objects, removed = changes.setdefault(folders[1], ({}, []))
+        uri = storage.to_uri(record['s3']['bucket']['name'], key)
+        if record.get('eventName', '').startswith('ObjectRemoved'):
+            removed.append(uri)
+        else:
+            objects[uri] = record['s3']['object'].get('eTag', '')
+    return changes
+
+
+@metrics.instrument('speech-to-tile')
 def lambda_handler(event, context):
+    event = event or {}
+    changes = event_changes(event)
+    if changes:
+        # new transcripts are merged as they arrive, the CSV is exported by the scheduled run
+        for day, (objects, removed) in changes.items():
+            with metrics.span('update_day'):
+                result = wordstore.update_day(day, objects, removed)
+            metrics.count('rows', result['rows'])
+            metrics.count('files_merged', result['files'])
+        return {'days': sorted(changes)}
     yesterday = date.today() - timedelta(days=1)
     yesterday = yesterday.strftime('%Y%m%d')
-    to_file(yesterday)
+    # {"date": "YYYYMMDD"} runs another day, e.g. today for an intra-day report
+    return to_file(event.get('date', yesterday), event.get('full', FULL_REBUILD))
     #to_file('20201210')
-
@@ -0,0 +1,98 @@
+import json
+import os
+from urllib.parse import unquote_plus
+import storage
+import metrics
+import submitter
+import idempotency
+
+# boto3 comes pinned in the dependency layer, the clients are created on the first event
+storage.check_versions()
+
+# A finished job frees a slot, the queued jobs of its profile are submitted right away
+DRAIN_ON_COMPLETION = os.environ.get('TRANSCRIBE_DRAIN_ON_COMPLETION', '1') == '1'
+
+
+def event_jobs(event):
+    ''' Names and statuses of the jobs of an event
+
+    Transcribe job state change events (EventBridge) carry them in 'detail'; S3 notifications of
+    the transcripts, direct or wrapped in SNS, carry the key of the output document, the job name is
+    taken from it (submitter.output_job_name) and the job is COMPLETED, only those jobs write one.
+    Other objects (e.g. the write access check of Transcribe) are skipped.
+
+    :param event: Lambda event
+    :return: list of (job name, status)
+    '''
+    if event.get('source') == 'aws.transcribe':
+        detail = event['detail']
+        return [(detail['TranscriptionJobName'], detail['TranscriptionJobStatus'])]
+    records = []
+    for record in event.get('Records', []):
+        if 'Sns' in record:
+            records.extend(json.loads(record['Sns']['Message']).get('Records', []))
+        else:
+            records.append(record)
+    jobs = []
+    for record in records:
+        if 's3' not in record or not record.get('eventName', 'ObjectCreated').startswith('ObjectCreated'):
+            continue
+        job_name = submitter.output_job_name(record['s3']['bucket']['name'],
+                                             unquote_plus(record['s3']['object']['key']))
+        if job_name:
+            jobs.append((job_name, 'COMPLETED'))
+    return jobs
+
+
+def complete_job(job_name):
+    ''' Downstream work of a finished job: the audio file of the production jobs is copied to the
+    procesados folder
+
+    :param job_name: Name of the transcription job
+    :return: tuple (profile, status of the job), the status is None for a job already handled
+    '''
+    transcribe = storage.get_client('transcribe')
+    job = transcribe.get_transcription_job(TranscriptionJobName=job_name)['TranscriptionJob']
+    status = job['TranscriptionJobStatus']
+    profile = submitter.job_profile(job_name)
+    if status in ('COMPLETED', 'FAILED'):
+        # jobs submitted before the idempotency store have no record (None), they are handled too
+        if idempotency.get_store().finish(job_name, status.lower(), job.get('FailureReason')) is False:
+            return profile, None
+    if status == 'FAILED':
+        print("El job ", job_name, " ha fallado: ", job.get('FailureReason'))
+    elif status == 'COMPLETED':
+        print("La Transcripcion del job ", job_name, " se encuentra en : ",
+              job.get('Transcript', {}).get('TranscriptFileUri'))
+        bucket, key = submitter.media_object(job)
+        target = submitter.processed_uri(profile, bucket, key) if profile else None
+        if target:
+            storage.copy(storage.to_uri(bucket, key), target)
+            print("Se ha movido el archivo a la carpeta procesados.")
+    return profile, status
+
+
+@metrics.instrument('transcription-completed')
+def lambda_handler(event, context):
+    ''' AWS Lambda Handler of the Transcribe job state change events or of the transcripts landing in S3
+
+    '''
+    statuses = {'COMPLETED': 0, 'FAILED': 0}
+    profiles = set()
+    for job_name, status in event_jobs(event or {}):
+        if status not in statuses:
+            continue
+        profile, status = complete_job(job_name)
+        if status in statuses:
+            statuses[status] += 1
+        if profile:
+            profiles.add(profile)
+    for status, count in statuses.items():
+        metrics.count(f'transcriptions_{status.lower()}', count)
+
+    submitted = 0
+    if DRAIN_ON_COMPLETION and profiles:
+        timeout = max(1, context.get_remaining_time_in_millis() / 1000 - 10)
+        for profile in sorted(profiles):
+            submitted += submitter.get_submitter(profile).drain(timeout=timeout)['submitted']
+    return dict(statuses, submitted=submitted)
@@ -1,106 +1,180 @@
 import re
+from array import array
+import numpy as np
 import pandas as pd
-import json
-import sys, os
-import boto3
+import io
+import os
 import logging
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from botocore.exceptions import ClientError
-from pytube import YouTube
-from urllib.parse import urlparse
-import random as rd
 import unidecode as uni
 import Levenshtein as lv
+import storage
+import cache
+import vocabulary
+import uploads
+import ingest
+from transcripts import transcribe2columns
 
 
-def _times(a_string, index):
-    """ create internal function that splits time into 'start' and 'end' times
+# SRT timing line ("00:01:02,500 --> 00:01:04,000") and its VTT variant, where the
+# hours are optional, milliseconds use a dot and cue settings may follow the end time
+_TIMING_RE = re.compile(r'^\s*(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{1,3})\s*-->\s*'
+                        r'(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{1,3})')
+# VTT blocks that carry no caption text
+_VTT_SKIP = ('WEBVTT', 'NOTE', 'STYLE', 'REGION')
+
+
+def _seconds(hours, minutes, seconds, millis):
+    """ Convert the groups of a timing match into seconds """
+    return (int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+            + int(millis) / 10 ** len(millis))
+
+
+def parse_captions(lines):
+    """ Parse SRT/VTT caption lines in a single pass
     
-    :param a_string: String to split
-    :param index: 0 for start 1 for end
-    :return: None if a_string is empty, else returns start or end depending on index
-    """  
-    if a_string == '':
-        return None
+    Blocks without a valid timing line are skipped, multi-line captions are joined with
+    a space and a trailing block without an ending blank line is still returned.
     
-    # split string using re lib
-    splits = re.split(r'[, :]', a_string)
+    :param lines: Iterable of caption lines (str), e.g. an open file
+    :return: Generator of tuples (index, start, end, transcript)
+    """
+    counter = 0
+    index = None
+    start = end = None
+    text = []
+    skip = False
+    for line in lines:
+        line = line.strip().lstrip('\ufeff')
+        if not line:
+            if start is not None:
+                yield index, start, end, ' '.join(text)
+            index, start, end, text, skip = None, None, None, [], False
+            continue
+        if skip:
+            continue
+
+        match = _TIMING_RE.match(line)
+        if match:
+            if start is not None:
+                # missing blank line between blocks, the last text line may be the next index
+                next_index = text.pop() if text and text[-1].isdigit() else None
+                yield index, start, end, ' '.join(text)
+                index, text = next_index, []
+            counter += 1
+            index = int(index) if index is not None and index.isdigit() else counter
+            groups = match.groups()
+            start = _seconds(*groups[:4])
+            end = _seconds(*groups[4:])
+        elif start is not None:
+            text.append(line)
+        elif line.startswith(_VTT_SKIP):
+            skip = True
+        else:
+            # cue identifier (SRT index or VTT id), stray text is overwritten
+            index = line
 
-    # cast to int each split
-    splits = [int(a_split) for index, a_split in enumerate(splits) if index != 4]
+    if start is not None:
+        yield index, start, end, ' '.join(text)
 
-    # calculate second start and end
-    if index == 0:
-        t = splits[0] * 3600 + splits[1] * 60 + splits[2] + splits[3]/1000
-    elif index == 1:
-        t = splits[4] * 3600 + splits[5] * 60 + splits[6] + splits[7]/1000
+
+def _caption_lines(filepath, aws_path=True):
+    """ Stream the lines of a caption file without reading it whole into memory
+    
+    :param filepath: Path to the caption file
+    :param aws_path: Shift to local file or AWS S3 file
+    :return: Generator of lines (str)
+    """
+    if aws_path:
+        yield from storage.iter_lines(filepath)
     else:
-        t = -1
+        with open(filepath, encoding='utf8') as f:
+            yield from f
 
-    return t
 
-def youtube2df(filepath, aws_path=True):
+def iter_captions(filepath, aws_path=True):
+    """ Generator mode of youtube2df, yields one caption block at a time
+    
+    :param filepath: Path to YouTube caption file (SRT or VTT)
+    :param aws_path: Shift to local file or AWS S3 file
+    :return: Generator of tuples (index, start, end, transcript)
+    """
+    return parse_captions(_caption_lines(filepath, aws_path))
+
+
+def _captions_frame(index, start, end, transcript):
+    """ Build the youtube2df DataFrame from columnar arrays """
+    return pd.DataFrame({'orig_index': np.frombuffer(index, dtype=np.int64),
+                         'start': np.frombuffer(start, dtype=np.float64),
+                         'end': np.frombuffer(end, dtype=np.float64),
+                         'transcript': pd.array(transcript, dtype='string')})
+
+
+def _iter_caption_frames(captions, chunksize):
+    """ Group caption tuples into DataFrames of chunksize rows """
+    columns = (array('q'), array('d'), array('d'), [])
+    for caption in captions:
+        for column, value in zip(columns, caption):
+            column.append(value)
+        if len(columns[3]) == chunksize:
+            yield _captions_frame(*columns)
+            columns = (array('q'), array('d'), array('d'), [])
+    if columns[3]:
+        yield _captions_frame(*columns)
+
+
+def _read_captions(captions):
+    """ Collect caption tuples into the youtube2df DataFrame """
+    index, start, end, transcript = array('q'), array('d'), array('d'), []
+    for i, s, e, t in captions:
+        index.append(i)
+        start.append(s)
+        end.append(e)
+        transcript.append(t)
+    return _captions_frame(index, start, end, transcript)
+
+
+def youtube2df(filepath, aws_path=True, chunksize=None, cached=True):
     """ Transform YouTube caption format to pandas DataFrame
     
+    The file is read as a stream and parsed once into typed columns (SRT or VTT).
+    
     :param filepath: Path to YouTube caption file
     :param aws_path: Shift to local file or AWS S3 file
+    :param chunksize: If given, return a generator of DataFrames with chunksize rows
+    :param cached: Serve S3 files and their parsed form from the local cache (see cache.py)
     
     :return: pandas DataFrame with columns 'orig_index', 'start', 'end', 'transcript'
     """
-    if aws_path:
-        fpath = urlparse(filepath)
-        bucket = fpath.netloc
-        key = fpath.path.lstrip('/')
-        s3 = boto3.resource('s3')
-        obj = s3.Object(bucket, key)
-        file = obj.get()['Body'].read().decode('utf8')
-    else:
-        # read the file
-        with open(filepath) as f:
-            file = f.read()
-
-    # split the file
-    lines = file.splitlines()
-    # compress into tuples of three, ignoring 4th
-    # tuples = [index, time, transcript]
-    #if _times(lines[i], 0)
-    tps = [(lines[i], _times(lines[i + 1], 0), _times(lines[i + 1], 1), lines[i + 2]) for i in range(0, len(lines), 4) 
-           if i + 2 < len(lines) and (_times(lines[i + 1], 0) is not None)]
-    
-    # convert to dataframe
-    _df = pd.DataFrame(tps, columns=['orig_index', 'start', 'end', 'transcript'])
-
-    return _df
+    if chunksize:
+        return _iter_caption_frames(iter_captions(filepath, aws_path), chunksize)
+    if aws_path and cached:
+        return cache.read_parsed(filepath, lambda stream: _read_captions(
+            parse_captions(io.TextIOWrapper(stream, encoding='utf8'))), 'youtube2df')
+    return _read_captions(iter_captions(filepath, aws_path))
 
 # AWS function with filepath to json function
-def aws2df(filepath, aws_path=True):
+def aws2df(filepath, aws_path=True, cached=False):
     ''' Transform AWS Transcribe (json) to pandas DataFrame
     
+    The file is streamed through transcripts.transcribe2columns, items without start time
+    (punctuation) are dropped.
+    
     :param filepath: Path to AWS Transcribe file
     :param aws_path: Shift to local file or AWS S3 file
+    :param cached: Serve S3 files and their parsed form from the local cache (see cache.py), which
+                   reads the whole object in memory; by default S3 files are streamed
     
     :return: pandas DataFrame with columns 'start', 'end', 'transcript'
     '''
-    if aws_path:
-        # Read the file from AWS S3 Bucket
-        data = pd.read_json(filepath)
-    else:
-        # Read the file from local filesystem
-        with open(filepath) as f:
-            data = json.load(f)
-            
-    # compress into tuples
-    tuples = []
-    for value in data['results']['items']:
-        if value.get('start_time'): 
-            tuples.append((value.get('start_time'),
-                           value.get('end_time'),
-                           value['alternatives'][0].get('content')
-                           ))
-
-    # transform to df
-    _df = pd.DataFrame(tuples, columns=['start', 'end', 'transcript'])
-
-    return _df.astype({'start':'float', 'end':'float', 'transcript':'string'})
+    items = transcribe2columns(filepath, aws_path=aws_path, dtype=np.float64, cached=cached)
+    items = items[items['start'].notna()]
+
+    return pd.DataFrame({'start': items['start'].to_numpy(),
+                         'end': items['end'].to_numpy(),
+                         'transcript': pd.array(items['content'].to_numpy(dtype=object), dtype='string')})
 
 def upload_yt_file(file_name, bucket='awstranscribe-tests', object_name=None):
     """ Upload YouTube file to an S3 bucket
@@ -108,7 +182,7 @@ def upload_yt_file(file_name, bucket='awstranscribe-tests', object_name=None):
     :param file_name: File to upload
     :param bucket: Bucket to upload to, defaults to transcribe job trigger S3
     :param object_name: S3 Object name, will default to key /exampleRecords/youtubeVideos/<file_name>
-    :return True if file was uploaded, else False
+    :return True if file was uploaded (or was already there), else False
     """
     # Get file_name name from OS path
     fname = os.path.basename(file_name)
@@ -117,82 +191,49 @@ def upload_yt_file(file_name, bucket='awstranscribe-tests', object_name=None):
     if object_name is None:
         object_name = f'exampleRecords/youtubeVideos/{fname}'
         
-    s3_client = boto3.client('s3')
     try:
-        response = s3_client.upload_file(file_name, bucket, object_name)
+        uploads.upload(file_name, storage.to_uri(bucket, object_name))
     except ClientError as e:
         logging.error(e)
         return False
     return True
 
-### TODO: Move to adaptaros.py and standarice this code.
-def get_all_s3_objects(s3, **base_kwargs):
-    """ Amplify the limit of AWS results to 1000+
-    
-    :param s3: Bucket to amplify the result limit
-    :return: None
-    """
-    continuation_token = None
-    while True:
-        list_kwargs = dict(MaxKeys=1000, **base_kwargs)
-        if continuation_token:
-            list_kwargs['ContinuationToken'] = continuation_token
-        response = s3.list_objects_v2(**list_kwargs)
-        yield from response.get('Contents', [])
-        if not response.get('IsTruncated'):  # At the end of the list?
-            break
-        continuation_token = response.get('NextContinuationToken')
-
-def get_folder_list(bucket='awstranscribe-tests', key='transcribeOutputs/Files'):
+def get_folder_list(bucket='awstranscribe-tests', key='transcribeOutputs/Files', manifest_uri=None):
     """ Get the name of the files inside an AWS S3 Bucket
     
     :param bucket: AWS S3 bucket name
     :param key: directory and name in bucket, defaults to transcribeOutputs/Files
+    :param manifest_uri: Listing manifest of the previous call, when given only the objects new or
+                         changed since then are returned (see storage.list_changes)
     :return: List with the name of each object in the S3 key
     """
     ###
     #  Get the name of the files in a bucket. While bucket is the AWS S3 Bucket and key is the folder inside that bucket
     # it defaults to transcribeOutputs/Files
     ###
-    s3 = boto3.client('s3')
-    data_loc = []
-    for obj in get_all_s3_objects(s3, Bucket=bucket, Prefix=key):
-        names = 's3://{}/{}'.format(bucket, obj['Key'])
-        data_loc.append(names)
-    return data_loc
-
-def vocabulary_shuffle(vocab_name='IPA_Shuffle', words=10):
-    ''' Create a random vocabulary of 'words' number of words from big_ass_dictionary.txt
+    if manifest_uri:
+        return storage.list_changes(storage.to_uri(bucket, key), manifest_uri)[0]
+    return storage.list_uris(storage.to_uri(bucket, key), workers=storage.LIST_WORKERS)
+
+def vocabulary_shuffle(vocab_name='IPA_Shuffle', words=10, weights=None, seed=None):
+    ''' Create a random vocabulary of 'words' distinct words from big_ass_dictionary.txt
     
     :param vocab_name: Vocabulary Name, defaults to IPA_Shuffle
     :param words: Number of words from big_ass_dictionary
+    :param weights: Optional weight of every word of the dictionary, see vocabulary.VocabularySampler
+    :param seed: Seed of the draw, fixed seeds give the same vocabulary
     '''
-    # Declare transcribe client
-    client = boto3.client('transcribe')
+    # Shared transcribe client
+    client = storage.get_client('transcribe')
     
     # Lists vocabularies if vocab_name exists
     response = client.list_vocabularies(
         StateEquals='READY',
         NameContains=vocab_name
         )
-    # Create a random vocabulary from big_ass_dictionary.txt
-    filepath = 's3://awstranscribe-tests/customVocabIPA/big_ass_dictionary.txt'
-    fpath = urlparse(filepath)
-    bucket = fpath.netloc
-    key = fpath.path.lstrip('/')
-    s3 = boto3.resource('s3')
-    obj = s3.Object(bucket, key)
-    file = obj.get()['Body'].read().decode('utf8')
-
-    file = file.splitlines()
-
-    n = words
-    with open(f'/tmp/{vocab_name}.txt', 'w') as f:    
-        f.write(file[0])
-        f.write("\n")
-        for i in range(n):
-            f.write(rd.choice(file))
-            f.write("\n")
+    # Create a random vocabulary from big_ass_dictionary.txt, the dictionary is downloaded and indexed once
+    sampler = vocabulary.get_sampler(vocabulary.DICTIONARY_URI)
+    sampler.write(f'/tmp/{vocab_name}.txt', sampler.sample(words, weights=weights, seed=seed))
         
     # Upload file to S3
     upload_yt_file(f'/tmp/{vocab_name}.txt', object_name=f'customVocabIPA/{vocab_name}.txt')
@@ -213,36 +254,271 @@ def vocabulary_shuffle(vocab_name='IPA_Shuffle', words=10):
         )
         return print(f'Creating Vocab: {vocab_name}\n {vocab}')
     
-def neutralize(a_string):
+# Normalization profiles used by neutralize, 'default' is the historical behaviour and
+# 'notebook' the lighter variant of transcribeTests.ipynb (no tag or parenthesis removal)
+NORMALIZATION_PROFILES = {
+    'default': {'ascii': True, 'strip_chars': '?!@#$.,/', 'strip_tags': True,
+                'strip_parenthetical': True, 'collapse_spaces': False, 'lower': True},
+    'notebook': {'ascii': True, 'strip_chars': '?!@#$.,', 'strip_tags': False,
+                 'strip_parenthetical': False, 'collapse_spaces': False, 'lower': True},
+}
+# Max number of raw strings cached per profile
+NEUTRALIZE_CACHE_SIZE = 2 ** 16
+
+_TAG_RE = re.compile('<.*?>')
+_SPACES_RE = re.compile(r'\s+')
+_normalizers = {}
+
+
+def _strip_parenthetical(a_string):
+    r""" re.sub(r'.*?\((.*?)\)', '', a_string) in linear time: the matches of a line are contiguous
+        from its start, so only the text after the last closed parenthesis is kept. The regex
+        retries every position of a long line without parentheses (quadratic). """
+    lines = []
+    for line in a_string.split('\n'):
+        position = 0
+        while True:
+            start = line.find('(', position)
+            end = line.find(')', start + 1) if start != -1 else -1
+            if end == -1:
+                break
+            position = end + 1
+        lines.append(line[position:])
+    return '\n'.join(lines)
+
+
+def register_profile(name, **options):
+    ''' Add or replace a normalization profile, missing options are taken from 'default'
+    
+    :param name: Profile name
+    :param options: Any of the keys of NORMALIZATION_PROFILES['default']
+    '''
+    profile = dict(NORMALIZATION_PROFILES['default'])
+    profile.update(options)
+    NORMALIZATION_PROFILES[name] = profile
+    _normalizers.pop(name, None)
+
+
+def _normalizer(profile='default'):
+    """ Compiled and LRU cached normalization function of a profile """
+    if profile in _normalizers:
+        return _normalizers[profile]
+
+    options = NORMALIZATION_PROFILES[profile]
+    table = str.maketrans('', '', options['strip_chars'])
+    steps = []
+    if options['strip_tags']:
+        steps.append(lambda a_string: _TAG_RE.sub('', a_string))
+    if options['strip_parenthetical']:
+        steps.append(_strip_parenthetical)
+    if options['collapse_spaces']:
+        steps.append(lambda a_string: _SPACES_RE.sub(' ', a_string).strip())
+    if options['lower']:
+        steps.append(str.lower)
+
+    @lru_cache(maxsize=NEUTRALIZE_CACHE_SIZE)
+    def normalize(a_string):
+        if options['ascii'] and not a_string.isascii():
+            a_string = uni.unidecode(a_string)
+        a_string = a_string.translate(table)
+        for step in steps:
+            a_string = step(a_string)
+        return a_string
+
+    _normalizers[profile] = normalize
+    return normalize
+
+
+def neutralize(a_string, profile='default'):
     ''' Neutralize a string, removing unnecesary characters
     
     :param a_string: the string to neutralize
+    :param profile: name of a NORMALIZATION_PROFILES entry, defaults to 'default'
     :return: a_string without unnecesary characters like tildes and HTML annotations
     '''
-    a_string = uni.unidecode(a_string)
-    a_string = re.sub('[?!@#$.,/]', '', a_string)
-    clean = re.compile('<.*?>')
-    a_string = re.sub(clean, '', a_string)
-    clean = re.compile(".*?\((.*?)\)")
-    a_string = re.sub(clean, '', a_string)
-    return a_string.lower()
-
-def compress(df_reference, df_to_modify, field='transcript'):
+    return _normalizer(profile)(a_string)
+
+
+def neutralize_series(a_series, profile='default'):
+    ''' Neutralize a whole series, each distinct value is normalized only once
+    
+    :param a_series: A series, array or list of strings, missing values become ''
+    :param profile: name of a NORMALIZATION_PROFILES entry, defaults to 'default'
+    :return: Series (same index as a_series when it is a Series) of neutralized strings
+    '''
+    normalize = _normalizer(profile)
+    codes, uniques = pd.factorize(pd.Series(a_series, dtype=object).fillna('').astype(str))
+    normalized = np.array([normalize(a_string) for a_string in uniques], dtype=object)
+    index = a_series.index if isinstance(a_series, pd.Series) else None
+    return pd.Series(normalized[codes], index=index, dtype=object)
+
+
+def neutralize_cache_info(profile='default'):
+    ''' Hits, misses and size of the neutralize cache of a profile '''
+    return _normalizer(profile).cache_info()
+
+# Policies to assign a word (start, end) to a caption window (start, end):
+# 'contained' the word lies fully inside the window,
+# 'overlap' the window that overlaps the word the most (ties go to the earliest one),
+# 'midpoint' the earliest window that contains the middle of the word
+JOIN_POLICIES = ('contained', 'overlap', 'midpoint')
+
+
+def _ranges(lo, hi):
+    """ Vectorized concatenation of range(lo[i], hi[i]) for every i
+    
+    :return: (owner, values) arrays, owner[j] is the i that produced values[j]
+    """
+    counts = np.maximum(hi - lo, 0)
+    owner = np.repeat(np.arange(len(lo)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(lo, counts) + offsets
+
+
+def _join_pairs(ref, word_start, word_end, policy):
+    """ Match words against the sorted reference windows
+    
+    :param ref: Tuple (order, start, end) of the reference windows sorted by start
+    :param word_start: Word start times sorted ascending
+    :param word_end: Word end times, in the same order as word_start
+    :return: (ref_pos, word_pos) arrays with one pair per assigned word
+    """
+    _, ref_start, ref_end = ref
+    if policy == 'contained':
+        lo = np.searchsorted(word_start, ref_start, 'left')
+        hi = np.searchsorted(word_start, ref_end, 'right')
+        ref_pos, word_pos = _ranges(lo, hi)
+        keep = word_end[word_pos] <= ref_end[ref_pos]
+        return ref_pos[keep], word_pos[keep]
+
+    if policy == 'midpoint':
+        word_start = word_end = (word_start + word_end) / 2
+    # candidate windows start before the word ends and (running max) end after it starts
+    lo = np.searchsorted(np.maximum.accumulate(ref_end), word_start, 'left')
+    hi = np.searchsorted(ref_start, word_end, 'right')
+    word_pos, ref_pos = _ranges(lo, hi)
+    w_start, w_end = word_start[word_pos], word_end[word_pos]
+    r_start, r_end = ref_start[ref_pos], ref_end[ref_pos]
+    overlap = np.minimum(w_end, r_end) - np.maximum(w_start, r_start)
+    inside = (w_start >= r_start) & (w_end <= r_end)
+    keep = (overlap > 0) | inside
+    word_pos, ref_pos, overlap = word_pos[keep], ref_pos[keep], overlap[keep]
+    if policy == 'midpoint':
+        overlap = np.zeros(len(overlap))
+    # best window per word: largest overlap, then earliest start
+    best = np.lexsort((ref_pos, -overlap, word_pos))
+    word_pos, ref_pos = word_pos[best], ref_pos[best]
+    first = np.ones(len(word_pos), dtype=bool)
+    first[1:] = word_pos[1:] != word_pos[:-1]
+    return ref_pos[first], word_pos[first]
+
+
+def _join_frame(ref, df_to_modify, field, policy):
+    """ Join the words of one hypothesis DataFrame into the reference windows """
+    order = ref[0]
+    phrases = [''] * len(order)
+    word_order = np.argsort(df_to_modify['start'].to_numpy(dtype=np.float64), kind='stable')
+    word_start = df_to_modify['start'].to_numpy(dtype=np.float64)[word_order]
+    word_end = df_to_modify['end'].to_numpy(dtype=np.float64)[word_order]
+    words = df_to_modify[field].fillna('').to_numpy(dtype=object)[word_order]
+
+    ref_pos, word_pos = _join_pairs(ref, word_start, word_end, policy)
+    # group by reference window keeping the words in time order
+    by_ref = np.lexsort((word_pos, ref_pos))
+    ref_pos, word_pos = ref_pos[by_ref], word_pos[by_ref]
+    bounds = np.flatnonzero(np.diff(ref_pos)) + 1
+    for group in np.split(np.arange(len(ref_pos)), bounds):
+        if len(group):
+            phrases[order[ref_pos[group[0]]]] = ' '.join(words[word_pos[group]])
+    return phrases
+
+
+def interval_join(df_reference, frames, field='transcript', policy='contained'):
+    ''' Join the words of one or several DataFrames into the windows of df_reference.
+        Every DataFrame must have start and end columns, both sides are sorted once.
+        
+    :param df_reference: reference DataFrame that contains the "real transcription"
+    :param frames: DataFrame, list of DataFrames or dict {column name: DataFrame}
+    :param field: column of the words to join
+    :param policy: one of JOIN_POLICIES, defaults to 'contained'
+    :return: DataFrame with the index of df_reference and one phrase column per frame
+    '''
+    if policy not in JOIN_POLICIES:
+        raise ValueError(f'Unknown policy {policy}, use one of {JOIN_POLICIES}')
+    if isinstance(frames, pd.DataFrame):
+        frames = {field: frames}
+    elif not isinstance(frames, dict):
+        frames = {f'{field}_{i}': frame for i, frame in enumerate(frames)}
+
+    ref_start = df_reference['start'].to_numpy(dtype=np.float64)
+    order = np.argsort(ref_start, kind='stable')
+    ref = (order, ref_start[order], df_reference['end'].to_numpy(dtype=np.float64)[order])
+
+    joined = {name: _join_frame(ref, frame, field, policy) for name, frame in frames.items()}
+    return pd.DataFrame(joined, index=df_reference.index)
+
+
+def compress(df_reference, df_to_modify, field='transcript', policy='contained'):
     ''' Compreses separate words into phrase using start and end time notations.
         The df_reference and df_to_modify must have start and end columns
         
     :param df_reference: reference DataFrame that contains the "real transcription"
     :param df_to_modify: DataFrame that needs to be compressed into phrases
+    :param policy: one of JOIN_POLICIES, defaults to 'contained'
     :return: The phrase with space between strings
     '''
-    container = []
-    for start, end in zip(df_reference['start'], df_reference['end']):
-        sub_df = df_to_modify[(df_to_modify['start'] >= start) & (df_to_modify['end'] <= end)]
-        
-        words = [a_word for a_word in sub_df[field]]
-        container.append(' '.join(word for word in words))
-        
-    return container
+    return interval_join(df_reference, {field: df_to_modify}, field=field, policy=policy)[field].tolist()
+
+def _as_strings(a_series):
+    """ Object array of strings from a Series, array or single string, missing values as '' """
+    if isinstance(a_series, str):
+        a_series = [a_series]
+    return pd.Series(a_series, dtype=object).fillna('').astype(str).to_numpy(dtype=object)
+
+
+def _lv_distances(pairs):
+    """ Levenshtein distances of a chunk of (a_string, b_string) pairs, runs in the process pool """
+    return [lv.distance(a_string, b_string) for a_string, b_string in pairs]
+
+
+def lv_scores(a_series, b_series, workers=None, chunksize=20000, parallel_threshold=100000,
+              profile='default'):
+    ''' Batch Levenshtein score between two series of strings
+    
+    Every distinct string is neutralized once and every distinct pair is scored once, large
+    batches are split in chunks over a process pool.
+    
+    :param a_series: A series, array or string
+    :param b_series: A series, array or string
+    :param workers: Number of processes, defaults to the CPU count, 1 disables the pool
+    :param chunksize: Pairs per task sent to the pool
+    :param parallel_threshold: Minimum number of distinct pairs to use the pool
+    :param profile: normalization profile passed to neutralize
+    :return: tuple (scores, distances) of NumPy arrays, scores are 1 - distance / longest length
+    '''
+    a_values, b_values = _as_strings(a_series), _as_strings(b_series)
+    n = min(len(a_values), len(b_values))
+    codes, uniques = pd.factorize(np.concatenate([a_values[:n], b_values[:n]]))
+    normalized = neutralize_series(uniques, profile).to_numpy()
+    lengths = np.fromiter((len(a_string) for a_string in normalized), dtype=np.int64, count=len(normalized))
+
+    # score each distinct (a, b) pair once
+    pair_codes, pair_index = np.unique(codes[:n] * len(uniques) + codes[n:], return_inverse=True)
+    a_codes, b_codes = np.divmod(pair_codes, max(len(uniques), 1))
+    pairs = list(zip(normalized[a_codes], normalized[b_codes]))
+    if workers != 1 and len(pairs) >= parallel_threshold:
+        chunks = [pairs[i:i + chunksize] for i in range(0, len(pairs), chunksize)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            distances = [d for chunk in pool.map(_lv_distances, chunks) for d in chunk]
+    else:
+        distances = _lv_distances(pairs)
+
+    distances = np.asarray(distances, dtype=np.int64)[pair_index.ravel()]
+    length = np.maximum(lengths[codes[:n]], lengths[codes[n:]])
+    # two empty strings are identical
+    scores = 1 - np.divide(distances, length, out=np.zeros(n), where=length > 0)
+    return scores, distances
+
 
 def lv_score(a_series, b_series):
     ''' Generate Levenshtein score based on the Levenshtein distance between two strings
@@ -251,19 +527,7 @@ def lv_score(a_series, b_series):
     :param b_series: A series or string
     :return: Levenshtein score between two strings
     '''
-    metric = 0
-    m_list = []
-    for a_string, b_string in zip(a_series, b_series):
-        a_string = neutralize(a_string)
-        b_string = neutralize(b_string)
-        if len(a_string) >= len(b_string):
-            length = len(a_string)
-        else:
-            length = len(b_string)
-        metric = lv.distance(a_string, b_string) / length
-        m_list.append(1 - metric)
-        
-    return m_list
+    return lv_scores(a_series, b_series)[0].tolist()
 
 def average(lst):
     ''' Average of a list
@@ -274,35 +538,13 @@ def average(lst):
     return sum(lst) / len(lst)
 
 
-def youtube2aws(url):
+def youtube2aws(url, **kwargs):
     ''' Convert YouYubue videos to mp4, exctracts spanish translate if exists
     
+    The video and its es-419 caption are uploaded through the ingestion pipeline, see
+    ingest.ingest for the options and for whole playlists.
+    
     :param url: Link to the video to uplaod
-    :return: Nothing
+    :return: Ingestion report of the video, see ingest.ingest
     '''
-    yt = YouTube(url)
-    # Get the tittle and replace spaces with underscore
-    yt_title = yt.title.replace(' ', '_')
-    yt_title = unicodedata.normalize('NFKD', yt_title).encode('ASCII', 'ignore').decode('utf-8')
-    yt_title = re.sub('\+', '', yt_title)
-    
-    # Download the video to tmp folder and save the output name to file_name
-    file_name = yt.streams.first().download(output_path="/tmp" ,filename=yt_title)
-    
-    upload_yt_file(file_name)
-    
-    if yt.captions.get_by_language_code('es-419'):
-        code = 'es-419'
-        caption = yt.captions.get_by_language_code('es-419')
-        yt_caption = caption.generate_srt_captions()
-        yt_title = yt.title.replace(' ', '_')
-        yt_title = unicodedata.normalize('NFKD', yt_title).encode('ASCII', 'ignore').decode('utf-8')
-        yt_title = re.sub('\+', '', yt_title)
-        with open(f'/tmp/{yt_title}_{code}.txt', 'a') as f:
-            f.write(yt_caption)
-        upload_yt_file(f'/tmp/{yt_title}_{code}.txt', object_name=f'levenshteinTests/ytCaptions/{yt_title}.txt')
-    else:
-        print('This caption doesn\'t exist for this video: ', yt.title)
-        print('You can use one of the following captions: \n', yt.captions.all())
-        
-    
\ No newline at end of file
+    return ingest.ingest([url], **kwargs)['videos'][0]
@@ -0,0 +1,218 @@
+from bisect import bisect_left
+import numpy as np
+import pandas as pd
+import Levenshtein as lv
+from adaptors import neutralize, neutralize_series
+
+
+# Words of the n-grams used as anchors, they must be unique on both sides (or within the
+# time tolerance when timestamps are given)
+ANCHOR_NGRAM = 3
+# Half width of the band of the gap alignment, in words off the gap diagonal
+BAND = 50
+# Transcripts up to this many DP cells (words x words) are aligned exactly, without anchors; the
+# full matrix of the C opcodes takes about 8 bytes per cell
+EXACT_CELLS = 4000000
+# Gaps up to this many DP cells are aligned exactly by the C opcodes of Levenshtein
+SMALL_GAP_CELLS = 10000
+# Seconds between the timestamps of matched anchor words
+TIME_TOLERANCE = 5.0
+
+
+def words_from_frame(frame, field='transcript', profile='default'):
+    ''' Words and start times of an aws2df or youtube2df DataFrame
+
+    aws2df rows are single words, youtube2df rows are caption windows whose words are spread
+    evenly over [start, end].
+
+    :param frame: DataFrame with start, end and field columns
+    :param field: column of the text
+    :param profile: normalization profile passed to neutralize
+    :return: tuple (list of words, NumPy array of start times)
+    '''
+    texts = neutralize_series(frame[field], profile).str.split()
+    counts = texts.str.len().to_numpy()
+    start = np.repeat(frame['start'].to_numpy(dtype=np.float64), counts)
+    end = np.repeat(frame['end'].to_numpy(dtype=np.float64), counts)
+    position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    times = start + (end - start) * position / np.repeat(np.maximum(counts, 1), counts)
+    return [word for words in texts for word in words], times
+
+
+def _words(text, profile):
+    if isinstance(text, str):
+        return neutralize(text, profile).split()
+    return list(text)
+
+
+def _anchor_pairs(a, b, a_times, b_times, ngram, tolerance):
+    """ (i, j) word pairs of the n-grams of a and b that match without ambiguity """
+    def occurrences(codes):
+        grams = {}
+        for k in range(len(codes) - ngram + 1):
+            grams.setdefault(tuple(codes[k:k + ngram]), []).append(k)
+        return grams
+
+    a_grams, b_grams = occurrences(a), occurrences(b)
+    pairs = []
+    for gram, a_positions in a_grams.items():
+        b_positions = b_grams.get(gram)
+        if b_positions is None:
+            continue
+        if a_times is None:
+            if len(a_positions) == 1 and len(b_positions) == 1:
+                pairs.append((a_positions[0], b_positions[0]))
+            continue
+        # with timestamps the n-gram only needs to be unique within the time tolerance
+        b_positions = sorted(b_positions, key=lambda j: b_times[j])
+        b_start = b_times[b_positions]
+        for i in a_positions:
+            lo = np.searchsorted(b_start, a_times[i] - tolerance, 'left')
+            hi = np.searchsorted(b_start, a_times[i] + tolerance, 'right')
+            if hi - lo == 1:
+                pairs.append((i, b_positions[lo]))
+    return sorted({(i + k, j + k) for i, j in pairs for k in range(ngram)})
+
+
+def _monotonic(pairs):
+    """ Longest chain of pairs increasing on both sides (longest increasing subsequence) """
+    # pairs are sorted by i, ties by j descending so a single i is used at most once
+    pairs = sorted(pairs, key=lambda pair: (pair[0], -pair[1]))
+    tails, tail_index, previous = [], [], [-1] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        position = bisect_left(tails, j)
+        if position == len(tails):
+            tails.append(j)
+            tail_index.append(k)
+        else:
+            tails[position] = j
+            tail_index[position] = k
+        previous[k] = tail_index[position - 1] if position else -1
+    chain, k = [], tail_index[-1] if tail_index else -1
+    while k >= 0:
+        chain.append(pairs[k])
+        k = previous[k]
+    return chain[::-1]
+
+
+def _chars(codes):
+    """ Word codes as a string, one character per word (surrogates are skipped) """
+    return ''.join(map(chr, np.where(codes < 0xD800, codes, codes + 0x800).tolist()))
+
+
+def _exact(a, b):
+    """ Edit distance and operations of a short gap """
+    ops = []
+    for tag, i0, i1, j0, j1 in lv.opcodes(_chars(a), _chars(b)):
+        if tag in ('equal', 'replace'):
+            ops += [(tag, i, j) for i, j in zip(range(i0, i1), range(j0, j1))]
+        elif tag == 'delete':
+            ops += [(tag, i, None) for i in range(i0, i1)]
+        else:
+            ops += [(tag, None, j) for j in range(j0, j1)]
+    return sum(op != 'equal' for op, _, _ in ops), ops
+
+
+def _banded(a, b, band):
+    """ Edit distance and operations of a gap, only cells within band words of the diagonal
+        are computed (the exact distance whenever the optimal path stays in the band) """
+    n, m = len(a), len(b)
+    if n == 0 or m == 0:
+        return max(n, m), [('insert', None, j) for j in range(m)] + [('delete', i, None) for i in range(n)]
+    if n * m <= SMALL_GAP_CELLS:
+        return _exact(a, b)
+    width = band + -(-m // n)
+    infinity = n + m + 1
+    rows, lows = [np.arange(min(m, width) + 1, dtype=np.int64)], [0]
+    for i in range(1, n + 1):
+        low = max(0, i * m // n - width)
+        high = min(m, -(-i * m // n) + width)
+        columns = np.arange(low, high + 1)
+        previous, previous_low = rows[-1], lows[-1]
+
+        def above(cols):
+            values = np.full(len(cols), infinity, dtype=np.int64)
+            inside = (cols >= previous_low) & (cols < previous_low + len(previous))
+            values[inside] = previous[cols[inside] - previous_low]
+            return values
+
+        cost = np.ones(len(columns), dtype=np.int64)
+        cost[columns > 0] = a[i - 1] != b[columns[columns > 0] - 1]
+        best = np.minimum(above(columns) + 1, above(columns - 1) + cost)
+        if low == 0:
+            best[0] = i
+        steps = np.arange(len(columns))
+        rows.append((steps + np.minimum.accumulate(best - steps)).astype(np.int32))
+        lows.append(low)
+
+    def cell(i, j):
+        j -= lows[i]
+        return rows[i][j] if 0 <= j < len(rows[i]) else infinity
+
+    ops, i, j = [], n, m
+    while i > 0 or j > 0:
+        value = cell(i, j)
+        if i > 0 and j > 0 and cell(i - 1, j - 1) + (a[i - 1] != b[j - 1]) == value:
+            ops.append(('equal' if a[i - 1] == b[j - 1] else 'replace', i - 1, j - 1))
+            i, j = i - 1, j - 1
+        elif i > 0 and cell(i - 1, j) + 1 == value:
+            ops.append(('delete', i - 1, None))
+            i -= 1
+        else:
+            ops.append(('insert', None, j - 1))
+            j -= 1
+    return int(rows[n][m - lows[n]]), ops[::-1]
+
+
+def align(reference, hypothesis, ref_times=None, hyp_times=None, ngram=ANCHOR_NGRAM, band=BAND,
+          time_tolerance=TIME_TOLERANCE, profile='default', exact=None):
+    ''' Word alignment of two long transcripts (e.g. a whole call or video)
+
+    Unambiguous n-grams (and timestamps when given) anchor both documents, only the gaps between
+    anchors are aligned with a banded edit distance: time grows with words x band and memory with
+    the longest gap x band. The distance is then an upper bound of the edit distance, equal to it
+    when the optimal alignment goes through every anchor and stays in the band of every gap.
+    Transcripts up to EXACT_CELLS are aligned exactly.
+
+    :param reference: Reference text or list of words (see words_from_frame)
+    :param hypothesis: Transcribed text or list of words
+    :param ref_times: Optional start time of every reference word
+    :param hyp_times: Optional start time of every hypothesis word
+    :param ngram: Words of the anchor n-grams
+    :param band: Half width of the band of the gap alignment
+    :param time_tolerance: Seconds between the timestamps of matched anchors
+    :param profile: normalization profile passed to neutralize (texts only)
+    :param exact: True for the exact edit distance whatever the length (memory grows with words x
+                  words), False for the anchored one, None picks it with EXACT_CELLS
+    :return: tuple (distance, DataFrame with columns 'op' ('equal', 'replace', 'insert', 'delete'),
+             'ref', 'hyp' (word positions, -1 when missing), 'ref_word', 'hyp_word')
+    '''
+    ref_words, hyp_words = _words(reference, profile), _words(hypothesis, profile)
+    vocabulary = {}
+    a = np.array([vocabulary.setdefault(word, len(vocabulary)) for word in ref_words], dtype=np.int64)
+    b = np.array([vocabulary.setdefault(word, len(vocabulary)) for word in hyp_words], dtype=np.int64)
+    if ref_times is None or hyp_times is None:
+        ref_times = hyp_times = None
+    else:
+        ref_times, hyp_times = np.asarray(ref_times, dtype=np.float64), np.asarray(hyp_times, dtype=np.float64)
+
+    if exact is None:
+        exact = len(a) * len(b) <= EXACT_CELLS
+    anchors = [] if exact else _monotonic(_anchor_pairs(a, b, ref_times, hyp_times, ngram, time_tolerance))
+    distance, ops = 0, []
+    bounds = [(-1, -1)] + anchors + [(len(a), len(b))]
+    for (i0, j0), (i1, j1) in zip(bounds, bounds[1:]):
+        if exact:
+            gap_distance, gap_ops = _exact(a[i0 + 1:i1], b[j0 + 1:j1])
+        else:
+            gap_distance, gap_ops = _banded(a[i0 + 1:i1], b[j0 + 1:j1], band)
+        distance += gap_distance
+        ops += [(op, -1 if i is None else i + i0 + 1, -1 if j is None else j + j0 + 1) for op, i, j in gap_ops]
+        if i1 < len(a):
+            ops.append(('equal', i1, j1))
+
+    alignment = pd.DataFrame(ops, columns=['op', 'ref', 'hyp']).astype({'ref': np.int64, 'hyp': np.int64})
+    words = np.array(ref_words + [''], dtype=object), np.array(hyp_words + [''], dtype=object)
+    alignment['ref_word'] = words[0][alignment['ref'].to_numpy()]
+    alignment['hyp_word'] = words[1][alignment['hyp'].to_numpy()]
+    return distance, alignment
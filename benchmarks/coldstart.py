@@ -0,0 +1,103 @@
+''' Cold start of the transcription submitters, every run is a fresh interpreter
+
+    python benchmarks/coldstart.py --runs 10 --output coldstart.json
+
+For each function it reports the init time (import of the function module, what Lambda runs before
+the first event), the first and a warm invocation with a local fake event and fake Transcribe
+endpoint (local_aws.py), and the creation of the first real boto3 client, which a real cold start
+pays on its first event. The process time includes the interpreter start.
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# trigger (sns or s3), bucket and key of the fake upload of every function
+CASES = {
+    'create-transcription-RAW': ('sns', 'awstranscribe-tests', 'audios/llamada prueba 1.wav'),
+    'create-transcription-IPA': ('sns', 'awstranscribe-tests', 'audios/llamada prueba 1.wav'),
+    'create-transcription-job': ('s3', 'socofin-input', 'grabaciones-audio/20210118/llamada 1.wav'),
+}
+
+CHILD = r'''
+import sys, time, json, importlib.util
+root, name, kind, bucket, key = sys.argv[1:6]
+sys.path.insert(0, root)
+times = {}
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location(name.replace('-', '_'), f'{root}/Lambdas/{name}.py')
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+times['init_ms'] = (time.perf_counter() - start) * 1000
+
+import metrics, storage, local_aws
+metrics.set_sink(metrics.MemorySink())
+local_aws.install(local_aws.FakeTranscribeClient())
+for number, phase in enumerate(('first_ms', 'warm_ms')):
+    # a new upload every time, job names are derived from the key
+    upload = key.replace('.wav', f' {number}.wav')
+    storage.write_bytes(storage.to_uri(bucket, upload), b'RIFF')
+    record = local_aws.s3_record(bucket, upload)
+    event = local_aws.sns_event([record]) if kind == 'sns' else local_aws.s3_event([record])
+    start = time.perf_counter()
+    module.lambda_handler(event, local_aws.FakeContext(name))
+    times[phase] = (time.perf_counter() - start) * 1000
+
+start = time.perf_counter()
+import boto3
+boto3.session.Session().client('transcribe', region_name='us-east-1')
+times['sdk_client_ms'] = (time.perf_counter() - start) * 1000
+print(json.dumps(times))
+'''
+
+
+def run_once(name, folder):
+    kind, bucket, key = CASES[name]
+    env = dict(os.environ, TRANSCRIBE_STORAGE_ROOT=folder, AWS_DEFAULT_REGION='us-east-1')
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD, ROOT, name, kind, bucket, key], env=env,
+                            capture_output=True, text=True, check=True).stdout
+    times = json.loads(output.strip().splitlines()[-1])
+    times['process_ms'] = (time.perf_counter() - start) * 1000
+    return times
+
+
+def run(names, runs=5):
+    results = {}
+    for name in names:
+        folder = tempfile.mkdtemp(prefix='coldstart-')
+        try:
+            samples = [run_once(name, folder) for _ in range(runs)]
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        results[name] = {phase: {'p50': float(np.percentile([s[phase] for s in samples], 50)),
+                                 'p90': float(np.percentile([s[phase] for s in samples], 90))}
+                         for phase in samples[0]}
+        print(f'{name:26s} ' + '  '.join(f"{phase[:-3]} {values['p50']:7.1f} ms"
+                                          for phase, values in results[name].items()))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', choices=sorted(CASES), help='functions to run')
+    parser.add_argument('--runs', type=int, default=5, help='cold starts per function')
+    parser.add_argument('--output', help='write the results to this json file')
+    args = parser.parse_args(argv)
+
+    results = run(args.only or list(CASES), args.runs)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'runs': args.runs, 'functions': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
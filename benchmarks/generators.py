@@ -0,0 +1,96 @@
+''' Deterministic synthetic inputs for the benchmarks: AWS Transcribe json (single and dual
+channel), SRT captions and vocabulary dictionaries. The same seed always gives the same files. '''
+import os
+import json
+import random
+
+
+WORDS = ('hola buenos dias le llamo de su banco para hablar sobre la deuda de su tarjeta '
+         'credito usted puede pagar hoy manana cuota monto pesos gracias senor senora '
+         'no si claro bueno entiendo necesito tiempo trabajo semana mes convenio oficina').split()
+PUNCTUATION = ('.', ',', '?')
+
+
+def _words(rng, count):
+    return [rng.choice(WORDS) for _ in range(count)]
+
+
+def _items(rng, words, start=0.0, punctuation=0.1):
+    """ Transcribe items with timestamps, some punctuation items in between """
+    items, time = [], start
+    for word in words:
+        duration = rng.uniform(0.15, 0.6)
+        items.append({'start_time': f'{time:.3f}', 'end_time': f'{time + duration:.3f}',
+                      'alternatives': [{'confidence': f'{rng.random():.4f}', 'content': word}],
+                      'type': 'pronunciation'})
+        time += duration + rng.uniform(0.0, 0.2)
+        if rng.random() < punctuation:
+            items.append({'alternatives': [{'confidence': '0.0', 'content': rng.choice(PUNCTUATION)}],
+                          'type': 'punctuation'})
+    return items
+
+
+def transcribe_json(words=1000, channels=1, seed=0):
+    ''' AWS Transcribe output document
+
+    :param words: Words per channel
+    :param channels: 1 for results.items only, 2 adds results.channel_labels (ch_0, ch_1)
+    :param seed: Random seed
+    :return: dict
+    '''
+    rng = random.Random(seed)
+    if channels == 1:
+        items = _items(rng, _words(rng, words))
+        labels = None
+    else:
+        labels = [{'channel_label': f'ch_{c}', 'items': _items(rng, _words(rng, words), start=c * 0.3)}
+                  for c in range(channels)]
+        items = sorted((item for label in labels for item in label['items'] if 'start_time' in item),
+                       key=lambda item: float(item['start_time']))
+    transcript = ' '.join(item['alternatives'][0]['content'] for item in items)
+    results = {'transcripts': [{'transcript': transcript}], 'items': items}
+    if labels is not None:
+        results['channel_labels'] = {'channels': labels, 'number_of_channels': channels}
+    return {'jobName': f'synthetic-{seed}', 'accountId': '000000000000', 'results': results,
+            'status': 'COMPLETED'}
+
+
+def _timestamp(seconds):
+    hours, rest = divmod(int(seconds * 1000), 3600000)
+    minutes, rest = divmod(rest, 60000)
+    return f'{hours:02d}:{minutes:02d}:{rest // 1000:02d},{rest % 1000:03d}'
+
+
+def srt_captions(segments=500, seed=0):
+    ''' YouTube SRT captions of segments blocks of 3 to 12 words '''
+    rng = random.Random(seed)
+    blocks, time = [], 0.0
+    for index in range(1, segments + 1):
+        duration = rng.uniform(1.0, 4.0)
+        text = ' '.join(_words(rng, rng.randint(3, 12)))
+        blocks.append(f'{index}\n{_timestamp(time)} --> {_timestamp(time + duration)}\n{text}\n')
+        time += duration
+    return '\n'.join(blocks) + '\n'
+
+
+def vocabulary_file(lines=100000, seed=0):
+    ''' Custom vocabulary table: header line then one phrase per line '''
+    rng = random.Random(seed)
+    rows = ['Phrase\tIPA\tSoundsLike\tDisplayAs']
+    rows += [f'{rng.choice(WORDS)}-{i}\t\t\t' for i in range(lines)]
+    return '\n'.join(rows) + '\n'
+
+
+def write_corpus(folder, files=20, words=1000, channels=1, seed=0):
+    ''' Write files Transcribe documents to folder
+
+    :return: List of paths
+    '''
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(files):
+        path = os.path.join(folder, f'call_{i:05d}.json')
+        with open(path, 'w') as f:
+            json.dump(transcribe_json(words, channels, seed + i), f)
+        paths.append(path)
+    return paths
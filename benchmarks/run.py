@@ -0,0 +1,193 @@
+''' Micro-benchmarks of the hot paths of adaptors.py and the sentiment Lambda
+
+    python benchmarks/run.py --scale 1 --repeat 5 --output results.json
+    python benchmarks/run.py --baseline results.json --tolerance 0.25
+
+Every benchmark reports throughput (items per second at the median latency), latency
+percentiles and the tracemalloc peak of one extra run. With --baseline the run exits with
+status 1 when the median latency or the peak memory of a benchmark grows over the tolerance.
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import importlib.util
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import storage
+import adaptors
+import generators
+
+
+def _lambda(name):
+    """ Import a Lambda module, their file names are not valid module names """
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), os.path.join(ROOT, 'Lambdas', f'{name}.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def _clear_neutralize():
+    adaptors._normalizers.clear()
+
+
+def bench_youtube2df(scale, folder):
+    path = _write(os.path.join(folder, 'captions.srt'), generators.srt_captions(int(5000 * scale)))
+    return {'run': lambda: adaptors.youtube2df(path, aws_path=False), 'items': int(5000 * scale)}
+
+
+def bench_aws2df(scale, folder):
+    path = _write(os.path.join(folder, 'transcribe.json'),
+                  json.dumps(generators.transcribe_json(int(20000 * scale))))
+    return {'run': lambda: adaptors.aws2df(path, aws_path=False), 'items': int(20000 * scale)}
+
+
+def bench_compress(scale, folder):
+    captions = adaptors.youtube2df(_write(os.path.join(folder, 'compress.srt'),
+                                          generators.srt_captions(int(5000 * scale), seed=1)), aws_path=False)
+    words = pd.DataFrame(generators.transcribe_json(int(40000 * scale), seed=1)['results']['items'])
+    words = words[words['type'] == 'pronunciation']
+    words = pd.DataFrame({'start': words['start_time'].astype(float), 'end': words['end_time'].astype(float),
+                          'transcript': words['alternatives'].str[0].str['content']})
+    return {'run': lambda: adaptors.compress(captions, words), 'items': len(words)}
+
+
+def bench_neutralize(scale, folder):
+    document = generators.transcribe_json(int(50000 * scale), seed=2)['results']['items']
+    texts = [f'<i>{item["alternatives"][0]["content"].title()}</i> ¿{i % 997}?' for i, item in enumerate(document)]
+    return {'run': lambda: adaptors.neutralize_series(texts), 'items': len(texts), 'reset': _clear_neutralize}
+
+
+def bench_lv_score(scale, folder):
+    captions = generators.srt_captions(int(20000 * scale), seed=3).split('\n\n')
+    hypotheses = generators.srt_captions(int(20000 * scale), seed=4).split('\n\n')
+    a = [block.split('\n')[-1] for block in captions]
+    b = [block.split('\n')[-1] for block in hypotheses]
+    return {'run': lambda: adaptors.lv_score(a, b), 'items': len(a), 'reset': _clear_neutralize}
+
+
+def _speaker_corpus(scale, folder):
+    files = max(1, int(50 * scale))
+    generators.write_corpus(os.path.join(folder, 'socofin-output', 'output-transcribe', 'bench'),
+                            files=files, words=400, channels=2)
+    storage.set_backend('s3', storage.LocalBackend(folder))
+    return _lambda('sentiment'), files
+
+
+def bench_speaker_label(scale, folder):
+    sentiment, files = _speaker_corpus(scale, folder)
+    return {'run': lambda: sentiment.get_speaker_label(key='output-transcribe/bench/'), 'items': files}
+
+
+def bench_speaker_content(scale, folder):
+    sentiment, files = _speaker_corpus(scale, folder)
+    labels = sentiment.get_speaker_label(key='output-transcribe/bench/')
+    return {'run': lambda: sentiment.get_content(key='output-transcribe/bench/', speaker_label=labels.copy()),
+            'items': files}
+
+
+BENCHMARKS = {
+    'youtube2df': bench_youtube2df,
+    'aws2df': bench_aws2df,
+    'compress': bench_compress,
+    'neutralize': bench_neutralize,
+    'lv_score': bench_lv_score,
+    'speaker_label': bench_speaker_label,
+    'speaker_content': bench_speaker_content,
+}
+
+
+def measure(case, repeat):
+    ''' Latencies of repeat runs (after one warm up run) and the peak memory of one more run '''
+    reset = case.get('reset', lambda: None)
+    reset()
+    case['run']()
+    latencies = []
+    for _ in range(repeat):
+        reset()
+        start = time.perf_counter()
+        case['run']()
+        latencies.append(time.perf_counter() - start)
+    reset()
+    tracemalloc.start()
+    case['run']()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {'items': case['items'], 'repeat': repeat, 'mean': float(np.mean(latencies)),
+            'p50': float(p50), 'p90': float(p90), 'p99': float(p99),
+            'throughput': case['items'] / p50 if p50 else float('inf'), 'peak_mb': peak / 2 ** 20}
+
+
+def run(names, scale=1.0, repeat=5):
+    results = {}
+    for name in names:
+        folder = tempfile.mkdtemp(prefix=f'bench-{name}-')
+        try:
+            results[name] = measure(BENCHMARKS[name](scale, folder), repeat)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        print(f"{name:16s} p50 {results[name]['p50'] * 1000:9.1f} ms  p90 {results[name]['p90'] * 1000:9.1f} ms  "
+              f"{results[name]['throughput']:12.0f} items/s  peak {results[name]['peak_mb']:8.1f} MB")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    ''' Print the ratios against a baseline run, return the names of the regressions '''
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if previous is None:
+            continue
+        time_ratio = current['p50'] / previous['p50'] if previous['p50'] else 1.0
+        memory_ratio = current['peak_mb'] / previous['peak_mb'] if previous['peak_mb'] else 1.0
+        regressed = time_ratio > 1 + tolerance or memory_ratio > 1 + tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:16s} time x{time_ratio:5.2f}  memory x{memory_ratio:5.2f}  {'REGRESSION' if regressed else 'ok'}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='benchmarks to run')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier of the input sizes')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark')
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--baseline', help='json file of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative growth')
+    args = parser.parse_args(argv)
+
+    results = run(args.only or list(BENCHMARKS), args.scale, args.repeat)
+    report = {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+              'scale': args.scale, 'benchmarks': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != args.scale:
+            print(f"Warning: baseline scale {baseline.get('scale')} differs from {args.scale}")
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+''' Load test of submitter.py against the fake Transcribe endpoint of local_aws.py
+
+    python benchmarks/submit_load.py --jobs 500 --duration 2 --rate 20 --max-in-flight 90
+
+A burst of uploads is queued, then drains run back to back (like a schedule or the upload events),
+with a growing pause after the drains that submit nothing, until every job has been submitted.
+--rate cannot be over --tps. Reports the sustained jobs per minute, the peak of jobs in
+flight and the requests the endpoint rejected. --naive starts every job directly, as the
+Lambdas did before, for comparison.
+'''
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import storage
+import local_aws
+import submitter
+
+# Pause after a drain that submitted nothing, doubled up to MAX_IDLE_DELAY while drains stay idle
+IDLE_DELAY = 0.05
+# One window of the request rate of the endpoint, throttled requests fill it too
+MAX_IDLE_DELAY = 1.0
+
+
+def _peak(client, stop, samples):
+    while not stop():
+        with client._lock:
+            client._refresh()
+            samples.append(sum(job['TranscriptionJobStatus'] == 'IN_PROGRESS' for job in client.jobs.values()))
+        time.sleep(0.01)
+
+
+def run(jobs=500, duration=2.0, rate=20.0, burst=5, max_in_flight=90, quota=100, tps=25, latency=0.02,
+        workers=submitter.SUBMIT_WORKERS, naive=False):
+    if not naive and tps is not None and rate > tps:
+        # the endpoint counts the throttled requests too, such drains mostly get throttled
+        raise ValueError(f'--rate {rate} is over the --tps {tps} of the endpoint')
+    folder = tempfile.mkdtemp(prefix='submit-load-')
+    storage.set_backend('s3', storage.LocalBackend(folder))
+    client = local_aws.FakeTranscribeClient(duration=duration, max_concurrent=quota, rate=tps, latency=latency)
+    queue = submitter.StorageQueue('s3://load/queue/', 's3://load/failed/')
+    jobs_submitter = submitter.Submitter('RAW', queue=queue, bucket=submitter.TokenBucket(rate, burst),
+                                         max_in_flight=max_in_flight, workers=workers, client=client)
+    uploads = [('uploads', f'audios/call-{i:05d}.wav') for i in range(jobs)]
+    samples, done = [], []
+    with ThreadPoolExecutor(max_workers=1) as monitor:
+        monitor.submit(_peak, client, lambda: bool(done), samples)
+        start = time.perf_counter()
+        try:
+            if naive:
+                def start_job(upload):
+                    try:
+                        client.start_transcription_job(**submitter.job_request('RAW', *upload))
+                        return 1
+                    except Exception:
+                        return 0
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    submitted = sum(pool.map(start_job, uploads))
+                drains = 1
+            else:
+                for bucket, key in uploads:
+                    jobs_submitter.enqueue(bucket, key)
+                submitted, drains, delay = 0, 0, IDLE_DELAY
+                while submitted < jobs:
+                    counts = jobs_submitter.drain()
+                    submitted += counts['submitted']
+                    drains += 1
+                    if counts['submitted']:
+                        delay = IDLE_DELAY
+                    else:
+                        # every slot is taken or the endpoint throttles (--rate over --tps), back off like
+                        # the next scheduled drain, retrying at once keeps the rate window full
+                        time.sleep(delay)
+                        delay = min(2 * delay, MAX_IDLE_DELAY)
+            elapsed = time.perf_counter() - start
+        finally:
+            done.append(True)
+            shutil.rmtree(folder, ignore_errors=True)
+    return {'jobs': jobs, 'submitted': submitted, 'seconds': elapsed, 'drains': drains,
+            'jobs_per_minute': submitted / elapsed * 60 if elapsed else 0.0,
+            'peak_in_flight': max(samples, default=0), 'rejected': dict(client.rejected)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=500, help='uploads in the burst')
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds every fake job runs')
+    parser.add_argument('--rate', type=float, default=20.0, help='token bucket rate, jobs per second')
+    parser.add_argument('--burst', type=int, default=5, help='token bucket size')
+    parser.add_argument('--max-in-flight', type=int, default=90, help='jobs in flight allowed by the submitter')
+    parser.add_argument('--quota', type=int, default=100, help='concurrent jobs allowed by the fake endpoint')
+    parser.add_argument('--tps', type=float, default=25, help='StartTranscriptionJob calls per second allowed')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds of every fake request')
+    parser.add_argument('--naive', action='store_true', help='start every job directly, without the submitter')
+    args = parser.parse_args(argv)
+
+    try:
+        result = run(args.jobs, args.duration, args.rate, args.burst, args.max_in_flight, args.quota, args.tps,
+                     args.latency, naive=args.naive)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"{result['submitted']}/{result['jobs']} jobs in {result['seconds']:.1f} s, "
+          f"{result['jobs_per_minute']:.0f} jobs/min over {result['drains']} drains, "
+          f"peak in flight {result['peak_in_flight']}, rejected {result['rejected']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+import os
+import io
+import json
+import pickle
+import hashlib
+import tempfile
+import threading
+import storage
+
+
+# Folder of the cache, /tmp is also the only writable folder of a Lambda
+CACHE_DIR = os.environ.get('TRANSCRIBE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'transcribe-cache'))
+# Size limit of the cache, the least recently used entries are evicted above it
+CACHE_MAX_BYTES = int(os.environ.get('TRANSCRIBE_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+# When False, the last cached version of an object is used without asking S3 for its ETag
+CACHE_VALIDATE = os.environ.get('TRANSCRIBE_CACHE_VALIDATE', '1') != '0'
+
+
+class DiskCache:
+    ''' Content addressed files keyed by bucket/key/ETag with a size bounded LRU eviction
+
+    Every entry is a file named after the hash of (uri, ETag, kind), its modification time is
+    refreshed on each hit and the oldest files are removed when the folder grows over max_bytes.
+    A small ref file per URI remembers the last ETag seen, for reads without validation.
+
+    :param directory: Folder of the cache
+    :param max_bytes: Size limit of the entries
+    '''
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, *parts):
+        digest = hashlib.sha256('\0'.join(parts).encode('utf8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _write(self, path, data):
+        """ Atomic write, readers never see a partial file """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def entry(self, uri, etag, kind='raw'):
+        ''' Path of a cached object version, None on a miss '''
+        path = self._path(uri, etag, kind)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get(self, uri, etag, kind='raw'):
+        ''' Cached content of an object version, None on a miss '''
+        path = self.entry(uri, etag, kind)
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def put(self, uri, etag, data, kind='raw'):
+        ''' Store the content of an object version and evict old entries if needed '''
+        self._write(self._path(uri, etag, kind), data)
+        self._added(uri, etag, len(data))
+
+    def put_file(self, uri, etag, file_name, kind='raw'):
+        ''' Move a downloaded file into the cache
+
+        :return: Path of the cache entry
+        '''
+        path = self._path(uri, etag, kind)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = os.path.getsize(file_name)
+        os.replace(file_name, path)
+        self._added(uri, etag, size)
+        return path
+
+    def _added(self, uri, etag, size):
+        """ Remember the last version of uri and keep the cache under max_bytes """
+        self._write(self._path(uri, 'ref'), etag.encode('utf8'))
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan()[1]
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._size = self.evict()
+
+    def last_etag(self, uri):
+        ''' ETag of the last cached version of uri, None if it was never cached '''
+        try:
+            with open(self._path(uri, 'ref'), 'rb') as f:
+                return f.read().decode('utf8')
+        except FileNotFoundError:
+            return None
+
+    def _scan(self):
+        """ Entries sorted from least to most recently used and their total size """
+        entries, total = [], 0
+        for dirpath, _, filenames in os.walk(self.directory):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        entries.sort()
+        return entries, total
+
+    def evict(self):
+        ''' Remove least recently used entries until the cache fits in max_bytes
+
+        :return: Size of the cache after eviction
+        '''
+        entries, total = self._scan()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+    def clear(self):
+        ''' Remove every entry '''
+        for _, _, path in self._scan()[0]:
+            os.remove(path)
+        with self._lock:
+            self._size = 0
+
+
+_cache = None
+
+
+def get_cache():
+    ''' Shared DiskCache of the process '''
+    global _cache
+    if _cache is None:
+        _cache = DiskCache()
+    return _cache
+
+
+def _cacheable(uri):
+    """ Only remote objects are cached, local files are already on disk """
+    backend, _, _ = storage.get_backend(uri)
+    return isinstance(backend, storage.S3Backend)
+
+
+def _current_etag(uri, etag=None, validate=CACHE_VALIDATE):
+    """ ETag to look up, from the caller, the last cached version or a HEAD request """
+    if etag is None and not validate:
+        etag = get_cache().last_etag(uri)
+    if etag is None:
+        obj = storage.head(uri)
+        etag = obj['ETag'] if obj else None
+    return etag
+
+
+def read_bytes(uri, etag=None, validate=CACHE_VALIDATE):
+    ''' Content of an object, served from the local cache when its version did not change
+
+    :param uri: s3:// or file:// URI
+    :param etag: ETag of the object when already known (e.g. from a listing), saves a HEAD
+    :param validate: Ask S3 for the current ETag, False reuses the last cached version
+    :return: bytes
+    '''
+    if not _cacheable(uri):
+        return storage.read_bytes(uri)
+    return _read_tagged(uri, etag, validate)[0]
+
+
+def _read_tagged(uri, etag=None, validate=CACHE_VALIDATE):
+    """ Content of an S3 object and the ETag of that content, which is newer than etag when the
+        object was replaced after the HEAD """
+    etag = _current_etag(uri, etag, validate)
+    data = get_cache().get(uri, etag) if etag else None
+    if data is None:
+        data, etag = storage.read_tagged(uri)
+        get_cache().put(uri, etag, data)
+    return data, etag
+
+
+def local_path(uri, etag=None, validate=CACHE_VALIDATE):
+    ''' Path of a local copy of an object, S3 objects are downloaded once into the cache
+
+    Useful for large files that are memory-mapped or read partially instead of loaded whole.
+
+    :param uri: s3:// or file:// URI
+    :param etag: ETag of the object when already known
+    :param validate: Ask S3 for the current ETag, False reuses the last cached version
+    :return: Path of a local file, do not modify it
+    '''
+    backend, bucket, key = storage.get_backend(uri)
+    if not isinstance(backend, storage.S3Backend):
+        return backend.path(bucket, key)
+    etag = _current_etag(uri, etag, validate)
+    path = get_cache().entry(uri, etag)
+    if path is None:
+        os.makedirs(get_cache().directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=get_cache().directory)
+        os.close(fd)
+        try:
+            storage.download_file(uri, tmp)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        path = get_cache().put_file(uri, etag, tmp)
+    return path
+
+
+def read_json(uri, etag=None, validate=CACHE_VALIDATE):
+    ''' Parsed json object, see read_bytes '''
+    return json.loads(read_bytes(uri, etag=etag, validate=validate))
+
+
+def read_parsed(uri, parser, kind, etag=None, validate=CACHE_VALIDATE):
+    ''' Parsed (e.g. columnar DataFrame) form of an object, cached next to the raw bytes
+
+    :param uri: s3:// or file:// URI
+    :param parser: Function that takes a binary file-like object and returns the parsed form
+    :param kind: Name of the parser and its options, part of the cache key
+    :param etag: ETag of the object when already known
+    :param validate: Ask S3 for the current ETag, False reuses the last cached version
+    :return: Output of parser
+    '''
+    if not _cacheable(uri):
+        with storage.open_uri(uri) as stream:
+            return parser(stream)
+    etag = _current_etag(uri, etag, validate)
+    data = get_cache().get(uri, etag, kind) if etag else None
+    if data is not None:
+        return pickle.loads(data)
+    # the parsed form is stored under the ETag of the bytes read, the object may have changed since
+    raw, etag = _read_tagged(uri, etag)
+    parsed = parser(io.BytesIO(raw))
+    get_cache().put(uri, etag, pickle.dumps(parsed, protocol=pickle.HIGHEST_PROTOCOL), kind)
+    return parsed
@@ -0,0 +1,137 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import pandas as pd
+import Levenshtein as lv
+from adaptors import neutralize_series, _as_strings
+import alignment
+
+
+# Count columns of evaluate, the rates are always recomputed from their sums
+WORD_COUNTS = ['ref_words', 'hyp_words', 'sub', 'ins', 'del']
+CHAR_COUNTS = ['ref_chars', 'hyp_chars', 'char_sub', 'char_ins', 'char_del']
+# Pairs over this many DP cells (length x length) are scored with the anchored, banded alignment
+# of alignment.py, whose counts are an upper bound, the matrix of the exact editops would not fit
+MAX_EXACT_CELLS = alignment.EXACT_CELLS
+# Characters of the anchor n-grams of those pairs, words are anchored with ANCHOR_NGRAM
+CHAR_ANCHOR_NGRAM = 8
+
+
+def _code_point(i):
+    """ i-th character usable as a word code, surrogates are skipped """
+    return chr(i if i < 0xD800 else i + 0x800)
+
+
+def _encode_words(texts):
+    """ Each text as a string with one character per word, codes are shared by all texts """
+    codes = {}
+    encoded = []
+    for text in texts:
+        encoded.append(''.join([codes.setdefault(word, _code_point(len(codes))) for word in text.split()]))
+    return encoded
+
+
+def _edit_counts(pairs, ngram=alignment.ANCHOR_NGRAM):
+    """ (substitutions, insertions, deletions) that turn each reference into its hypothesis,
+        runs in the process pool """
+    counts = []
+    for reference, hypothesis in pairs:
+        if len(reference) * len(hypothesis) > MAX_EXACT_CELLS:
+            _, ops = alignment.align(list(reference), list(hypothesis), ngram=ngram, exact=False)
+            ops = Counter(ops['op'])
+        else:
+            ops = Counter(op for op, _, _ in lv.editops(reference, hypothesis))
+        counts.append((ops['replace'], ops['insert'], ops['delete']))
+    return counts
+
+
+def _batch_counts(pairs, workers, chunksize, parallel_threshold, ngram=alignment.ANCHOR_NGRAM):
+    if workers != 1 and len(pairs) >= parallel_threshold:
+        chunks = [pairs[i:i + chunksize] for i in range(0, len(pairs), chunksize)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            counts = [c for chunk in pool.map(partial(_edit_counts, ngram=ngram), chunks) for c in chunk]
+    else:
+        counts = _edit_counts(pairs, ngram)
+    return np.asarray(counts, dtype=np.int64).reshape(-1, 3)
+
+
+def _rate(errors, total):
+    """ errors / total, NaN where there is nothing to compare against """
+    errors, total = np.asarray(errors, dtype=np.float64), np.asarray(total, dtype=np.float64)
+    return np.divide(errors, total, out=np.full(errors.shape, np.nan), where=total > 0)
+
+
+def _with_rates(frame):
+    frame['wer'] = _rate(frame['sub'] + frame['ins'] + frame['del'], frame['ref_words'])
+    frame['cer'] = _rate(frame['char_sub'] + frame['char_ins'] + frame['char_del'], frame['ref_chars'])
+    return frame
+
+
+def evaluate(references, hypotheses, files=None, profile='default', workers=None, chunksize=20000,
+             parallel_threshold=100000):
+    ''' Word and character error rates of many segments with their edit operation counts
+
+    Both sides are neutralized, words are encoded as single characters so the C edit
+    operations of Levenshtein give the word alignment. Every distinct pair is scored once. Pairs
+    over MAX_EXACT_CELLS (e.g. whole calls scored by character) are aligned with anchors instead,
+    see alignment.align, and their counts are an upper bound.
+
+    :param references: Series, array or list of reference ("real") segments
+    :param hypotheses: Series, array or list of transcribed segments, in the same order
+    :param files: Optional file of every segment, kept as the 'file' column for aggregate
+    :param profile: normalization profile passed to neutralize
+    :param workers: Number of processes, defaults to the CPU count, 1 disables the pool
+    :param chunksize: Pairs per task sent to the pool
+    :param parallel_threshold: Minimum number of distinct pairs to use the pool
+    :return: DataFrame with one row per segment: WORD_COUNTS, CHAR_COUNTS, 'wer' and 'cer'
+    '''
+    ref_values, hyp_values = _as_strings(references), _as_strings(hypotheses)
+    n = min(len(ref_values), len(hyp_values))
+    codes, uniques = pd.factorize(np.concatenate([ref_values[:n], hyp_values[:n]]))
+    texts = [' '.join(text.split()) for text in neutralize_series(uniques, profile)]
+    words = _encode_words(texts)
+    word_lengths = np.array([len(text) for text in words], dtype=np.int64)
+    char_lengths = np.array([len(text) for text in texts], dtype=np.int64)
+
+    # score each distinct (reference, hypothesis) pair once
+    pair_codes, pair_index = np.unique(codes[:n] * len(uniques) + codes[n:], return_inverse=True)
+    ref_codes, hyp_codes = np.divmod(pair_codes, max(len(uniques), 1))
+    pair_index = pair_index.ravel()
+    options = (workers, chunksize, parallel_threshold)
+    word_ops = _batch_counts([(words[r], words[h]) for r, h in zip(ref_codes, hyp_codes)], *options)[pair_index]
+    char_ops = _batch_counts([(texts[r], texts[h]) for r, h in zip(ref_codes, hyp_codes)], *options,
+                             CHAR_ANCHOR_NGRAM)[pair_index]
+
+    frame = pd.DataFrame({'ref_words': word_lengths[codes[:n]], 'hyp_words': word_lengths[codes[n:]],
+                          'sub': word_ops[:, 0], 'ins': word_ops[:, 1], 'del': word_ops[:, 2],
+                          'ref_chars': char_lengths[codes[:n]], 'hyp_chars': char_lengths[codes[n:]],
+                          'char_sub': char_ops[:, 0], 'char_ins': char_ops[:, 1], 'char_del': char_ops[:, 2]})
+    if files is not None:
+        frame.insert(0, 'file', pd.Series(files).to_numpy()[:n])
+    return _with_rates(frame)
+
+
+def aggregate(segments, by='file'):
+    ''' Error rates of groups of segments (e.g. per file), from the summed counts
+
+    :param segments: DataFrame returned by evaluate
+    :param by: Column or list of columns to group by
+    :return: DataFrame indexed by the groups with the summed counts, 'segments', 'wer' and 'cer'
+    '''
+    grouped = segments.groupby(by, sort=True)
+    totals = grouped[WORD_COUNTS + CHAR_COUNTS].sum()
+    totals.insert(0, 'segments', grouped.size())
+    return _with_rates(totals)
+
+
+def corpus_scores(segments):
+    ''' Corpus level counts and error rates, every word of the corpus weighs the same
+
+    :param segments: DataFrame returned by evaluate (or aggregate)
+    :return: dict with the summed counts, 'wer' and 'cer'
+    '''
+    totals = segments[WORD_COUNTS + CHAR_COUNTS].sum().to_frame().T
+    scores = _with_rates(totals).iloc[0].to_dict()
+    return {name: (int(value) if name in WORD_COUNTS + CHAR_COUNTS else float(value))
+            for name, value in scores.items()}
@@ -0,0 +1,269 @@
+''' Idempotency records of the transcription submissions
+
+Every upload is claimed once per profile, keyed by profile, bucket, key and ETag, with a
+conditional put: a redelivered S3 / SNS notification or a second container finds the record and
+skips the upload. Records move from 'submitted' to 'completed' or 'failed'; the failed ones (and the
+submissions that never finished) make the reprocessing queue, see Submitter.reprocess.
+
+The records live in a DynamoDB table (partition key 'pk', a string), or in a SQLite database for
+offline runs (TRANSCRIBE_IDEMPOTENCY_DB, or idempotency.sqlite3 under TRANSCRIBE_STORAGE_ROOT).
+'''
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import storage
+
+
+TABLE = os.environ.get('TRANSCRIBE_IDEMPOTENCY_TABLE', 'transcribe-submissions')
+DATABASE = os.environ.get('TRANSCRIBE_IDEMPOTENCY_DB') or (
+    os.path.join(storage.STORAGE_ROOT, 'idempotency.sqlite3') if storage.STORAGE_ROOT else None)
+
+SUBMITTED, COMPLETED, FAILED = 'submitted', 'completed', 'failed'
+
+
+def submission_key(profile, bucket, key, etag):
+    ''' Partition key of the record of an upload, the ETag quotes of S3 are ignored '''
+    text = '\n'.join((profile, bucket, key, etag.strip('"')))
+    return f"{profile}#{hashlib.sha256(text.encode('utf8')).hexdigest()}"
+
+
+def _job_key(job_name):
+    return f'job#{job_name}'
+
+
+class DynamoBackend:
+    ''' Records in a DynamoDB table with the partition key 'pk' (string), string and number
+        attributes only
+
+    :param table: Table name
+    '''
+
+    def __init__(self, table=TABLE):
+        self.table = table
+
+    @property
+    def client(self):
+        return storage.get_client('dynamodb')
+
+    @staticmethod
+    def _attributes(record):
+        return {name: {'N': repr(value)} if isinstance(value, (int, float)) else {'S': str(value)}
+                for name, value in record.items() if value is not None}
+
+    @staticmethod
+    def _record(item):
+        return {name: float(value['N']) if 'N' in value else value['S'] for name, value in item.items()}
+
+    def put(self, record, if_absent=False):
+        ''' Write a record, with if_absent only when its pk is new: returns False when it exists '''
+        from botocore.exceptions import ClientError
+        kwargs = {'ConditionExpression': 'attribute_not_exists(pk)'} if if_absent else {}
+        try:
+            self.client.put_item(TableName=self.table, Item=self._attributes(record), **kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+    def get(self, pk):
+        item = self.client.get_item(TableName=self.table, Key={'pk': {'S': pk}}, ConsistentRead=True).get('Item')
+        return self._record(item) if item else None
+
+    def update(self, pk, values, expected=None):
+        ''' Set attributes of an existing record (None removes them), only when the attributes of
+            expected have those values
+
+        :return: False when the record is missing or does not match expected
+        '''
+        from botocore.exceptions import ClientError
+        names, attributes, sets, removes = {}, {}, [], []
+        for i, (name, value) in enumerate(values.items()):
+            names[f'#a{i}'] = name
+            if value is None:
+                removes.append(f'#a{i}')
+            else:
+                attributes[f':a{i}'] = self._attributes({name: value})[name]
+                sets.append(f'#a{i} = :a{i}')
+        conditions = ['attribute_exists(pk)']
+        for i, (name, value) in enumerate((expected or {}).items()):
+            names[f'#e{i}'], attributes[f':e{i}'] = name, self._attributes({name: value})[name]
+            conditions.append(f'#e{i} = :e{i}')
+        expression = ' '.join(part for part in (sets and 'SET ' + ', '.join(sets),
+                                                removes and 'REMOVE ' + ', '.join(removes)) if part)
+        try:
+            self.client.update_item(TableName=self.table, Key={'pk': {'S': pk}}, UpdateExpression=expression,
+                                    ConditionExpression=' AND '.join(conditions), ExpressionAttributeNames=names,
+                                    ExpressionAttributeValues=attributes)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+    def delete(self, pk):
+        self.client.delete_item(TableName=self.table, Key={'pk': {'S': pk}})
+
+    def scan(self, state):
+        ''' Records in a state, a full scan of the table '''
+        kwargs = {'TableName': self.table, 'FilterExpression': '#state = :state',
+                  'ExpressionAttributeNames': {'#state': 'state'}, 'ExpressionAttributeValues': {':state': {'S': state}}}
+        while True:
+            response = self.client.scan(**kwargs)
+            for item in response.get('Items', []):
+                yield self._record(item)
+            if not response.get('LastEvaluatedKey'):
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+class SQLiteBackend:
+    ''' Records in a SQLite database, the local stand-in of DynamoBackend. The conditional writes
+        hold the database lock, so concurrent processes on one machine are safe.
+
+    :param path: Database file, ':memory:' for a private database
+    '''
+
+    def __init__(self, path):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS records '
+                                     '(pk TEXT PRIMARY KEY, state TEXT, record TEXT NOT NULL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS records_state ON records (state)')
+
+    def put(self, record, if_absent=False):
+        verb = 'INSERT OR IGNORE' if if_absent else 'INSERT OR REPLACE'
+        with self._lock:
+            cursor = self._connection.execute(f'{verb} INTO records VALUES (?, ?, ?)',
+                                              (record['pk'], record.get('state'), json.dumps(record)))
+        return cursor.rowcount == 1
+
+    def get(self, pk):
+        with self._lock:
+            row = self._connection.execute('SELECT record FROM records WHERE pk = ?', (pk,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, pk, values, expected=None):
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._connection.execute('SELECT record FROM records WHERE pk = ?', (pk,)).fetchone()
+                record = json.loads(row[0]) if row else None
+                if record is None or any(record.get(name) != value for name, value in (expected or {}).items()):
+                    return False
+                for name, value in values.items():
+                    if value is None:
+                        record.pop(name, None)
+                    else:
+                        record[name] = value
+                self._connection.execute('UPDATE records SET state = ?, record = ? WHERE pk = ?',
+                                         (record.get('state'), json.dumps(record), pk))
+                return True
+            finally:
+                self._connection.execute('COMMIT')
+
+    def delete(self, pk):
+        with self._lock:
+            self._connection.execute('DELETE FROM records WHERE pk = ?', (pk,))
+
+    def scan(self, state):
+        with self._lock:
+            rows = self._connection.execute('SELECT record FROM records WHERE state = ? ORDER BY pk',
+                                            (state,)).fetchall()
+        return (json.loads(row[0]) for row in rows)
+
+
+class IdempotencyStore:
+    ''' Submission records of the uploads
+
+    :param backend: DynamoBackend, SQLiteBackend or an object with their methods
+    '''
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def claim(self, profile, bucket, key, etag, job_name=None, queue_uri=None):
+        ''' Record the submission of an upload
+
+        :param job_name: Name of its transcription job
+        :param queue_uri: URI of its item in the submission queue
+        :return: True when the upload is new, False for a duplicate (skip it)
+        '''
+        pk = submission_key(profile, bucket, key, etag)
+        record = {'pk': pk, 'state': SUBMITTED, 'profile': profile, 'bucket': bucket, 'key': key,
+                  'etag': etag.strip('"'), 'job_name': job_name, 'queue_uri': queue_uri, 'attempts': 1,
+                  'updated': time.time()}
+        if not self.backend.put(record, if_absent=True):
+            return False
+        if job_name:
+            self.backend.put({'pk': _job_key(job_name), 'submission': pk})
+        return True
+
+    def release(self, profile, bucket, key, etag, job_name=None):
+        ''' Drop the claim of an upload that could not be queued, so a redelivery submits it '''
+        if job_name:
+            self.backend.delete(_job_key(job_name))
+        self.backend.delete(submission_key(profile, bucket, key, etag))
+
+    def get(self, profile, bucket, key, etag):
+        ''' Record of an upload, None when it was never claimed '''
+        return self.backend.get(submission_key(profile, bucket, key, etag))
+
+    def job_record(self, job_name):
+        ''' Record of the upload a job was started for, None for unknown jobs '''
+        pointer = self.backend.get(_job_key(job_name))
+        return self.backend.get(pointer['submission']) if pointer else None
+
+    def finish(self, job_name, state, error=None):
+        ''' Move the record of a job from 'submitted' to state (COMPLETED or FAILED)
+
+        :return: True when it moved, False when it was already finished, None for unknown jobs
+        '''
+        pointer = self.backend.get(_job_key(job_name))
+        if pointer is None:
+            return None
+        return self.backend.update(pointer['submission'], {'state': state, 'error': error, 'updated': time.time()},
+                                   expected={'state': SUBMITTED})
+
+    def pending(self, stale_after=None):
+        ''' The reprocessing queue: failed records, and with stale_after (seconds) the submissions
+            that did not finish in that time '''
+        yield from self.backend.scan(FAILED)
+        if stale_after is not None:
+            limit = time.time() - stale_after
+            yield from (record for record in self.backend.scan(SUBMITTED) if record['updated'] < limit)
+
+    def retry(self, record, job_name=None, queue_uri=None):
+        ''' Claim a record of pending() again, False when another process took it first '''
+        # the update time is compared too, a stale submission is only retried by one process
+        values = {'state': SUBMITTED, 'job_name': job_name, 'queue_uri': queue_uri, 'error': None,
+                  'attempts': record.get('attempts', 1) + 1, 'updated': time.time()}
+        if not self.backend.update(record['pk'], values,
+                                   expected={'state': record['state'], 'updated': record['updated']}):
+            return False
+        if job_name:
+            self.backend.put({'pk': _job_key(job_name), 'submission': record['pk']})
+        return True
+
+
+_store = None
+
+
+def get_store():
+    ''' Store of the process: SQLite with DATABASE set, otherwise the DynamoDB table TABLE '''
+    global _store
+    if _store is None:
+        _store = IdempotencyStore(SQLiteBackend(DATABASE) if DATABASE else DynamoBackend(TABLE))
+    return _store
+
+
+def set_store(store):
+    ''' Replace the store of the process, e.g. with a SQLiteBackend(':memory:') one '''
+    global _store
+    _store = store
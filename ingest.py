@@ -0,0 +1,258 @@
+import os
+import re
+import time
+import shutil
+import logging
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, Future
+import storage
+import uploads
+
+
+# Bucket and folders of the YouTube test corpus
+BUCKET = 'awstranscribe-tests'
+VIDEO_PREFIX = 'exampleRecords/youtubeVideos/'
+CAPTION_PREFIX = 'levenshteinTests/ytCaptions/'
+CAPTION_CODE = 'es-419'
+# Workers of every stage, metadata and captions are small requests, media downloads and
+# uploads are bandwidth bound
+META_WORKERS = 4
+DOWNLOAD_WORKERS = 4
+UPLOAD_WORKERS = 4
+# Parts of a streamed video buffered in memory while they wait for the upload pool
+STREAM_PARTS = 4
+
+
+def safe_title(title):
+    ''' Object name of a video title: underscores instead of spaces and slashes, ASCII only, no '+' '''
+    title = title.replace(' ', '_').replace('/', '_')
+    title = unicodedata.normalize('NFKD', title).encode('ASCII', 'ignore').decode('utf-8')
+    return re.sub(r'\+', '', title)
+
+
+class YouTubeSource:
+    ''' Videos and captions served by YouTube through pytube '''
+
+    def metadata(self, url):
+        from pytube import YouTube
+        video = YouTube(url)
+        stream = video.streams.first()
+        return {'url': url, 'title': video.title, 'size': stream.filesize, 'video': video, 'stream': stream,
+                'extension': stream.subtype}
+
+    def captions(self, meta, code):
+        caption = meta['video'].captions.get_by_language_code(code)
+        if not caption:
+            print('This caption doesn\'t exist for this video: ', meta['title'])
+            print('You can use one of the following captions: \n', meta['video'].captions.all())
+            return None
+        return caption.generate_srt_captions()
+
+    def chunks(self, meta):
+        from pytube import request
+        return request.stream(meta['stream'].url)
+
+    def download(self, meta, file_name):
+        ''' Save the video next to file_name, returns the path pytube wrote (it cleans the name
+            and adds the extension, e.g. '.mp4') '''
+        return meta['stream'].download(output_path=os.path.dirname(file_name), filename=os.path.basename(file_name))
+
+
+class FakeSource:
+    ''' Offline stand in for YouTubeSource, to measure throughput and disk usage without network
+
+    :param size: Bytes of every video
+    :param chunk_size: Bytes per chunk of the media stream
+    :param bandwidth: Bytes per second of every download, None for no limit
+    :param latency: Seconds of every metadata or caption request
+    :param captions: Serve a short SRT caption for every video
+    '''
+
+    def __init__(self, size=8 * 1024 ** 2, chunk_size=1024 ** 2, bandwidth=None, latency=0.0, captions=True):
+        self.size = size
+        self.chunk_size = chunk_size
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.has_captions = captions
+
+    def metadata(self, url):
+        time.sleep(self.latency)
+        return {'url': url, 'title': f'Fake video {url}', 'size': self.size}
+
+    def captions(self, meta, code):
+        time.sleep(self.latency)
+        if not self.has_captions:
+            return None
+        return f'1\n00:00:00,000 --> 00:00:01,000\n{meta["title"]}\n\n'
+
+    def chunks(self, meta):
+        for sent in range(0, self.size, self.chunk_size):
+            chunk = bytes(min(self.chunk_size, self.size - sent))
+            if self.bandwidth:
+                time.sleep(len(chunk) / self.bandwidth)
+            yield chunk
+
+    def download(self, meta, file_name):
+        with open(file_name, 'wb') as f:
+            for chunk in self.chunks(meta):
+                f.write(chunk)
+        return file_name
+
+
+class DiskBudget:
+    ''' Bytes of local disk that the downloads may hold at the same time, downloads wait for
+        uploads to free space (a single file bigger than the budget is let through alone)
+
+    :param limit: Max bytes in use
+    '''
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size):
+        with self._condition:
+            self._condition.wait_for(lambda: self.used == 0 or self.used + size <= self.limit)
+            self.used += size
+            self.peak = max(self.peak, self.used)
+
+    def release(self, size):
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+def stream_upload(chunks, uri, pool, part_size=uploads.PART_SIZE, max_parts=STREAM_PARTS):
+    ''' Multipart upload of an iterable of byte chunks without a local copy
+
+    :param chunks: Iterable of bytes
+    :param uri: Destination s3:// or file:// URI
+    :param pool: Executor that sends the parts
+    :param part_size: Size of every part but the last one
+    :param max_parts: Parts held in memory waiting for the pool
+    :return: Bytes uploaded
+    '''
+    backend, bucket, key = storage.get_backend(uri)
+    upload_id = backend.create_multipart(bucket, key)
+    slots = threading.Semaphore(max_parts)
+    futures, buffer, total = [], bytearray(), 0
+
+    def send(number, data):
+        try:
+            return backend.upload_part(bucket, key, upload_id, number, data)
+        finally:
+            slots.release()
+
+    def submit(data):
+        slots.acquire()
+        futures.append(pool.submit(send, len(futures) + 1, data))
+
+    try:
+        for chunk in chunks:
+            buffer += chunk
+            total += len(chunk)
+            while len(buffer) >= part_size:
+                submit(bytes(buffer[:part_size]))
+                del buffer[:part_size]
+        if buffer or not futures:
+            submit(bytes(buffer))
+        backend.complete_multipart(bucket, key, upload_id, [future.result() for future in futures])
+    except Exception:
+        backend.abort_multipart(bucket, key, upload_id)
+        raise
+    return total
+
+
+def _resolve(future):
+    """ Result of a chain of futures, each stage returns the future of the next one """
+    while isinstance(future, Future):
+        future = future.result()
+    return future
+
+
+def ingest(urls, source=None, bucket=BUCKET, stream=False, tmp_dir='/tmp', disk_limit=None,
+           caption_code=CAPTION_CODE, meta_workers=META_WORKERS, download_workers=DOWNLOAD_WORKERS,
+           upload_workers=UPLOAD_WORKERS, part_size=uploads.PART_SIZE):
+    ''' Pipelined ingestion of videos and captions into S3
+
+    Metadata and captions, media downloads and uploads run in separate pools so network reads
+    and S3 writes overlap. Downloads wait while the files in tmp_dir would exceed disk_limit.
+
+    :param urls: Video URLs (e.g. plist.video_urls)
+    :param source: YouTubeSource (default) or FakeSource
+    :param bucket: Destination bucket, videos go to VIDEO_PREFIX and captions to CAPTION_PREFIX
+    :param stream: Send the media straight to S3 without a local copy
+    :param tmp_dir: Folder of the local copies
+    :param disk_limit: Max bytes of local copies, defaults to 80% of the free space of tmp_dir
+    :param caption_code: Language code of the captions
+    :param meta_workers: Threads fetching metadata and captions
+    :param download_workers: Threads downloading (or streaming) media
+    :param upload_workers: Threads uploading files or streamed parts
+    :param part_size: Part size of the multipart uploads
+    :return: dict with 'videos' (one dict per url with 'title', 'video', 'caption' and 'error'),
+             'bytes', 'seconds' and 'peak_disk' (bytes)
+    '''
+    source = source or YouTubeSource()
+    if disk_limit is None:
+        disk_limit = int(shutil.disk_usage(tmp_dir).free * 0.8)
+    budget = DiskBudget(disk_limit)
+    results = [{'url': url, 'title': None, 'video': None, 'caption': None, 'error': None} for url in urls]
+    transferred = []
+
+    def upload_file(file_name, uri, size=0):
+        try:
+            return uploads.upload(file_name, uri, part_size=part_size)
+        finally:
+            os.remove(file_name)
+            budget.release(size)
+
+    def download(result, meta):
+        if stream:
+            # the name pytube would give the file: the title and the extension of the stream
+            extension = f".{meta['extension']}" if meta.get('extension') else ''
+            uri = storage.to_uri(bucket, f"{VIDEO_PREFIX}{result['title']}{extension}")
+            size = stream_upload(source.chunks(meta), uri, uploaders, part_size)
+            transferred.append(size)
+            result['video'] = 'uploaded'
+            return None
+        size = meta.get('size') or 0
+        budget.acquire(size)
+        try:
+            # the source may rename the file (pytube adds the extension), its path is used
+            file_name = source.download(meta, os.path.join(tmp_dir, result['title']))
+        except Exception:
+            budget.release(size)
+            raise
+        uri = storage.to_uri(bucket, f'{VIDEO_PREFIX}{os.path.basename(file_name)}')
+        transferred.append(os.path.getsize(file_name))
+        return uploaders.submit(lambda: result.update(video=upload_file(file_name, uri, size)))
+
+    def fetch(result):
+        meta = source.metadata(result['url'])
+        result['title'] = title = safe_title(meta['title'])
+        media = downloaders.submit(download, result, meta)
+        text = source.captions(meta, caption_code)
+        if text is not None:
+            caption_file = os.path.join(tmp_dir, f'{title}_{caption_code}.txt')
+            with open(caption_file, 'w') as f:
+                f.write(text)
+            uri = storage.to_uri(bucket, f'{CAPTION_PREFIX}{title}.txt')
+            result['caption'] = uploaders.submit(upload_file, caption_file, uri).result()
+        return media
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=upload_workers) as uploaders, \
+            ThreadPoolExecutor(max_workers=download_workers) as downloaders, \
+            ThreadPoolExecutor(max_workers=meta_workers) as fetchers:
+        futures = [fetchers.submit(fetch, result) for result in results]
+        for result, future in zip(results, futures):
+            try:
+                _resolve(future)
+            except Exception as e:
+                logging.error('Could not ingest %s: %r', result['url'], e)
+                result['error'] = e
+    return {'videos': results, 'bytes': sum(transferred), 'seconds': time.time() - start,
+            'peak_disk': budget.peak}
@@ -0,0 +1,12 @@
+#!/bin/sh
+# Build the Lambda layer: the pinned dependencies and the shared modules under python/
+#   sh layer/build.sh && aws lambda publish-layer-version --layer-name transcribe-poc --zip-file fileb://layer/layer.zip
+set -e
+cd "$(dirname "$0")"
+rm -rf build layer.zip
+pip install --no-cache-dir --only-binary=:all: --platform manylinux2014_x86_64 --implementation cp \
+    --target build/python -r requirements.txt
+# numpy, pandas and pyarrow of the report functions come from the AWS SDK for pandas layer
+cp ../*.py build/python/
+(cd build && zip -qr ../layer.zip python)
+rm -rf build
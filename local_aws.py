@@ -0,0 +1,247 @@
+''' Local stand-ins for the AWS side of the Lambdas: a fake Transcribe client, Lambda contexts and
+the S3 / SNS events that trigger the functions. Used by the benchmarks and for offline runs with
+TRANSCRIBE_STORAGE_ROOT (see storage.py).
+
+    client = local_aws.install(local_aws.FakeTranscribeClient(duration=30))
+    handler(local_aws.sns_event([local_aws.s3_record('bucket', 'audio/call.wav')]), local_aws.FakeContext())
+    local_aws.JobEvents(client).run(completion_handler)
+'''
+import json
+import time
+import uuid
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from urllib.parse import quote_plus
+import storage
+
+
+def client_error(code, message, operation):
+    """ botocore ClientError as raised by the real client """
+    from botocore.exceptions import ClientError
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+class FakeTranscribeClient:
+    ''' In memory Transcribe endpoint with the limits of the real service
+
+    Jobs complete duration seconds after they start, their output document is written with
+    storage so the completion path can read it.
+
+    :param duration: Seconds a job stays IN_PROGRESS
+    :param max_concurrent: Jobs IN_PROGRESS at the same time, more raise LimitExceededException
+    :param rate: Max StartTranscriptionJob requests per second, more raise ThrottlingException
+    :param latency: Seconds added to every request, stands in for the round trip
+    :param fail: Function of the job dict, True makes the job end as FAILED
+    '''
+
+    def __init__(self, duration=0.0, max_concurrent=100, rate=None, latency=0.0, fail=None):
+        self.duration = duration
+        self.max_concurrent = max_concurrent
+        self.rate = rate
+        self.latency = latency
+        self.fail = fail or (lambda job: False)
+        self.jobs = {}
+        self.requests = []
+        self.rejected = {'LimitExceededException': 0, 'ThrottlingException': 0, 'ConflictException': 0}
+        # functions called with the job dict when a job completes or fails (job state change events)
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def _refresh(self, now=None):
+        """ Finish the jobs whose duration has elapsed, the lock is held """
+        now = time.time() if now is None else now
+        finished = []
+        for job in self.jobs.values():
+            if job['TranscriptionJobStatus'] == 'IN_PROGRESS' and now - job['_started'] >= self.duration:
+                finished.append(job)
+        for job in finished:
+            if self.fail(job):
+                job['TranscriptionJobStatus'] = 'FAILED'
+                job['FailureReason'] = 'The media file could not be transcribed (fake).'
+            else:
+                job['TranscriptionJobStatus'] = 'COMPLETED'
+                self._write_output(job)
+            job['CompletionTime'] = datetime.fromtimestamp(now, timezone.utc)
+        return finished
+
+    def _write_output(self, job):
+        bucket = job.get('OutputBucketName')
+        if not bucket:
+            return
+        key = job.get('OutputKey') or f"{job['TranscriptionJobName']}.json"
+        if key.endswith('/'):
+            key = f"{key}{job['TranscriptionJobName']}.json"
+        document = {'jobName': job['TranscriptionJobName'], 'accountId': '000000000000', 'status': 'COMPLETED',
+                    'results': {'transcripts': [{'transcript': ''}], 'items': []}}
+        storage.write_bytes(storage.to_uri(bucket, key), json.dumps(document))
+        job['Transcript'] = {'TranscriptFileUri': f'https://s3.amazonaws.com/{bucket}/{key}'}
+
+    def _notify(self, finished):
+        for job in finished:
+            for listener in list(self.listeners):
+                listener(self._public(job))
+
+    def poll(self):
+        ''' Finish the due jobs and call the listeners, returns the finished jobs '''
+        with self._lock:
+            finished = self._refresh()
+        self._notify(finished)
+        return [self._public(job) for job in finished]
+
+    @staticmethod
+    def _public(job):
+        return {name: value for name, value in job.items() if not name.startswith('_')}
+
+    def start_transcription_job(self, **request):
+        if self.latency:
+            time.sleep(self.latency)
+        for name in ('TranscriptionJobName', 'LanguageCode', 'Media'):
+            if name not in request:
+                raise client_error('BadRequestException', f'{name} is required', 'StartTranscriptionJob')
+        now = time.time()
+        with self._lock:
+            finished = self._refresh(now)
+            self.requests = [t for t in self.requests if now - t < 1.0]
+            error = None
+            if self.rate is not None and len(self.requests) >= self.rate:
+                error = 'ThrottlingException', 'Rate exceeded'
+            elif request['TranscriptionJobName'] in self.jobs:
+                error = 'ConflictException', 'The requested job name already exists.'
+            elif sum(job['TranscriptionJobStatus'] == 'IN_PROGRESS' for job in self.jobs.values()) >= self.max_concurrent:
+                error = 'LimitExceededException', 'You have exceeded the concurrent jobs limit.'
+            self.requests.append(now)
+            if error is None:
+                job = dict(request, TranscriptionJobStatus='IN_PROGRESS', _started=now,
+                           CreationTime=datetime.fromtimestamp(now, timezone.utc),
+                           StartTime=datetime.fromtimestamp(now, timezone.utc))
+                self.jobs[request['TranscriptionJobName']] = job
+            else:
+                self.rejected[error[0]] += 1
+        self._notify(finished)
+        if error is not None:
+            raise client_error(*error, 'StartTranscriptionJob')
+        return {'TranscriptionJob': self._public(job)}
+
+    def get_transcription_job(self, TranscriptionJobName):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            finished = self._refresh()
+            job = self.jobs.get(TranscriptionJobName)
+        self._notify(finished)
+        if job is None:
+            raise client_error('BadRequestException', 'The requested job couldn\'t be found.', 'GetTranscriptionJob')
+        return {'TranscriptionJob': self._public(job)}
+
+    def delete_transcription_job(self, TranscriptionJobName):
+        with self._lock:
+            if self.jobs.pop(TranscriptionJobName, None) is None:
+                raise client_error('BadRequestException', 'The requested job couldn\'t be found.',
+                                   'DeleteTranscriptionJob')
+        return {}
+
+    def list_transcription_jobs(self, Status=None, MaxResults=100, **kwargs):
+        with self._lock:
+            finished = self._refresh()
+            jobs = [self._public(job) for job in self.jobs.values()
+                    if Status is None or job['TranscriptionJobStatus'] == Status]
+        self._notify(finished)
+        return {'TranscriptionJobSummaries': jobs[:MaxResults]}
+
+
+class FakeContext:
+    ''' Lambda context object of one invocation '''
+
+    def __init__(self, function_name='local', timeout=900):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self.memory_limit_in_mb = 1024
+        self._deadline = time.time() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.time()) * 1000))
+
+
+def job_state_event(job):
+    ''' Transcribe job state change event of EventBridge for a job dict '''
+    detail = {'TranscriptionJobName': job['TranscriptionJobName'],
+              'TranscriptionJobStatus': job['TranscriptionJobStatus']}
+    if job.get('FailureReason'):
+        detail['FailureReason'] = job['FailureReason']
+    return {'version': '0', 'id': str(uuid.uuid4()), 'detail-type': 'Transcribe Job State Change',
+            'source': 'aws.transcribe', 'account': '000000000000',
+            'time': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'), 'region': 'us-east-1',
+            'resources': [], 'detail': detail}
+
+
+class JobEvents:
+    ''' EventBridge rule of the job state changes of a fake client
+
+    Events are kept until deliver or run invokes the handler, outside of the client calls, like the
+    asynchronous delivery of the real rule.
+
+    :param client: FakeTranscribeClient
+    '''
+
+    def __init__(self, client):
+        self.client = client
+        self.pending = deque()
+        self.delivered = []
+        client.listeners.append(lambda job: self.pending.append(job_state_event(job)))
+
+    def deliver(self, handler, context=None):
+        ''' Invoke handler with every pending event, returns the handler results '''
+        results = []
+        while self.pending:
+            event = self.pending.popleft()
+            results.append(handler(event, context or FakeContext('transcription-completed')))
+            self.delivered.append(event)
+        return results
+
+    def run(self, handler, timeout=60.0, interval=0.05):
+        ''' Deliver the events until no job is IN_PROGRESS or the timeout (seconds) expires
+
+        :return: The handler results
+        '''
+        results = []
+        deadline = time.time() + timeout
+        while True:
+            self.client.poll()
+            results += self.deliver(handler)
+            with self.client._lock:
+                running = any(job['TranscriptionJobStatus'] == 'IN_PROGRESS' for job in self.client.jobs.values())
+            if not running and not self.pending or time.time() > deadline:
+                return results
+            time.sleep(interval)
+
+
+def install(client=None):
+    ''' Use a fake Transcribe client for every storage.get_client('transcribe') call
+
+    :return: The client
+    '''
+    client = client or FakeTranscribeClient()
+    storage.set_client('transcribe', client)
+    return client
+
+
+def s3_record(bucket, key, etag=None, size=0, event_name='ObjectCreated:Put'):
+    ''' One record of an S3 notification, the key is URL encoded like in the real events '''
+    return {'eventVersion': '2.1', 'eventSource': 'aws:s3', 'eventName': event_name,
+            'eventTime': datetime.now(timezone.utc).isoformat(),
+            's3': {'bucket': {'name': bucket},
+                   'object': {'key': quote_plus(key), 'size': size,
+                              'eTag': etag or uuid.uuid4().hex, 'sequencer': f'{time.time_ns():X}'}}}
+
+
+def s3_event(records):
+    ''' S3 notification delivered to the function directly '''
+    return {'Records': list(records)}
+
+
+def sns_event(*messages):
+    ''' SNS delivery of S3 notifications, one SNS record per message (a list of S3 records) '''
+    return {'Records': [{'EventSource': 'aws:sns', 'EventSubscriptionArn': 'arn:aws:sns:local',
+                         'Sns': {'MessageId': str(uuid.uuid4()), 'Message': json.dumps({'Records': list(records)})}}
+                        for records in messages]}
@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import tracemalloc
+from contextlib import contextmanager
+
+
+# CloudWatch namespace of the embedded metric records
+NAMESPACE = os.environ.get('TRANSCRIBE_METRICS_NAMESPACE', 'TranscribePoc')
+# tracemalloc slows the code it traces, peak memory per span is only captured when enabled
+TRACE_MEMORY = os.environ.get('TRANSCRIBE_METRICS_MEMORY', '0') == '1'
+
+
+class StdoutSink:
+    ''' One JSON line per record on stdout, CloudWatch Logs extracts the embedded metrics '''
+
+    def write(self, record):
+        sys.stdout.write(json.dumps(record, default=str) + '\n')
+        sys.stdout.flush()
+
+
+class MemorySink:
+    ''' Keeps the records in a list, for tests and local runs '''
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+
+class Metrics:
+    ''' Spans (duration and optional peak memory) and counters of one unit of work, e.g. a
+        Lambda invocation, written as a single CloudWatch embedded metric format record
+
+    :param dimensions: dict of dimensions of every metric, e.g. {'Function': 'sentiment'}
+    :param sink: Object with write(record), defaults to the module sink
+    :param trace_memory: Capture the tracemalloc peak of every span
+    '''
+
+    def __init__(self, dimensions=None, sink=None, trace_memory=TRACE_MEMORY):
+        self.dimensions = dict(dimensions or {})
+        self.sink = sink
+        self.trace_memory = trace_memory
+        self.values = {}
+        self.units = {}
+        self._lock = threading.Lock()
+        # running peak of the open spans of each thread, innermost last
+        self._local = threading.local()
+
+    @property
+    def _peaks(self):
+        if not hasattr(self._local, 'peaks'):
+            self._local.peaks = []
+        return self._local.peaks
+
+    def _put(self, name, value, unit, add=False):
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + value if add else value
+            self.units[name] = unit
+
+    def count(self, name, value=1, unit='Count'):
+        ''' Add value to a counter (files read, bytes fetched, API calls, rows...) '''
+        self._put(name, value, unit, add=True)
+
+    def gauge(self, name, value, unit='None'):
+        ''' Set a metric to value '''
+        self._put(name, value, unit)
+
+    @contextmanager
+    def span(self, name):
+        ''' Time a block, records '<name>.duration' (ms) and '<name>.peak_memory' (MB) '''
+        tracing = self.trace_memory
+        if tracing:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            if self._peaks:
+                # fold the peak so far into the enclosing span before resetting it
+                self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self._peaks.append(0)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self._put(f'{name}.duration', (time.perf_counter() - start) * 1000, 'Milliseconds', add=True)
+            if tracing:
+                peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+                tracemalloc.reset_peak()
+                if started:
+                    tracemalloc.stop()
+                self._put(f'{name}.peak_memory', peak / 2 ** 20, 'Megabytes')
+
+    def timed(self, name=None):
+        ''' Decorator form of span, the span is named after the function by default '''
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name or function.__name__):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self):
+        ''' Embedded metric format record of the current values '''
+        metrics = [{'Name': name, 'Unit': self.units[name]} for name in sorted(self.values)]
+        record = {'_aws': {'Timestamp': int(time.time() * 1000),
+                           'CloudWatchMetrics': [{'Namespace': NAMESPACE,
+                                                  'Dimensions': [sorted(self.dimensions)],
+                                                  'Metrics': metrics}]}}
+        record.update(self.dimensions)
+        record.update(self.values)
+        return record
+
+    def flush(self):
+        ''' Write the record to the sink and start over '''
+        with self._lock:
+            empty = not self.values
+        if not empty:
+            (self.sink or _sink).write(self.record())
+        with self._lock:
+            self.values, self.units = {}, {}
+
+
+_sink = StdoutSink()
+_default = Metrics()
+# Metrics of the running handler, shared by its worker threads (a Lambda runs one invocation
+# at a time per process)
+_active = None
+
+
+def set_sink(sink):
+    ''' Replace the sink of every Metrics without its own sink (e.g. MemorySink() in tests) '''
+    global _sink
+    _sink = sink
+
+
+def current():
+    ''' Metrics of the running instrumented handler, or the module default outside of one '''
+    return _active or _default
+
+
+def count(name, value=1, unit='Count'):
+    current().count(name, value, unit)
+
+
+def gauge(name, value, unit='None'):
+    current().gauge(name, value, unit)
+
+
+def span(name):
+    return current().span(name)
+
+
+def timed(name=None):
+    ''' Decorator that times a function in the metrics of the running handler '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument(function_name=None, **dimensions):
+    ''' Decorator of a Lambda handler: the whole invocation is a span, every metric recorded
+        during it (see count and span) is written as one record when it ends
+
+    :param function_name: Value of the 'Function' dimension, defaults to the module name
+    :param dimensions: Extra dimensions
+    '''
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            global _active
+            metrics = Metrics(dict(Function=function_name or handler.__module__, **dimensions))
+            previous, _active = _active, metrics
+            try:
+                with metrics.span('handler'):
+                    return handler(*args, **kwargs)
+            finally:
+                _active = previous
+                metrics.flush()
+        return wrapper
+    return decorator
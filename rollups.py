@@ -0,0 +1,141 @@
+''' Per call rollups of the word store (see wordstore.py): confidence statistics, low confidence
+fraction, speech seconds per channel and the lowest confidence words, a few hundred bytes per call
+'''
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+# Words under this confidence count in 'low_fraction'
+LOW_CONFIDENCE = 0.5
+QUANTILES = (0.1, 0.5, 0.9)
+# Lowest confidence words kept per call
+LOWEST_WORDS = 10
+# Rows pushed at a time into LowestK
+CHUNK_ROWS = 65536
+
+_WORD = pa.struct([('content', pa.string()), ('confidence', pa.float32()), ('start_time', pa.float64())])
+SCHEMA = pa.schema([('file', pa.string()), ('words', pa.int64()),
+                    ('mean_confidence', pa.float64()), ('min_confidence', pa.float32())]
+                   + [(f'p{round(q * 100)}_confidence', pa.float64()) for q in QUANTILES]
+                   + [('low_fraction', pa.float64()), ('seconds', pa.float64()),
+                      ('channel_seconds', pa.map_(pa.string(), pa.float64())),
+                      ('lowest_words', pa.list_(_WORD))])
+
+
+class LowestK:
+    ''' The k rows of lowest value of every group, fed in chunks
+
+    A chunk only keeps the rows under the k-th value kept so far for their group, so memory stays
+    bounded by k rows per group plus one chunk and only the survivors are ever sorted.
+
+    :param groups: Number of groups, rows are pushed with group codes in [0, groups)
+    :param k: Rows kept per group
+    '''
+
+    def __init__(self, groups, k=LOWEST_WORDS):
+        self.k = k
+        self.codes = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0, dtype=np.float64)
+        self.payload = None
+        # value a row must be under to enter its group, infinite until the group has k rows
+        self.threshold = np.full(groups, np.inf)
+
+    def push(self, codes, values, **payload):
+        ''' Add rows: group codes, values and payload columns (NumPy arrays of the same length) '''
+        codes, values = np.asarray(codes, dtype=np.int64), np.asarray(values, dtype=np.float64)
+        keep = values < self.threshold[codes]
+        if self.payload is None:
+            self.payload = {name: column[:0] for name, column in payload.items()}
+        codes = np.concatenate([self.codes, codes[keep]])
+        values = np.concatenate([self.values, values[keep]])
+        payload = {name: np.concatenate([self.payload[name], column[keep]]) for name, column in payload.items()}
+
+        order = np.lexsort((values, codes))
+        codes = codes[order]
+        rank = np.arange(len(codes)) - np.searchsorted(codes, codes, 'left')
+        order = order[rank < self.k]
+        self.codes, self.values = codes[rank < self.k], values[order]
+        self.payload = {name: column[order] for name, column in payload.items()}
+
+        if len(self.codes):
+            # the last kept row of a full group holds its k-th value
+            last = np.flatnonzero(np.r_[self.codes[1:] != self.codes[:-1], True])
+            counts = np.bincount(self.codes, minlength=len(self.threshold))
+            last = last[counts[self.codes[last]] == self.k]
+            self.threshold[self.codes[last]] = self.values[last]
+
+    def groups(self):
+        ''' {group code: list of row dicts (payload columns), lowest value first} '''
+        rows = {}
+        columns = list(self.payload or {})
+        for i, code in enumerate(self.codes.tolist()):
+            rows.setdefault(code, []).append({name: self.payload[name][i] for name in columns})
+        return rows
+
+
+def rollup(words, k=LOWEST_WORDS, low=LOW_CONFIDENCE, quantiles=QUANTILES):
+    ''' Rollups of every call of a word table, one vectorized group-by over the rows
+
+    :param words: pyarrow Table with the wordstore.SCHEMA columns
+    :param k: Lowest confidence words kept per call
+    :param low: Words under this confidence count in 'low_fraction'
+    :param quantiles: Confidence quantiles, must match QUANTILES to be stored with SCHEMA
+    :return: pyarrow Table with SCHEMA, one row per file
+    '''
+    if not len(words):
+        return SCHEMA.empty_table()
+    frame = words.select(['file', 'channel', 'content', 'start_time', 'end_time', 'confidence']).to_pandas()
+    files = frame['file'].cat.remove_unused_categories()
+    codes = files.cat.codes.to_numpy().astype(np.int64)
+    confidence = frame['confidence'].to_numpy()
+    frame = pd.DataFrame({'file': codes, 'confidence': confidence.astype(np.float64),
+                          'low': confidence < np.float32(low),
+                          'seconds': frame['end_time'].to_numpy() - frame['start_time'].to_numpy(),
+                          'channel': frame['channel'], 'content': frame['content'], 'start_time': frame['start_time']})
+
+    grouped = frame.groupby('file', sort=True)
+    stats = grouped.agg(words=('confidence', 'size'), mean_confidence=('confidence', 'mean'),
+                        min_confidence=('confidence', 'min'), low_fraction=('low', 'mean'),
+                        seconds=('seconds', 'sum'))
+    stats = stats.join(grouped['confidence'].quantile(list(quantiles)).unstack())
+
+    per_channel = frame.groupby(['file', 'channel'], observed=True, sort=True)['seconds'].sum()
+    channel_seconds = {code: [] for code in stats.index}
+    for (code, channel), seconds in per_channel.items():
+        channel_seconds[code].append((channel, float(seconds)))
+
+    lowest = LowestK(len(files.cat.categories), k)
+    content = frame['content'].astype(object).to_numpy()
+    start = frame['start_time'].to_numpy()
+    for i in range(0, len(frame), CHUNK_ROWS):
+        chunk = slice(i, i + CHUNK_ROWS)
+        lowest.push(codes[chunk], confidence[chunk], content=content[chunk], confidence=confidence[chunk],
+                    start_time=start[chunk])
+    lowest = lowest.groups()
+
+    names = files.cat.categories.to_numpy(dtype=object)
+    columns = {'file': names[stats.index.to_numpy()], 'words': stats['words'].to_numpy(),
+               'mean_confidence': stats['mean_confidence'].to_numpy(),
+               'min_confidence': stats['min_confidence'].to_numpy(dtype=np.float32)}
+    for q in quantiles:
+        columns[f'p{round(q * 100)}_confidence'] = stats[q].to_numpy()
+    columns.update({'low_fraction': stats['low_fraction'].to_numpy(), 'seconds': stats['seconds'].to_numpy(),
+                    'channel_seconds': [channel_seconds[code] for code in stats.index],
+                    'lowest_words': [lowest.get(code, []) for code in stats.index]})
+    return pa.Table.from_pydict(columns, schema=SCHEMA)
+
+
+def merge(tables, drop=()):
+    ''' Rollup tables as one, the later rows of a file replace the earlier ones
+
+    :param tables: List of rollup tables (or None), oldest first
+    :param drop: Files removed from the result
+    :return: pyarrow Table with SCHEMA sorted by file
+    '''
+    frames = [table.to_pandas() for table in tables if table is not None and len(table)]
+    if not frames:
+        return SCHEMA.empty_table()
+    frame = pd.concat(frames, ignore_index=True)
+    frame = frame[~frame['file'].isin(set(drop))].drop_duplicates('file', keep='last').sort_values('file')
+    return pa.Table.from_pandas(frame, schema=SCHEMA, preserve_index=False)
@@ -0,0 +1,808 @@
+import io
+import os
+import hashlib
+import bisect
+import fcntl
+import itertools
+import shutil
+import tempfile
+import threading
+import time
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from importlib.metadata import version, PackageNotFoundError
+import metrics
+
+
+# Max pooled connections of every client, also the default number of threads of bulk operations
+MAX_POOL_CONNECTIONS = 32
+# When set, s3://<bucket>/<key> is served from <STORAGE_ROOT>/<bucket>/<key> (offline runs)
+STORAGE_ROOT = os.environ.get('TRANSCRIBE_STORAGE_ROOT')
+
+_session = None
+_clients = {}
+_backends = {}
+_lock = threading.Lock()
+
+# Concurrent listings used by the callers that list big prefixes, see list_objects
+LIST_WORKERS = 16
+# Oldest releases with the Transcribe parameters used by the functions (OutputKey), the layer
+# pins newer ones (layer/requirements.txt)
+MIN_VERSIONS = {'boto3': '1.17.0', 'botocore': '1.20.0'}
+
+
+def check_versions(minimums=None):
+    ''' Fail at import time when the bundled dependency layer is missing or too old, instead of
+        failing on the first API call
+
+    :param minimums: dict {package: oldest version}, defaults to MIN_VERSIONS
+    :return: dict {package: installed version}
+    '''
+    installed = {}
+    for package, minimum in (minimums or MIN_VERSIONS).items():
+        try:
+            installed[package] = version(package)
+        except PackageNotFoundError:
+            raise RuntimeError(f'{package} is not installed, deploy the dependency layer (layer/build.sh)')
+        if _version_tuple(installed[package]) < _version_tuple(minimum):
+            raise RuntimeError(f'{package} {installed[package]} is older than {minimum}, '
+                               f'redeploy the dependency layer (layer/build.sh)')
+    return installed
+
+
+def _version_tuple(text):
+    return tuple(int(part) if part.isdigit() else 0 for part in text.split('.')[:3])
+
+
+def get_client(service, region_name=None):
+    ''' Shared boto3 client of the process, created once and reused across calls and threads
+
+    :param service: AWS service name, e.g. 's3', 'transcribe', 'comprehend'
+    :param region_name: AWS region, defaults to the session region
+    :return: boto3 client with a connection pool of MAX_POOL_CONNECTIONS
+    '''
+    global _session
+    key = (service, region_name)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            if key not in _clients:
+                # boto3 is only imported by the first client, imports that never call AWS stay fast
+                import boto3
+                from botocore.config import Config
+                if _session is None:
+                    _session = boto3.session.Session()
+                config = Config(max_pool_connections=MAX_POOL_CONNECTIONS,
+                                retries={'max_attempts': 10, 'mode': 'adaptive'})
+                client = _session.client(service, region_name=region_name, config=config)
+                client.meta.events.register('before-call', _count_call)
+                _clients[key] = client
+            client = _clients[key]
+    return client
+
+
+def _count_call(model=None, **kwargs):
+    """ botocore hook, every API request is counted in the running metrics """
+    metrics.count('api_calls')
+
+
+def set_client(service, client, region_name=None):
+    ''' Replace the shared client of a service, e.g. with a local fake
+
+    :param service: AWS service name
+    :param client: Object with the boto3 client methods used by the callers
+    :param region_name: AWS region of the client
+    '''
+    with _lock:
+        _clients[(service, region_name)] = client
+
+
+class PreconditionFailed(Exception):
+    ''' A conditional write found the object changed (or existing) '''
+
+
+class S3Backend:
+    ''' Objects stored in AWS S3, all calls share the pooled 's3' client '''
+
+    @property
+    def client(self):
+        return get_client('s3')
+
+    def get(self, bucket, key):
+        return self.client.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+    def get_tagged(self, bucket, key):
+        response = self.client.get_object(Bucket=bucket, Key=key)
+        return response['Body'].read(), response['ETag']
+
+    def open(self, bucket, key):
+        return self.client.get_object(Bucket=bucket, Key=key)['Body']
+
+    def get_range(self, bucket, key, start, end):
+        return self.client.get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{end - 1}')['Body'].read()
+
+    def put(self, bucket, key, data):
+        self.client.put_object(Bucket=bucket, Key=key, Body=data)
+
+    def put_if(self, bucket, key, data, etag=None):
+        ''' Write only when the object still has etag, or does not exist when etag is None
+            (S3 conditional writes), returns the new ETag '''
+        from botocore.exceptions import ClientError
+        condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+        try:
+            return self.client.put_object(Bucket=bucket, Key=key, Body=data, **condition)['ETag']
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409'):
+                raise PreconditionFailed(f's3://{bucket}/{key}') from e
+            raise
+
+    def upload_file(self, file_name, bucket, key):
+        self.client.upload_file(file_name, bucket, key)
+
+    def download_file(self, bucket, key, file_name):
+        self.client.download_file(bucket, key, file_name)
+
+    def copy(self, src_bucket, src_key, bucket, key):
+        self.client.copy({'Bucket': src_bucket, 'Key': src_key}, bucket, key)
+
+    def delete(self, bucket, key):
+        self.client.delete_object(Bucket=bucket, Key=key)
+
+    def create_multipart(self, bucket, key):
+        return self.client.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+
+    def find_multipart(self, bucket, key):
+        ''' Id of the latest unfinished multipart upload of key, None if there is none '''
+        uploads, kwargs = [], dict(Bucket=bucket, Prefix=key)
+        while True:
+            response = self.client.list_multipart_uploads(**kwargs)
+            uploads += [upload for upload in response.get('Uploads', []) if upload['Key'] == key]
+            if not response.get('IsTruncated'):
+                break
+            kwargs.update(KeyMarker=response['NextKeyMarker'], UploadIdMarker=response['NextUploadIdMarker'])
+        return max(uploads, key=lambda upload: upload['Initiated'])['UploadId'] if uploads else None
+
+    def list_parts(self, bucket, key, upload_id):
+        ''' Parts already uploaded, {part number: {'ETag', 'Size'}} '''
+        parts, kwargs = {}, dict(Bucket=bucket, Key=key, UploadId=upload_id)
+        while True:
+            response = self.client.list_parts(**kwargs)
+            for part in response.get('Parts', []):
+                parts[part['PartNumber']] = {'ETag': part['ETag'], 'Size': part['Size']}
+            if not response.get('IsTruncated'):
+                return parts
+            kwargs['PartNumberMarker'] = response['NextPartNumberMarker']
+
+    def upload_part(self, bucket, key, upload_id, number, data):
+        return self.client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                                       PartNumber=number, Body=data)['ETag']
+
+    def complete_multipart(self, bucket, key, upload_id, etags):
+        ''' Assemble the parts, etags is the list of part ETags in order '''
+        parts = [{'PartNumber': number, 'ETag': etag} for number, etag in enumerate(etags, 1)]
+        self.client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                              MultipartUpload={'Parts': parts})
+
+    def abort_multipart(self, bucket, key, upload_id):
+        self.client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+
+    def head(self, bucket, key):
+        from botocore.exceptions import ClientError
+        try:
+            response = self.client.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return {'Key': key, 'Size': response['ContentLength'], 'ETag': response['ETag'],
+                'LastModified': response['LastModified']}
+
+    def list_page(self, bucket, prefix, token=None, start_after=None, delimiter=None, max_keys=1000):
+        ''' One page of a listing
+
+        :return: tuple (objects, common prefixes, token of the next page or None)
+        '''
+        kwargs = dict(Bucket=bucket, Prefix=prefix, MaxKeys=max_keys)
+        if token:
+            kwargs['ContinuationToken'] = token
+        elif start_after:
+            kwargs['StartAfter'] = start_after
+        if delimiter:
+            kwargs['Delimiter'] = delimiter
+        response = self.client.list_objects_v2(**kwargs)
+        objects = [{'Key': obj['Key'], 'Size': obj['Size'], 'ETag': obj['ETag'],
+                    'LastModified': obj['LastModified']} for obj in response.get('Contents', [])]
+        prefixes = [common['Prefix'] for common in response.get('CommonPrefixes', [])]
+        return objects, prefixes, response.get('NextContinuationToken') if response.get('IsTruncated') else None
+
+
+class LocalBackend:
+    ''' Objects stored as files under root/<bucket>/<key>, same interface as S3Backend
+
+    :param root: Directory that holds one folder per bucket
+    :param latency: Seconds added to every listing page, stands in for the S3 round trip
+    '''
+
+    def __init__(self, root, latency=0.0):
+        self.root = root
+        self.latency = latency
+        # folder walks by top folder and the count of writes through this backend, see _keys
+        self._walks = {}
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+    def _changed(self):
+        """ Count a write, the cached walks taken before it are not reused """
+        with self._writes_lock:
+            self._writes += 1
+
+    def path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def get(self, bucket, key):
+        with open(self.path(bucket, key), 'rb') as f:
+            return f.read()
+
+    def get_tagged(self, bucket, key):
+        etag = self._describe(bucket, key)['ETag']
+        return self.get(bucket, key), etag
+
+    def open(self, bucket, key):
+        return open(self.path(bucket, key), 'rb')
+
+    def get_range(self, bucket, key, start, end):
+        with open(self.path(bucket, key), 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def put(self, bucket, key, data):
+        path = self.path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(data, str):
+            data = data.encode('utf8')
+        with open(path, 'wb') as f:
+            f.write(data)
+        self._changed()
+
+    def put_if(self, bucket, key, data, etag=None):
+        path = self.path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # the lock file serializes the conditional writes of every process sharing root
+        digest = hashlib.sha1(os.path.abspath(self.root).encode('utf8')).hexdigest()[:16]
+        with open(os.path.join(tempfile.gettempdir(), f'transcribe-put-if-{digest}.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                current = self.head(bucket, key)
+                if (current and current['ETag']) != etag:
+                    raise PreconditionFailed(f's3://{bucket}/{key}')
+                temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+                with open(temporary, 'wb') as f:
+                    f.write(data.encode('utf8') if isinstance(data, str) else data)
+                os.replace(temporary, path)
+                self._changed()
+                return self._describe(bucket, key)['ETag']
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def upload_file(self, file_name, bucket, key):
+        path = self.path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(file_name, path)
+        self._changed()
+
+    def download_file(self, bucket, key, file_name):
+        shutil.copyfile(self.path(bucket, key), file_name)
+
+    def copy(self, src_bucket, src_key, bucket, key):
+        self.upload_file(self.path(src_bucket, src_key), bucket, key)
+
+    def delete(self, bucket, key):
+        # deleting a missing object is not an error, like in S3
+        try:
+            os.remove(self.path(bucket, key))
+        except FileNotFoundError:
+            pass
+        self._changed()
+
+    def _uploads(self, bucket, key):
+        """ Folder of the unfinished multipart uploads of a key, kept outside of the buckets """
+        digest = hashlib.sha256(f'{bucket}/{key}'.encode('utf8')).hexdigest()
+        return os.path.join(self.root, '.multipart', digest)
+
+    def create_multipart(self, bucket, key):
+        upload_id = f'{time.time_ns():x}'
+        os.makedirs(os.path.join(self._uploads(bucket, key), upload_id))
+        return upload_id
+
+    def find_multipart(self, bucket, key):
+        try:
+            uploads = os.listdir(self._uploads(bucket, key))
+        except FileNotFoundError:
+            return None
+        # ids are hexadecimal timestamps of the same length, the latest sorts last
+        return max(uploads) if uploads else None
+
+    def list_parts(self, bucket, key, upload_id):
+        folder = os.path.join(self._uploads(bucket, key), upload_id)
+        parts = {}
+        for name in os.listdir(folder):
+            if name.isdigit():
+                with open(os.path.join(folder, name), 'rb') as f:
+                    data = f.read()
+                parts[int(name)] = {'ETag': f'"{hashlib.md5(data).hexdigest()}"', 'Size': len(data)}
+        return parts
+
+    def upload_part(self, bucket, key, upload_id, number, data):
+        folder = os.path.join(self._uploads(bucket, key), upload_id)
+        with open(os.path.join(folder, f'{number}.tmp'), 'wb') as f:
+            f.write(data)
+        os.replace(os.path.join(folder, f'{number}.tmp'), os.path.join(folder, str(number)))
+        return f'"{hashlib.md5(data).hexdigest()}"'
+
+    def complete_multipart(self, bucket, key, upload_id, etags):
+        folder = os.path.join(self._uploads(bucket, key), upload_id)
+        path = self.path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as out:
+            for number in range(1, len(etags) + 1):
+                with open(os.path.join(folder, str(number)), 'rb') as f:
+                    shutil.copyfileobj(f, out)
+        shutil.rmtree(folder)
+        self._changed()
+
+    def abort_multipart(self, bucket, key, upload_id):
+        shutil.rmtree(os.path.join(self._uploads(bucket, key), upload_id), ignore_errors=True)
+
+    def _describe(self, bucket, key):
+        stat = os.stat(self.path(bucket, key))
+        # size and modification time stand in for the content hash of S3
+        return {'Key': key, 'Size': stat.st_size, 'ETag': f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"',
+                'LastModified': datetime.fromtimestamp(stat.st_mtime, timezone.utc)}
+
+    def head(self, bucket, key):
+        if not os.path.isfile(self.path(bucket, key)):
+            return None
+        return self._describe(bucket, key)
+
+    def _walk(self, base, top):
+        """ Sorted keys under top and the modification time of every folder walked """
+        keys, folders = [], {}
+        for dirpath, _, filenames in os.walk(top):
+            folders[dirpath] = os.stat(dirpath).st_mtime_ns
+            relative = os.path.relpath(dirpath, base).replace(os.sep, '/')
+            relative = '' if relative == '.' else f'{relative}/'
+            keys.extend(relative + name for name in filenames)
+        keys.sort()
+        return folders, keys
+
+    def _keys(self, bucket, prefix):
+        """ Sorted keys of the bucket that start with prefix
+
+        The walk of a folder is reused while nothing was written through this backend and none of
+        its folders changed (writes of other processes), so concurrent shards of a listing do not
+        walk the same tree again. A missing folder is never cached.
+        """
+        base = os.path.join(self.root, bucket)
+        top = os.path.join(base, *prefix.split('/')[:-1])
+        writes = self._writes
+        cached = self._walks.get(top)
+        try:
+            fresh = cached is not None and cached[2] == writes and all(
+                os.stat(folder).st_mtime_ns == mtime for folder, mtime in cached[0].items())
+        except FileNotFoundError:
+            fresh = False
+        if not fresh:
+            folders, keys = self._walk(base, top)
+            if folders:
+                self._walks[top] = folders, keys, writes
+            else:
+                self._walks.pop(top, None)
+        else:
+            keys = cached[1]
+        return keys[bisect.bisect_left(keys, prefix):bisect.bisect_left(keys, prefix + chr(0x10FFFF))]
+
+    def list_page(self, bucket, prefix, token=None, start_after=None, delimiter=None, max_keys=1000):
+        ''' One page of a listing, the token is the last key or common prefix returned
+
+        :return: tuple (objects, common prefixes, token of the next page or None)
+        '''
+        if self.latency:
+            time.sleep(self.latency)
+        after = token or start_after or ''
+        keys = self._keys(bucket, prefix)
+        if token and delimiter and token.endswith(delimiter):
+            # the token is a common prefix, all its keys were returned
+            after = token + chr(0x10FFFF)
+
+        entries = []
+        truncated = False
+        for key in itertools.islice(keys, bisect.bisect_right(keys, after), None):
+            cut = key.find(delimiter, len(prefix)) if delimiter else -1
+            if cut >= 0:
+                entry = (key[:cut + len(delimiter)], None)
+                if entries and entries[-1][0] == entry[0]:
+                    continue
+            else:
+                entry = (key, key)
+            if len(entries) == max_keys:
+                truncated = True
+                break
+            entries.append(entry)
+        objects = [self._describe(bucket, key) for _, key in entries if key is not None]
+        prefixes = [name for name, key in entries if key is None]
+        return objects, prefixes, entries[-1][0] if truncated else None
+
+
+def get_backend(uri):
+    ''' Resolve a s3:// or file:// URI
+
+    :param uri: URI of an object or prefix, a plain path is taken as file://
+    :return: tuple (backend, bucket, key)
+    '''
+    fpath = urlparse(uri)
+    scheme = fpath.scheme or 'file'
+    if scheme == 's3':
+        bucket, key = fpath.netloc, fpath.path.lstrip('/')
+    elif scheme == 'file':
+        bucket, key = '', os.path.abspath(fpath.netloc + fpath.path).lstrip(os.sep).replace(os.sep, '/')
+        if uri.endswith('/'):
+            key = f'{key}/'
+    else:
+        raise ValueError(f'Unsupported storage scheme: {uri}')
+
+    backend = _backends.get(scheme)
+    if backend is None:
+        if scheme == 'file':
+            backend = LocalBackend(os.sep)
+        else:
+            backend = LocalBackend(STORAGE_ROOT) if STORAGE_ROOT else S3Backend()
+        backend = _backends.setdefault(scheme, backend)
+    return backend, bucket, key
+
+
+def set_backend(scheme, backend):
+    ''' Replace the backend of a URI scheme, e.g. a LocalBackend with latency for 's3'
+
+    :param scheme: 's3' or 'file'
+    :param backend: Object with the S3Backend methods
+    '''
+    _backends[scheme] = backend
+
+
+def to_uri(bucket, key, scheme='s3'):
+    ''' Build the URI of an object '''
+    return f'{scheme}://{bucket}/{key}'
+
+
+def read_bytes(uri):
+    ''' Content of an object
+
+    :param uri: s3:// or file:// URI
+    :return: bytes
+    '''
+    backend, bucket, key = get_backend(uri)
+    data = backend.get(bucket, key)
+    metrics.count('files_read')
+    metrics.count('bytes_fetched', len(data), 'Bytes')
+    return data
+
+
+def read_tagged(uri):
+    ''' Content of an object and the ETag of the version that was read
+
+    :param uri: s3:// or file:// URI
+    :return: (bytes, ETag)
+    '''
+    backend, bucket, key = get_backend(uri)
+    data, etag = backend.get_tagged(bucket, key)
+    metrics.count('files_read')
+    metrics.count('bytes_fetched', len(data), 'Bytes')
+    return data, etag
+
+
+def open_uri(uri):
+    ''' Binary file-like stream of an object, the caller closes it
+
+    :param uri: s3:// or file:// URI
+    :return: object with read()
+    '''
+    backend, bucket, key = get_backend(uri)
+    metrics.count('files_read')
+    return backend.open(bucket, key)
+
+
+class RangeReader(io.RawIOBase):
+    ''' Seekable, read only file object of an object, every read is a ranged GET (e.g. for
+        pyarrow readers that only need the footer and a few column chunks of a file)
+
+    :param uri: s3:// or file:// URI
+    :param size: Size of the object, read with a HEAD request when not given
+    '''
+
+    def __init__(self, uri, size=None):
+        super().__init__()
+        self.uri = uri
+        self.backend, self.bucket, self.key = get_backend(uri)
+        if size is None:
+            size = self.backend.head(self.bucket, self.key)['Size']
+        self.size = size
+        self._position = 0
+        metrics.count('files_read')
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self.size}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.size, self._position + size)
+        if end <= self._position:
+            return b''
+        data = self.backend.get_range(self.bucket, self.key, self._position, end)
+        self._position += len(data)
+        metrics.count('bytes_fetched', len(data), 'Bytes')
+        return data
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def iter_lines(uri, encoding='utf8', chunk_size=1 << 16):
+    ''' Stream the lines of a text object without reading it whole into memory
+
+    :param uri: s3:// or file:// URI
+    :param encoding: Text encoding of the object
+    :param chunk_size: Bytes read per request
+    :return: Generator of lines (str) without line endings
+    '''
+    stream = open_uri(uri)
+    try:
+        pending = b''
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line.rstrip(b'\r').decode(encoding)
+        if pending:
+            yield pending.rstrip(b'\r').decode(encoding)
+    finally:
+        stream.close()
+
+
+def write_bytes(uri, data):
+    ''' Store data (bytes or str) as an object
+
+    :param uri: s3:// or file:// URI
+    :param data: Content of the object
+    '''
+    backend, bucket, key = get_backend(uri)
+    backend.put(bucket, key, data)
+    metrics.count('files_written')
+    metrics.count('bytes_written', len(data), 'Bytes')
+
+
+def write_if(uri, data, etag=None):
+    ''' Store data only when the object still has the ETag read before, or does not exist yet
+        when etag is None
+
+    :param uri: s3:// or file:// URI
+    :param data: Content of the object
+    :param etag: ETag of the version that is replaced, None to create the object
+    :return: ETag of the new version
+    :raises PreconditionFailed: The object changed (or exists) since it was read
+    '''
+    backend, bucket, key = get_backend(uri)
+    etag = backend.put_if(bucket, key, data, etag)
+    metrics.count('files_written')
+    metrics.count('bytes_written', len(data), 'Bytes')
+    return etag
+
+
+def upload_file(file_name, uri):
+    ''' Upload a local file, S3 uses the managed (multipart) transfer '''
+    backend, bucket, key = get_backend(uri)
+    backend.upload_file(file_name, bucket, key)
+
+
+def download_file(uri, file_name):
+    ''' Download an object to a local file '''
+    backend, bucket, key = get_backend(uri)
+    backend.download_file(bucket, key, file_name)
+
+
+def copy(src_uri, uri):
+    ''' Copy an object inside the same backend '''
+    backend, src_bucket, src_key = get_backend(src_uri)
+    _, bucket, key = get_backend(uri)
+    backend.copy(src_bucket, src_key, bucket, key)
+
+
+def delete(uri):
+    ''' Remove an object '''
+    backend, bucket, key = get_backend(uri)
+    backend.delete(bucket, key)
+
+
+def head(uri):
+    ''' Size, ETag and modification time of an object
+
+    :return: dict with 'Key', 'Size', 'ETag', 'LastModified' or None if it does not exist
+    '''
+    backend, bucket, key = get_backend(uri)
+    return backend.head(bucket, key)
+
+
+def _list_range(backend, bucket, prefix, start_after=None, lower=None, upper=None):
+    """ Objects under prefix with key > start_after, key >= lower and key < upper, page by page """
+    objects = []
+    token = None
+    while True:
+        page, _, token = backend.list_page(bucket, prefix, token=token, start_after=start_after)
+        for obj in page:
+            if upper is not None and obj['Key'] >= upper:
+                return objects
+            if lower is None or obj['Key'] >= lower:
+                objects.append(obj)
+        if token is None:
+            return objects
+
+
+def _range_bounds(prefix, keys):
+    """ Key range boundaries after the last of keys, guessed from the characters they use """
+    last = keys[-1]
+    stem = os.path.commonprefix([keys[0], last])
+    chars = set(''.join(key[len(prefix):] for key in keys))
+    bounds = set()
+    for depth in (len(prefix), len(stem) - 1, len(stem)):
+        if len(prefix) <= depth < len(last):
+            bounds.update(last[:depth] + char for char in chars if char > last[depth])
+    return sorted(bounds)
+
+
+def _shards(backend, bucket, prefix, delimiter='/'):
+    """ Split a prefix into listings that can run concurrently
+
+    When one delimiter page holds the whole folder, each sub-prefix is a shard. Otherwise the
+    keys after the first page are split in ranges on the characters seen in that page.
+
+    :return: tuple (objects already listed, list of (prefix, start_after, lower, upper))
+    """
+    while True:
+        objects, prefixes, token = backend.list_page(bucket, prefix, delimiter=delimiter)
+        if token is None and len(prefixes) == 1 and not objects:
+            # a single folder, look inside it
+            prefix = prefixes[0]
+            continue
+        if token is None:
+            return objects, [(common, None, None, None) for common in prefixes]
+
+        if prefixes:
+            objects, _, token = backend.list_page(bucket, prefix)
+            if token is None:
+                return objects, []
+        last = objects[-1]['Key']
+        bounds = _range_bounds(prefix, [obj['Key'] for obj in objects])
+        # each range starts right before its lower bound (previous character followed by the
+        # highest code point), lower still filters the keys in case one sorts in between
+        shards = [(prefix, last, None, bounds[0] if bounds else None)]
+        for lower, upper in zip(bounds, bounds[1:] + [None]):
+            start_after = lower[:-1] + chr(ord(lower[-1]) - 1) + chr(0x10FFFF)
+            shards.append((prefix, start_after, lower, upper))
+        return objects, shards
+
+
+def list_objects(prefix_uri, start_after=None, workers=1):
+    ''' List every object under a prefix
+
+    :param prefix_uri: s3:// or file:// URI of the prefix
+    :param start_after: Only list keys after this one
+    :param workers: Number of concurrent listings, more than 1 shards the prefix (sub-prefixes
+                    or key ranges)
+    :return: Generator of dicts with 'Key', 'Size', 'ETag', 'LastModified' sorted by key
+    '''
+    backend, bucket, prefix = get_backend(prefix_uri)
+    if workers > 1 and not start_after:
+        objects, shards = _shards(backend, bucket, prefix)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for listed in pool.map(lambda shard: _list_range(backend, bucket, *shard), shards):
+                objects.extend(listed)
+        yield from sorted(objects, key=lambda obj: obj['Key'])
+        return
+
+    token = None
+    while True:
+        objects, _, token = backend.list_page(bucket, prefix, token=token, start_after=start_after)
+        yield from objects
+        if token is None:
+            break
+
+
+def list_uris(prefix_uri, workers=1):
+    ''' URIs of every object under a prefix
+
+    :param prefix_uri: s3:// or file:// URI of the prefix
+    :param workers: Number of concurrent listings, see list_objects
+    :return: List of URIs with the scheme and bucket of prefix_uri
+    '''
+    return [object_uri(prefix_uri, obj['Key']) for obj in list_objects(prefix_uri, workers=workers)]
+
+
+def object_uri(prefix_uri, key):
+    ''' URI of a listed key with the scheme and bucket of prefix_uri '''
+    fpath = urlparse(prefix_uri)
+    if (fpath.scheme or 'file') == 'file':
+        return f'file:///{key}'
+    return to_uri(fpath.netloc, key, fpath.scheme)
+
+
+def _read_listing(manifest_uri):
+    """ Objects of the last listing saved at manifest_uri, {} if there is none """
+    backend, bucket, key = get_backend(manifest_uri)
+    if backend.head(bucket, key) is None:
+        return {}
+    return json.loads(backend.get(bucket, key))['objects']
+
+
+def list_changes(prefix_uri, manifest_uri, workers=LIST_WORKERS, append_only=False):
+    ''' List a prefix and compare it with the listing manifest of the previous run
+
+    The manifest (json with the key, ETag, size and modification time of every object) is
+    replaced with the new listing.
+
+    :param prefix_uri: s3:// or file:// URI of the prefix
+    :param manifest_uri: URI of the manifest
+    :param workers: Number of concurrent listings
+    :param append_only: Keys only grow (e.g. timestamped names), list only after the last known key
+    :return: tuple (list of URIs of new or changed objects, list of URIs of removed objects)
+    '''
+    known = _read_listing(manifest_uri)
+    if append_only and known:
+        listed = [dict(obj, Key=key) for key, obj in known.items()]
+        listed.extend(list_objects(prefix_uri, start_after=max(known)))
+    else:
+        listed = list(list_objects(prefix_uri, workers=workers))
+
+    current = {obj['Key']: {'ETag': obj['ETag'], 'Size': obj['Size'],
+                            'LastModified': str(obj['LastModified'])} for obj in listed}
+    changed = [object_uri(prefix_uri, key) for key, obj in current.items()
+               if known.get(key, {}).get('ETag') != obj['ETag']]
+    removed = [object_uri(prefix_uri, key) for key in known if key not in current]
+    write_bytes(manifest_uri, json.dumps({'prefix': prefix_uri, 'objects': current}))
+    return changed, removed
+
+
+def get_many(uris, workers=MAX_POOL_CONNECTIONS):
+    ''' Read several objects concurrently over the pooled clients
+
+    :param uris: Iterable of URIs
+    :param workers: Number of threads
+    :return: List of bytes in the order of uris
+    '''
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(read_bytes, uris))
+
+
+def put_many(objects, workers=MAX_POOL_CONNECTIONS):
+    ''' Write several objects concurrently over the pooled clients
+
+    :param objects: dict {uri: bytes or str}
+    :param workers: Number of threads
+    '''
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda item: write_bytes(*item), objects.items()))
@@ -0,0 +1,528 @@
+''' Transcribe job submission shared by the create-transcription Lambdas
+
+Uploads are queued (one object per job under QUEUE_URI, so nothing is lost when the account is at
+its limit) and drained by a Submitter: a token bucket paces StartTranscriptionJob and no more
+than max_in_flight jobs run at the same time. Uploads with an ETag are claimed in the idempotency
+store (idempotency.py) when they are queued, a redelivered notification is skipped. Requests are
+built when they are queued, so a queued job submitted twice gets the same name and Transcribe
+rejects the copy (ConflictException).
+'''
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from urllib.parse import urlparse, unquote_plus
+from concurrent.futures import ThreadPoolExecutor
+import storage
+import metrics
+import idempotency
+
+
+# Settings of every pipeline, see job_request
+PROFILES = {
+    'RAW': {'output_bucket': 'awstranscribe-tests', 'output_prefix': 'levenshteinTests/RAW/', 'tag': 'RAW',
+            'naming': 'timestamp', 'language': 'es-ES', 'channels': False, 'vocabulary': None},
+    'IPA': {'output_bucket': 'awstranscribe-tests', 'output_prefix': 'levenshteinTests/IPA/', 'tag': 'IPA',
+            'naming': 'timestamp', 'language': 'es-ES', 'channels': False, 'vocabulary': 'big_ass_voc'},
+    # keys look like '<17 characters>/YYYYMMDD/<name>.wav', the transcript keeps the date folder
+    'production': {'output_bucket': 'socofin-output', 'output_prefix': 'output-transcribe', 'tag': 'DA',
+                   'naming': 'key', 'key_offset': 17, 'language': 'es-ES', 'channels': True,
+                   'vocabulary': 'mvp-socofin-voc', 'processed_prefix': 'procesados'},
+}
+
+# Pending and rejected jobs, one folder per profile
+QUEUE_URI = os.environ.get('TRANSCRIBE_QUEUE_URI', 's3://socofin-output/transcribe-queue/')
+FAILED_URI = os.environ.get('TRANSCRIBE_FAILED_URI', 's3://socofin-output/transcribe-queue-failed/')
+# StartTranscriptionJob calls per second and the burst allowed after an idle period
+RATE = float(os.environ.get('TRANSCRIBE_SUBMIT_RATE', '5'))
+BURST = int(os.environ.get('TRANSCRIBE_SUBMIT_BURST', '10'))
+# Jobs QUEUED or IN_PROGRESS at the same time, under the concurrent job quota of the account (100)
+MAX_IN_FLIGHT = int(os.environ.get('TRANSCRIBE_MAX_IN_FLIGHT', '90'))
+# Submissions of an upload made by Submitter.reprocess, the first one included
+MAX_ATTEMPTS = int(os.environ.get('TRANSCRIBE_MAX_ATTEMPTS', '3'))
+# Seconds after which a submitted upload that never finished is queued again by the scheduled runs
+STALE_AFTER = float(os.environ.get('TRANSCRIBE_STALE_AFTER', str(6 * 3600)))
+# Concurrent StartTranscriptionJob calls and jobs read from the queue at a time
+SUBMIT_WORKERS = 8
+BATCH_SIZE = 50
+
+
+def _clean(name):
+    """ Characters allowed in a job name, the others become '_' """
+    return ''.join(c if c.isalnum() and c.isascii() or c in '._-' else '_' for c in name)
+
+
+def job_request(profile, bucket, key, timestamp=None):
+    ''' StartTranscriptionJob parameters of an upload
+
+    :param profile: Name of a PROFILES entry or a profile dict
+    :param bucket: Bucket of the audio file
+    :param key: Key of the audio file
+    :param timestamp: Time of the upload, used in the names of the 'timestamp' profiles
+    :return: dict of keyword arguments of start_transcription_job
+    '''
+    profile = PROFILES[profile] if isinstance(profile, str) else profile
+    file_name = os.path.basename(key)
+    if profile['naming'] == 'key':
+        stem = key[profile['key_offset']:-4]
+        job_name = profile['tag'] + _clean(stem.replace('/', '_').replace('.', '_').replace(' ', '_'))
+        output_key = profile['output_prefix'] + stem.replace('.', '_').replace(' ', '_') + '.json'
+    else:
+        timestamp = time.time() if timestamp is None else timestamp
+        job_name = f"{_clean(file_name.lower())}-{timestamp}-{profile['tag']}"
+        output_key = f"{profile['output_prefix']}{file_name}-{timestamp}-{profile['tag']}.json"
+    settings = {'ChannelIdentification': profile['channels']}
+    if profile['vocabulary']:
+        settings['VocabularyName'] = profile['vocabulary']
+    return {'TranscriptionJobName': job_name[:200], 'LanguageCode': profile['language'],
+            'Media': {'MediaFileUri': storage.to_uri(bucket, key)}, 'OutputBucketName': profile['output_bucket'],
+            'OutputKey': output_key, 'Settings': settings}
+
+
+def _job_pattern(profile):
+    """ Regular expression of the job names built by job_request for a profile """
+    tag = re.escape(profile['tag'])
+    if profile['naming'] == 'key':
+        # the date folder and the file name of the key, '/', '.' and ' ' replaced by '_'
+        return rf'{tag}_\d{{8}}_[A-Za-z0-9_-]+'
+    # lower case file name, upload time
+    return rf'[a-z0-9._-]+-\d+(\.\d+)?-{tag}'
+
+
+def job_profile(job_name):
+    ''' Name of the profile that built a job name (see job_request), None for other jobs '''
+    for name, profile in PROFILES.items():
+        if re.fullmatch(_job_pattern(profile), job_name):
+            return name
+    return None
+
+
+def output_job_name(bucket, key):
+    ''' Name of the job that wrote a transcript, from its key (the OutputKey of job_request)
+
+    :param bucket: Bucket of the transcript
+    :param key: Key of the transcript
+    :return: job name, None when the object is not the transcript of a job of PROFILES
+    '''
+    for name, profile in PROFILES.items():
+        prefix = profile['output_prefix']
+        if bucket != profile['output_bucket'] or not key.startswith(prefix) or not key.endswith('.json'):
+            continue
+        stem = key[len(prefix):-5]
+        if profile['naming'] == 'key':
+            job_name = profile['tag'] + _clean(stem.replace('/', '_'))
+        else:
+            parts = stem.rsplit('-', 2)
+            if len(parts) != 3:
+                continue
+            job_name = f"{_clean(parts[0].lower())}-{parts[1]}-{parts[2]}"
+        if job_profile(job_name[:200]) == name:
+            return job_name[:200]
+    return None
+
+
+def media_object(job):
+    ''' (bucket, key) of the audio file of a job description (GetTranscriptionJob) '''
+    uri = urlparse(job['Media']['MediaFileUri'])
+    return uri.netloc, uri.path.lstrip('/')
+
+
+def processed_uri(profile, bucket, key):
+    ''' URI where the audio file of a completed job is copied, None when the profile keeps it in place '''
+    profile = PROFILES[profile] if isinstance(profile, str) else profile
+    if not profile.get('processed_prefix'):
+        return None
+    return storage.to_uri(bucket, profile['processed_prefix'] + key[profile['key_offset']:])
+
+class TokenBucket:
+    ''' Thread safe token bucket: rate tokens per second, up to burst saved
+
+    :param rate: Tokens added per second
+    :param burst: Max tokens saved
+    '''
+
+    def __init__(self, rate=RATE, burst=BURST, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.clock, self.sleep = clock, sleep
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def take(self, deadline=None):
+        ''' Wait for a token, False when it would only come after deadline (a clock value) '''
+        while True:
+            with self._lock:
+                now = self.clock()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            self.sleep(wait)
+
+
+class StorageQueue:
+    ''' Durable FIFO queue, one json object per item under a prefix (S3, or local folders with
+        TRANSCRIBE_STORAGE_ROOT)
+
+    :param uri: Prefix URI of the pending items
+    :param failed_uri: Prefix URI where rejected items are moved
+    '''
+
+    def __init__(self, uri, failed_uri=None):
+        self.uri = uri if uri.endswith('/') else f'{uri}/'
+        self.failed_uri = failed_uri
+
+    def item_uri(self, item):
+        ''' URI of a new item, names sort in the order they are created '''
+        digest = hashlib.sha256(json.dumps(item, sort_keys=True).encode('utf8')).hexdigest()[:16]
+        return f'{self.uri}{time.time_ns():020d}-{digest}.json'
+
+    def put(self, item, uri=None):
+        ''' Queue a json serializable item, returns its URI
+
+        :param uri: URI given by item_uri, a new one by default
+        '''
+        uri = uri or self.item_uri(item)
+        storage.write_bytes(uri, json.dumps(item, sort_keys=True))
+        return uri
+
+    def __contains__(self, uri):
+        return storage.head(uri) is not None
+
+    def peek(self, limit=BATCH_SIZE):
+        ''' Oldest items, list of (uri, item), all of them with limit None '''
+        uris = []
+        for obj in storage.list_objects(self.uri):
+            uris.append(storage.object_uri(self.uri, obj['Key']))
+            if limit is not None and len(uris) >= limit:
+                break
+        return list(zip(uris, (json.loads(body) for body in storage.get_many(uris)))) if uris else []
+
+    def remove(self, uri):
+        storage.delete(uri)
+
+    def fail(self, uri, item, reason):
+        ''' Move an item to failed_uri with the reason it was rejected '''
+        if self.failed_uri:
+            storage.write_bytes(f'{self.failed_uri}{uri.rsplit("/", 1)[-1]}', json.dumps(dict(item, error=reason)))
+        self.remove(uri)
+
+    def __len__(self):
+        return sum(1 for _ in storage.list_objects(self.uri))
+
+
+def _error_code(error):
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
+
+
+class Submitter:
+    ''' Starts the queued jobs of a profile within the rate and concurrency limits
+
+    :param profile: Name of a PROFILES entry
+    :param queue: StorageQueue, defaults to the profile folder of QUEUE_URI
+    :param bucket: TokenBucket, defaults to RATE and BURST
+    :param max_in_flight: Jobs QUEUED or IN_PROGRESS at the same time in the account
+    :param workers: Concurrent StartTranscriptionJob calls
+    :param client: Transcribe client, defaults to storage.get_client('transcribe')
+    :param store: idempotency.IdempotencyStore of the uploads, defaults to idempotency.get_store()
+    '''
+
+    def __init__(self, profile, queue=None, bucket=None, max_in_flight=MAX_IN_FLIGHT, workers=SUBMIT_WORKERS,
+                 client=None, store=None):
+        self.profile = profile
+        # an empty queue is falsy (__len__)
+        self.queue = queue if queue is not None else StorageQueue(f'{QUEUE_URI}{profile}/', f'{FAILED_URI}{profile}/')
+        self.bucket = bucket or TokenBucket()
+        self.max_in_flight = max_in_flight
+        self.workers = workers
+        self._client = client
+        self._store = store
+        self._lock = threading.Lock()
+        self._slots = 0
+
+    @property
+    def client(self):
+        return self._client or storage.get_client('transcribe')
+
+    @property
+    def store(self):
+        return self._store or idempotency.get_store()
+
+    def enqueue(self, bucket, key, etag=None):
+        ''' Queue the job of an upload, returns the queued item
+
+        With the ETag the upload is claimed in the idempotency store first, a duplicate (a
+        redelivered notification) is skipped and None returned.
+        '''
+        item = {'profile': self.profile, 'bucket': bucket, 'key': key, 'etag': etag,
+                'request': job_request(self.profile, bucket, key)}
+        job_name = item['request']['TranscriptionJobName']
+        uri = self.queue.item_uri(item)
+        if etag and not self.store.claim(self.profile, bucket, key, etag, job_name, uri):
+            metrics.count('jobs_skipped')
+            return None
+        try:
+            self.queue.put(item, uri)
+        except Exception:
+            if etag:
+                # not queued, the redelivery of the notification must not be taken for a duplicate
+                self.store.release(self.profile, bucket, key, etag, job_name)
+            raise
+        metrics.count('jobs_queued')
+        return item
+
+    def in_flight(self):
+        ''' Jobs of the account that are QUEUED or IN_PROGRESS '''
+        count = 0
+        for status in ('QUEUED', 'IN_PROGRESS'):
+            kwargs = {'Status': status, 'MaxResults': 100}
+            while True:
+                response = self.client.list_transcription_jobs(**kwargs)
+                count += len(response.get('TranscriptionJobSummaries', []))
+                if not response.get('NextToken'):
+                    break
+                kwargs['NextToken'] = response['NextToken']
+        return count
+
+    def _reserve(self):
+        with self._lock:
+            if self._slots <= 0:
+                return False
+            self._slots -= 1
+            return True
+
+    def _release(self):
+        with self._lock:
+            self._slots += 1
+
+    def submit(self, uri, item, deadline=None):
+        ''' Start the job of a queued item
+
+        :return: 'submitted', 'duplicate' (a job with its name exists), 'deferred' (left queued,
+                 over a limit) or 'failed' (rejected, moved to the failed folder)
+        '''
+        if not self._reserve():
+            return 'deferred'
+        if not self.bucket.take(deadline):
+            self._release()
+            return 'deferred'
+        try:
+            self.client.start_transcription_job(**item['request'])
+        except Exception as e:
+            self._release()
+            code = _error_code(e)
+            if code == 'ConflictException':
+                self.queue.remove(uri)
+                return 'duplicate'
+            if code == 'LimitExceededException':
+                with self._lock:
+                    self._slots = 0
+                return 'deferred'
+            if code in ('ThrottlingException', 'TooManyRequestsException'):
+                # the rest of the drain would only be throttled too and keep the request rate up
+                with self._lock:
+                    self._slots = 0
+            if code in ('ThrottlingException', 'TooManyRequestsException', 'InternalFailureException') \
+                    or code is None:
+                logging.warning('Could not submit %s, left queued: %r', item['request']['TranscriptionJobName'], e)
+                return 'deferred'
+            logging.error('Job %s rejected: %r', item['request']['TranscriptionJobName'], e)
+            self.queue.fail(uri, item, repr(e))
+            if item.get('etag'):
+                self.store.finish(item['request']['TranscriptionJobName'], idempotency.FAILED, repr(e))
+            return 'failed'
+        self.queue.remove(uri)
+        return 'submitted'
+
+    def drain(self, limit=None, timeout=None):
+        ''' Submit queued jobs in batches until the queue is empty, a limit is reached or the time is up
+
+        :param limit: Max jobs to submit
+        :param timeout: Seconds to spend, e.g. a bit less than the remaining Lambda time
+        :return: dict with the counts of every submit status and 'jobs', the submitted items
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._slots = self.max_in_flight - self.in_flight()
+        counts = {'submitted': 0, 'duplicate': 0, 'deferred': 0, 'failed': 0}
+        jobs = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while self._slots > 0 and (deadline is None or time.monotonic() < deadline):
+                size = min(BATCH_SIZE, self._slots)
+                if limit is not None:
+                    size = min(size, limit - counts['submitted'])
+                batch = self.queue.peek(size) if size > 0 else []
+                if not batch:
+                    break
+                statuses = list(pool.map(lambda entry: self.submit(*entry, deadline=deadline), batch))
+                for (_, item), status in zip(batch, statuses):
+                    counts[status] += 1
+                    if status == 'submitted':
+                        jobs.append(item)
+                if 'submitted' not in statuses and 'duplicate' not in statuses and 'failed' not in statuses:
+                    # nothing left the queue, the next drain retries
+                    break
+        for status, count in counts.items():
+            metrics.count(f'jobs_{status}', count)
+        return dict(counts, jobs=jobs)
+
+    def _job_status(self, job_name):
+        """ Status of a job, None when Transcribe does not know it """
+        try:
+            job = self.client.get_transcription_job(TranscriptionJobName=job_name)['TranscriptionJob']
+        except Exception as e:
+            if _error_code(e) in ('BadRequestException', 'NotFoundException'):
+                return None
+            raise
+        return job['TranscriptionJobStatus']
+
+    def reprocess(self, stale_after=None, limit=None, max_attempts=MAX_ATTEMPTS):
+        ''' Queue again the failed uploads of the profile (the reprocessing queue of the idempotency store)
+
+        :param stale_after: Seconds after which a submitted upload that did not finish is retried
+                            too, unless its item is still queued or its job still runs
+        :param limit: Max uploads queued
+        :param max_attempts: Submissions of an upload, the ones that failed as many times are left
+        :return: list of the queued items
+        '''
+        items, queued = [], None
+        for record in self.store.pending(stale_after):
+            if limit is not None and len(items) >= limit:
+                break
+            if record['profile'] != self.profile or record.get('attempts', 1) >= max_attempts:
+                continue
+            if record['state'] == idempotency.SUBMITTED:
+                # deferred, the next drain submits it
+                if record.get('queue_uri'):
+                    if record['queue_uri'] in self.queue:
+                        continue
+                else:
+                    # claimed without the URI of its item, the queue is read once
+                    if queued is None:
+                        queued = {(item['bucket'], item['key'], (item.get('etag') or '').strip('"'))
+                                  for _, item in self.queue.peek(limit=None)}
+                    if (record['bucket'], record['key'], record['etag']) in queued:
+                        continue
+            status = self._job_status(record['job_name']) if record.get('job_name') else None
+            if status in ('QUEUED', 'IN_PROGRESS'):
+                continue
+            if status == 'COMPLETED':
+                # the completion was missed, nothing to redo
+                self.store.finish(record['job_name'], idempotency.COMPLETED)
+                continue
+            request = job_request(self.profile, record['bucket'], record['key'])
+            item = {'profile': self.profile, 'bucket': record['bucket'], 'key': record['key'],
+                    'etag': record['etag'], 'request': request}
+            uri = self.queue.item_uri(item)
+            if not self.store.retry(record, request['TranscriptionJobName'], uri):
+                continue
+            if status == 'FAILED' and record['job_name'] == request['TranscriptionJobName']:
+                # the name of the failed job is taken until it is deleted
+                self.client.delete_transcription_job(TranscriptionJobName=record['job_name'])
+            self.queue.put(item, uri)
+            items.append(item)
+        metrics.count('jobs_reprocessed', len(items))
+        return items
+
+
+def scheduled_run(profile, timeout=None, stale_after=STALE_AFTER):
+    ''' Run of a schedule (an event without records): the failed and stale uploads are queued
+    again, then the queue is drained
+
+    :param profile: Name of a PROFILES entry
+    :param timeout: Seconds the submission may take
+    :param stale_after: See Submitter.reprocess
+    :return: dict with the counts of Submitter.drain and 'reprocessed'
+    '''
+    jobs = get_submitter(profile)
+    reprocessed = len(jobs.reprocess(stale_after=stale_after))
+    result = jobs.drain(timeout=timeout)
+    return dict({status: count for status, count in result.items() if status != 'jobs'}, reprocessed=reprocessed)
+
+
+def _identifier(record):
+    """ Identifier of a record of an event in a partial batch failure response """
+    if 'messageId' in record:
+        return record['messageId']
+    if 'Sns' in record:
+        return record['Sns'].get('MessageId')
+    return record.get('s3', {}).get('object', {}).get('sequencer')
+
+
+def _notifications(record):
+    """ S3 notification records of a record of an event: an SQS message (of SNS or S3), an SNS
+        message or an S3 record """
+    if 'messageId' in record:
+        message = json.loads(record['body'])
+        if message.get('Type') == 'Notification':
+            message = json.loads(message['Message'])
+    elif 'Sns' in record:
+        message = json.loads(record['Sns']['Message'])
+    else:
+        return [record]
+    # the s3:TestEvent of a new subscription has no records
+    return message.get('Records', [])
+
+
+def submit_event(profile, event, timeout=None, workers=SUBMIT_WORKERS):
+    ''' Queue the uploads of every record of an event and submit the queued jobs
+
+    Handles S3 notifications delivered directly, in SNS messages (any number of S3 records per
+    message) or in SQS messages. The uploads are queued concurrently, a record that cannot be read
+    or queued is reported and does not stop the others.
+
+    :param profile: Name of a PROFILES entry
+    :param event: Lambda event
+    :param timeout: Seconds the submission may take
+    :param workers: Uploads queued at the same time
+    :return: dict with the counts of Submitter.drain, 'queued', 'skipped' (duplicates), 'errors'
+             (records and uploads that could not be read or queued) and 'batchItemFailures', the
+             partial batch response [{'itemIdentifier': id}]
+    '''
+    jobs = get_submitter(profile)
+    uploads, failed = [], []
+    for record in event.get('Records', []):
+        identifier = _identifier(record)
+        try:
+            for notification in _notifications(record):
+                obj = notification['s3']['object']
+                uploads.append((identifier, notification['s3']['bucket']['name'], unquote_plus(obj['key']),
+                                obj.get('eTag')))
+        except Exception as e:
+            logging.error('Could not read the record %s: %r', identifier, e)
+            failed.append(identifier)
+
+    def enqueue(upload):
+        identifier, bucket, key, etag = upload
+        try:
+            return 'queued' if jobs.enqueue(bucket, key, etag) is not None else 'skipped'
+        except Exception as e:
+            logging.error('Could not queue %s: %r', storage.to_uri(bucket, key), e)
+            return 'error'
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        statuses = list(pool.map(enqueue, uploads))
+    failed += [upload[0] for upload, status in zip(uploads, statuses) if status == 'error']
+    result = jobs.drain(timeout=timeout)
+    result = {status: count for status, count in result.items() if status != 'jobs'}
+    result.update(queued=statuses.count('queued'), skipped=statuses.count('skipped'), errors=len(failed),
+                  batchItemFailures=[{'itemIdentifier': identifier} for identifier in dict.fromkeys(failed)])
+    return result
+
+
+_submitters = {}
+
+
+def get_submitter(profile):
+    ''' Submitter of a profile, shared by the warm invocations of a Lambda '''
+    if profile not in _submitters:
+        _submitters[profile] = Submitter(profile)
+    return _submitters[profile]
@@ -0,0 +1,16 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import storage
+
+
+@pytest.fixture
+def local_s3(tmp_path, monkeypatch):
+    ''' s3:// URIs served from a temporary folder (like TRANSCRIBE_STORAGE_ROOT) '''
+    monkeypatch.setitem(storage._backends, 's3', storage.LocalBackend(str(tmp_path)))
+    return tmp_path
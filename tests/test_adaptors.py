@@ -0,0 +1,179 @@
+import re
+import json
+import numpy as np
+import pandas as pd
+import pytest
+import unidecode as uni
+import Levenshtein as lv
+import storage
+import cache
+import transcripts
+import adaptors
+
+URI = 's3://tests/output-transcribe/20210118/llamada.json'
+
+DOCUMENT = {'jobName': 'DA_20210118_llamada', 'status': 'COMPLETED', 'results': {
+    'transcripts': [{'transcript': 'Hola, buenos dias.'}],
+    'items': [{'start_time': '0.5', 'end_time': '0.9', 'type': 'pronunciation',
+               'alternatives': [{'confidence': '0.99', 'content': 'Hola'}]},
+              {'type': 'punctuation', 'alternatives': [{'confidence': '0.0', 'content': ','}]},
+              {'start_time': '1.0', 'end_time': '1.4', 'type': 'pronunciation',
+               'alternatives': [{'confidence': '0.87', 'content': 'buenos'}]},
+              {'start_time': '1.4', 'end_time': '1.75', 'type': 'pronunciation',
+               'alternatives': [{'confidence': '0.9', 'content': 'dias'}]},
+              {'type': 'punctuation', 'alternatives': [{'confidence': '0.0', 'content': '.'}]}]}}
+
+
+@pytest.fixture(params=['ijson', 'json'])
+def parser(request, local_s3, monkeypatch):
+    if request.param == 'json':
+        monkeypatch.setattr(transcripts, 'ijson', None)
+    storage.write_bytes(URI, json.dumps(DOCUMENT))
+    return request.param
+
+
+def test_aws2df_streams_the_document(parser, monkeypatch):
+    monkeypatch.setattr(cache, 'read_parsed', lambda *args, **kwargs: pytest.fail('read through the cache'))
+    frame = adaptors.aws2df(URI)
+    assert list(frame.columns) == ['start', 'end', 'transcript']
+    assert frame['start'].tolist() == [0.5, 1.0, 1.4]
+    assert frame['end'].tolist() == [0.9, 1.4, 1.75]
+    assert frame['transcript'].tolist() == ['Hola', 'buenos', 'dias']
+    assert frame['transcript'].dtype == 'string'
+
+
+def test_aws2df_local_file(parser, tmp_path):
+    path = tmp_path / 'llamada.json'
+    path.write_text(json.dumps(DOCUMENT), encoding='utf8')
+    assert adaptors.aws2df(str(path), aws_path=False).equals(adaptors.aws2df(URI))
+
+
+def brute_join(reference, words, policy):
+    """ One phrase per reference window, word by word, straight from the JOIN_POLICIES definitions """
+    windows = sorted(range(len(reference)), key=lambda i: reference['start'].iloc[i])
+    phrases = [[] for _ in range(len(reference))]
+    for j in sorted(range(len(words)), key=lambda j: words['start'].iloc[j]):
+        start, end = words['start'].iloc[j], words['end'].iloc[j]
+        if policy == 'midpoint':
+            start = end = (start + end) / 2
+        candidates = []
+        for rank, i in enumerate(windows):
+            r_start, r_end = reference['start'].iloc[i], reference['end'].iloc[i]
+            if policy == 'contained':
+                if r_start <= start and end <= r_end:
+                    phrases[i].append(words['transcript'].iloc[j])
+                continue
+            overlap = min(end, r_end) - max(start, r_start)
+            if overlap > 0 or r_start <= start and end <= r_end:
+                candidates.append((-overlap if policy == 'overlap' else 0, rank, i))
+        if candidates:
+            phrases[min(candidates)[2]].append(words['transcript'].iloc[j])
+    return [' '.join(phrase) for phrase in phrases]
+
+
+REFERENCE = pd.DataFrame({'start': [0.0, 2.0, 4.0], 'end': [2.0, 4.0, 6.0]}, index=['a', 'b', 'c'])
+# unsorted on purpose: 'le' straddles the first two windows, 'banco' the last two
+WORDS = pd.DataFrame({'start': [4.5, 0.2, 1.5, 0.8, 3.9, 6.5],
+                      'end': [5.0, 0.7, 2.8, 1.2, 4.2, 7.0],
+                      'transcript': ['deuda', 'hola', 'le', 'buenos', 'banco', 'fuera']})
+
+
+@pytest.mark.parametrize('policy, expected', [
+    ('contained', ['hola buenos', '', 'deuda']),
+    ('overlap', ['hola buenos', 'le', 'banco deuda']),
+    ('midpoint', ['hola buenos', 'le', 'banco deuda']),
+])
+def test_interval_join_policies(policy, expected):
+    joined = adaptors.interval_join(REFERENCE, WORDS, policy=policy)
+    assert joined.index.tolist() == ['a', 'b', 'c']
+    assert joined['transcript'].tolist() == expected == brute_join(REFERENCE, WORDS, policy)
+
+
+@pytest.mark.parametrize('policy', adaptors.JOIN_POLICIES)
+@pytest.mark.parametrize('seed', range(5))
+def test_interval_join_matches_the_definitions(policy, seed):
+    rng = np.random.default_rng(seed)
+    starts = rng.uniform(0, 60, 12).round(1)
+    reference = pd.DataFrame({'start': starts, 'end': starts + rng.uniform(0.5, 8, 12).round(1)})
+    starts = rng.uniform(0, 70, 80).round(1)
+    words = pd.DataFrame({'start': starts, 'end': starts + rng.uniform(0, 2, 80).round(1),
+                          'transcript': [f'w{i}' for i in range(80)]})
+    joined = adaptors.interval_join(reference, {'transcript': words}, policy=policy)
+    assert joined['transcript'].tolist() == brute_join(reference, words, policy)
+    assert adaptors.compress(reference, words, policy=policy) == joined['transcript'].tolist()
+
+
+def test_interval_join_names_the_columns_of_a_list():
+    joined = adaptors.interval_join(REFERENCE, [WORDS, WORDS.iloc[:0]], policy='overlap')
+    assert joined.columns.tolist() == ['transcript_0', 'transcript_1']
+    assert joined['transcript_1'].tolist() == ['', '', '']
+    with pytest.raises(ValueError, match='Unknown policy'):
+        adaptors.interval_join(REFERENCE, WORDS, policy='nearest')
+
+
+def scalar_score(a_string, b_string):
+    a_string, b_string = adaptors.neutralize(a_string), adaptors.neutralize(b_string)
+    length = max(len(a_string), len(b_string))
+    return 1 - lv.distance(a_string, b_string) / length if length else 1.0
+
+
+A = ['Hola, ¿cómo está?', 'le llamo de su banco', '', 'deuda', '<b>pago</b> hoy', 'deuda', 'sí']
+B = ['hola como esta', 'le llamo del banco', '', 'duda', 'pago', 'deuda', '']
+
+
+@pytest.mark.parametrize('workers, threshold', [(1, 100000), (2, 1)])
+def test_lv_scores_match_the_scalar_score(workers, threshold):
+    scores, distances = adaptors.lv_scores(pd.Series(A), B, workers=workers, chunksize=2,
+                                           parallel_threshold=threshold)
+    assert scores.tolist() == pytest.approx([scalar_score(a, b) for a, b in zip(A, B)])
+    assert distances.tolist() == [lv.distance(adaptors.neutralize(a), adaptors.neutralize(b)) for a, b in zip(A, B)]
+    assert adaptors.lv_score(A, B) == pytest.approx(scores.tolist())
+
+
+def test_lv_scores_of_empty_and_missing_values():
+    # two empty strings are identical, one empty string is all edits
+    assert adaptors.lv_score(['', None, 'hola'], ['', '', np.nan]) == [1.0, 1.0, 0.0]
+    scores, distances = adaptors.lv_scores([], [])
+    assert scores.tolist() == [] and distances.tolist() == []
+    # extra values of the longer series are ignored, like zip
+    assert adaptors.lv_score(['hola', 'extra'], ['hola']) == [1.0]
+    assert adaptors.lv_score('Hola', 'hola') == [1.0]
+
+
+def old_neutralize(a_string):
+    a_string = uni.unidecode(a_string)
+    a_string = re.sub('[?!@#$.,/]', '', a_string)
+    a_string = re.sub(re.compile('<.*?>'), '', a_string)
+    a_string = re.sub(re.compile(r".*?\((.*?)\)"), '', a_string)
+    return a_string.lower()
+
+
+def old_notebook_neutralize(a_string):
+    a_string = uni.unidecode(a_string)
+    a_string = re.sub('[?!@#$.,]', '', a_string)
+    return a_string.lower()
+
+
+TEXTS = ['', 'Hola, ¿cómo está?', 'Año 2021: ÑANDÚ / pingüino!', '<b>pago</b> de la <i>deuda</i>',
+         'le llamo (risas) de su banco', 'a (b (c) d) e', 'sin cerrar (nunca', 'dos (a) (b) veces',
+         'primera (x) linea\nsegunda (y) linea\r\ntercera', '@#$ símbolos ?!', 'emoji 😀 y tab\tfinal',
+         '(todo entre parentesis)', '<a href="x.html">enlace</a> (nota) fin.']
+
+
+@pytest.mark.parametrize('text', TEXTS)
+def test_neutralize_profiles_match_the_old_functions(text):
+    assert adaptors.neutralize(text) == old_neutralize(text)
+    assert adaptors.neutralize(text, 'notebook') == old_notebook_neutralize(text)
+
+
+def test_neutralize_series_and_custom_profiles(monkeypatch):
+    monkeypatch.setattr(adaptors, 'NORMALIZATION_PROFILES', dict(adaptors.NORMALIZATION_PROFILES))
+    monkeypatch.setattr(adaptors, '_normalizers', {})
+    series = pd.Series(TEXTS + [None, TEXTS[1]], index=range(10, 10 + len(TEXTS) + 2))
+    neutralized = adaptors.neutralize_series(series)
+    assert neutralized.index.equals(series.index)
+    assert neutralized.tolist() == [old_neutralize(text) for text in TEXTS] + ['', old_neutralize(TEXTS[1])]
+
+    adaptors.register_profile('test-spaces', collapse_spaces=True)
+    assert adaptors.neutralize('  Hola,   (eh)  Buenos\n días ', 'test-spaces') == 'buenos dias'
+    assert adaptors.neutralize_cache_info('test-spaces').misses == 1
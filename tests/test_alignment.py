@@ -0,0 +1,90 @@
+import random
+import numpy as np
+import pytest
+import Levenshtein as lv
+import alignment
+
+
+def edit_distance(a, b):
+    ''' Reference word edit distance, the full dynamic program '''
+    row = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        previous, row[0] = row[:], i
+        for j in range(1, len(b) + 1):
+            row[j] = min(previous[j] + 1, row[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+    return row[-1]
+
+
+def transcribed(rng, words, vocabulary, error=0.1):
+    ''' Copy of words with substituted, dropped and inserted words '''
+    hypothesis = []
+    for word in words:
+        roll = rng.random()
+        if roll < error / 3:
+            continue
+        hypothesis.append(rng.choice(vocabulary) if roll < 2 * error / 3 else word)
+        if rng.random() < error / 3:
+            hypothesis.append(rng.choice(vocabulary))
+    return hypothesis
+
+
+def check_operations(distance, frame, a, b):
+    assert (frame['op'] != 'equal').sum() == distance
+    assert frame.loc[frame['ref'] >= 0, 'ref'].tolist() == list(range(len(a)))
+    assert frame.loc[frame['hyp'] >= 0, 'hyp'].tolist() == list(range(len(b)))
+    equal = frame[frame['op'] == 'equal']
+    assert (equal['ref_word'] == equal['hyp_word']).all()
+    assert (frame.loc[frame['op'] == 'replace', 'ref_word'] != frame.loc[frame['op'] == 'replace', 'hyp_word']).all()
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_short_transcripts_are_aligned_exactly(seed):
+    rng = random.Random(seed)
+    vocabulary = [f'w{i}' for i in range(rng.choice([3, 10, 50]))]
+    a = [rng.choice(vocabulary) for _ in range(rng.randint(0, 80))]
+    b = transcribed(rng, a, vocabulary, error=rng.choice([0.1, 0.5]))
+    distance, frame = alignment.align(a, b)
+    assert distance == edit_distance(a, b)
+    check_operations(distance, frame, a, b)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_anchored_distance_is_an_upper_bound(seed):
+    rng = random.Random(seed)
+    vocabulary = [f'w{i}' for i in range(20)]
+    a = [rng.choice(vocabulary) for _ in range(200)]
+    b = transcribed(rng, a, vocabulary, error=0.3)
+    distance, frame = alignment.align(a, b, exact=False)
+    assert distance >= edit_distance(a, b)
+    check_operations(distance, frame, a, b)
+
+
+def test_long_transcripts_are_anchored(monkeypatch):
+    rng = random.Random(0)
+    vocabulary = [f'w{i}' for i in range(5000)]
+    a = [rng.choice(vocabulary) for _ in range(3000)]
+    b = transcribed(rng, a, vocabulary)
+    monkeypatch.setattr(alignment, '_exact', lambda a, b: pytest.fail('exact alignment of a long pair'))
+    monkeypatch.setattr(alignment, 'SMALL_GAP_CELLS', 0)
+    distance, frame = alignment.align(a, b)
+    # sparse errors on a large vocabulary: the optimal path goes through the anchors
+    codes = {word: chr(0x4e00 + i) for i, word in enumerate(vocabulary)}
+    assert distance == lv.distance(''.join(codes[w] for w in a), ''.join(codes[w] for w in b))
+    check_operations(distance, frame, a, b)
+
+
+def test_timestamps_anchor_repeated_ngrams():
+    phrase = 'le llamo de su banco'.split()
+    a = phrase * 40
+    b = [word for k, word in enumerate(a) if k % 17 != 5]
+    a_times, b_times = np.arange(len(a), dtype=np.float64), np.array([k for k in range(len(a)) if k % 17 != 5],
+                                                                      dtype=np.float64)
+    distance, frame = alignment.align(a, b, a_times, b_times, time_tolerance=2.0, exact=False)
+    assert distance == edit_distance(a, b) == len(a) - len(b)
+    check_operations(distance, frame, a, b)
+
+
+def test_texts_are_neutralized():
+    distance, frame = alignment.align('Hola, buenos <b>días</b>', 'hola buenos dias')
+    assert distance == 0
+    assert frame['ref_word'].tolist() == ['hola', 'buenos', 'dias']
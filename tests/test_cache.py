@@ -0,0 +1,48 @@
+import os
+import pytest
+import storage
+import cache
+
+URI = 's3://tests/documents/a.json'
+
+
+@pytest.fixture
+def disk_cache(local_s3, tmp_path, monkeypatch):
+    # the local backend stands in for S3, whose objects are the only ones cached
+    monkeypatch.setattr(storage, 'S3Backend', storage.LocalBackend)
+    monkeypatch.setattr(cache, '_cache', cache.DiskCache(str(tmp_path / 'cache')))
+    return cache.get_cache()
+
+
+def test_read_bytes_is_served_from_the_cache_until_the_object_changes(disk_cache):
+    storage.write_bytes(URI, b'first')
+    assert cache.read_bytes(URI) == b'first'
+    assert disk_cache.get(URI, storage.head(URI)['ETag']) == b'first'
+    storage.write_bytes(URI, b'second')
+    assert cache.read_bytes(URI) == b'second'
+
+
+def test_read_parsed_is_keyed_on_the_version_read(disk_cache, monkeypatch):
+    storage.write_bytes(URI, b'old')
+    old = storage.head(URI)['ETag']
+    storage.write_bytes(URI, b'new')
+    new = storage.head(URI)['ETag']
+    # the object was replaced between the HEAD and the read
+    monkeypatch.setattr(cache, '_current_etag', lambda uri, etag=None, validate=True: old)
+    assert cache.read_parsed(URI, lambda stream: stream.read().upper(), 'upper') == b'NEW'
+    assert disk_cache.get(URI, old, 'upper') is None
+    assert disk_cache.get(URI, new, 'upper') is not None
+
+
+def test_local_path_removes_the_partial_download(disk_cache, monkeypatch):
+    storage.write_bytes(URI, b'content')
+
+    def download_file(uri, file_name):
+        with open(file_name, 'wb') as f:
+            f.write(b'cont')
+        raise ConnectionError('connection reset')
+
+    monkeypatch.setattr(storage, 'download_file', download_file)
+    with pytest.raises(ConnectionError):
+        cache.local_path(URI)
+    assert os.listdir(disk_cache.directory) == []
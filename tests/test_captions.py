@@ -0,0 +1,80 @@
+import pandas as pd
+import pytest
+import storage
+import adaptors
+import generators
+
+SRT = '''1
+00:00:01,000 --> 00:00:02,500
+Hola, buenos dias
+
+2
+00:00:02,500 --> 00:01:04,250
+le llamo de su banco
+para hablar de su deuda
+
+3
+01:00:00,000 --> 01:00:01,5
+gracias
+'''
+
+VTT = '''WEBVTT
+Kind: captions
+
+NOTE una nota
+que ocupa dos lineas
+
+intro
+00:01.000 --> 00:02.500 align:start position:10%
+Hola, buenos dias
+
+00:00:02.500 --> 00:00:04.000
+le llamo de su banco
+'''
+
+
+def test_srt_blocks():
+    assert list(adaptors.parse_captions(SRT.splitlines())) == [
+        (1, 1.0, 2.5, 'Hola, buenos dias'),
+        (2, 2.5, 64.25, 'le llamo de su banco para hablar de su deuda'),
+        (3, 3600.0, 3601.5, 'gracias')]
+
+
+def test_vtt_blocks_skip_the_header_and_notes():
+    # VTT cue ids are not numbers, the blocks are numbered in order
+    assert list(adaptors.parse_captions(VTT.splitlines())) == [
+        (1, 1.0, 2.5, 'Hola, buenos dias'),
+        (2, 2.5, 4.0, 'le llamo de su banco')]
+
+
+def test_missing_blank_lines_and_bom():
+    lines = ['\ufeff1', '00:00:01,000 --> 00:00:02,000', 'uno', '2', '00:00:02,000 --> 00:00:03,000', 'dos']
+    assert list(adaptors.parse_captions(lines)) == [(1, 1.0, 2.0, 'uno'), (2, 2.0, 3.0, 'dos')]
+
+
+def test_blocks_without_timing_are_skipped():
+    lines = ['1', 'texto suelto', '', '2', '00:00:02,000 --> 00:00:03,000', 'dos', '']
+    assert list(adaptors.parse_captions(lines)) == [(2, 2.0, 3.0, 'dos')]
+
+
+@pytest.mark.parametrize('chunksize', [None, 2])
+def test_youtube2df_local_file(tmp_path, chunksize):
+    path = tmp_path / 'captions.srt'
+    path.write_text(SRT, encoding='utf8')
+    frame = adaptors.youtube2df(str(path), aws_path=False, chunksize=chunksize)
+    if chunksize:
+        frames = list(frame)
+        assert [len(part) for part in frames] == [2, 1]
+        frame = pd.concat(frames, ignore_index=True)
+    assert list(frame.columns) == ['orig_index', 'start', 'end', 'transcript']
+    assert frame['orig_index'].tolist() == [1, 2, 3]
+    assert frame['end'].tolist() == [2.5, 64.25, 3601.5]
+    assert frame['transcript'].dtype == 'string'
+
+
+def test_youtube2df_from_s3(local_s3):
+    storage.write_bytes('s3://captions/video.srt', generators.srt_captions(50))
+    frame = adaptors.youtube2df('s3://captions/video.srt', cached=False)
+    assert len(frame) == 50
+    assert frame['orig_index'].tolist() == list(range(1, 51))
+    assert (frame['end'] > frame['start']).all()
@@ -0,0 +1,56 @@
+import math
+import pytest
+import evaluation
+
+REFERENCES = ['Hola, buenos días', 'le llamo de su banco', 'pago hoy', 'deuda', '']
+HYPOTHESES = ['hola buenos dias', 'le llamo de banco', 'pago el hoy', 'duda', 'ruido']
+FILES = ['f1', 'f1', 'f2', 'f2', 'f2']
+
+# counted by hand: columns of evaluation.WORD_COUNTS then evaluation.CHAR_COUNTS
+SEGMENTS = [[3, 3, 0, 0, 0, 16, 16, 0, 0, 0],
+            [5, 4, 0, 0, 1, 20, 17, 0, 0, 3],
+            [2, 3, 0, 1, 0, 8, 11, 0, 3, 0],
+            [1, 1, 1, 0, 0, 5, 4, 0, 0, 1],
+            [0, 1, 0, 1, 0, 0, 5, 0, 5, 0]]
+COUNTS = evaluation.WORD_COUNTS + evaluation.CHAR_COUNTS
+
+
+@pytest.mark.parametrize('workers, threshold', [(1, 100000), (2, 1)])
+def test_evaluate_counts_every_segment(workers, threshold):
+    segments = evaluation.evaluate(REFERENCES, HYPOTHESES, files=FILES, workers=workers, chunksize=2,
+                                   parallel_threshold=threshold)
+    assert segments['file'].tolist() == FILES
+    assert segments[COUNTS].to_numpy().tolist() == SEGMENTS
+    assert segments['wer'].tolist()[:4] == [0.0, 1 / 5, 1 / 2, 1.0]
+    assert segments['cer'].tolist()[:4] == [0.0, 3 / 20, 3 / 8, 1 / 5]
+    # nothing to compare against
+    assert math.isnan(segments['wer'].iloc[4]) and math.isnan(segments['cer'].iloc[4])
+
+
+def test_aggregate_sums_the_counts_of_each_file():
+    files = evaluation.aggregate(evaluation.evaluate(REFERENCES, HYPOTHESES, files=FILES, workers=1))
+    assert files.index.tolist() == ['f1', 'f2']
+    assert files['segments'].tolist() == [2, 3]
+    assert files[COUNTS].to_numpy().tolist() == [[8, 7, 0, 0, 1, 36, 33, 0, 0, 3],
+                                                 [3, 5, 1, 2, 0, 13, 20, 0, 8, 1]]
+    assert files['wer'].tolist() == [1 / 8, 1.0]
+    assert files['cer'].tolist() == [3 / 36, 9 / 13]
+
+
+def test_corpus_scores_weigh_every_word_the_same():
+    segments = evaluation.evaluate(REFERENCES, HYPOTHESES, files=FILES, workers=1)
+    expected = dict(zip(COUNTS, [11, 12, 1, 2, 1, 49, 53, 0, 8, 4]), wer=4 / 11, cer=12 / 49)
+    assert evaluation.corpus_scores(segments) == pytest.approx(expected)
+    assert evaluation.corpus_scores(evaluation.aggregate(segments)) == pytest.approx(expected)
+    # the mean of the per segment rates would give the short segments more weight
+    assert segments['wer'].mean() != pytest.approx(expected['wer'])
+
+
+def test_anchored_counts_are_an_upper_bound(monkeypatch):
+    exact = evaluation.evaluate(REFERENCES, HYPOTHESES, workers=1)
+    monkeypatch.setattr(evaluation, 'MAX_EXACT_CELLS', 0)
+    anchored = evaluation.evaluate(REFERENCES, HYPOTHESES, workers=1)
+    errors = lambda frame: frame[['sub', 'ins', 'del', 'char_sub', 'char_ins', 'char_del']].to_numpy()
+    assert (errors(anchored) >= errors(exact)).all()
+    assert anchored[['ref_words', 'hyp_words', 'ref_chars', 'hyp_chars']].equals(
+        exact[['ref_words', 'hyp_words', 'ref_chars', 'hyp_chars']])
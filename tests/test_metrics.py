@@ -0,0 +1,28 @@
+import threading
+import metrics
+
+
+def test_spans_of_other_threads_do_not_share_the_peaks():
+    record = metrics.Metrics(trace_memory=True)
+    depths = []
+    opened, closed = threading.Event(), threading.Event()
+
+    def worker():
+        with record.span('worker'):
+            depths.append(len(record._peaks))
+            opened.set()
+            closed.wait(5)
+
+    thread = threading.Thread(target=worker)
+    with record.span('handler'):
+        thread.start()
+        opened.wait(5)
+        # the worker span is still open, this thread only sees its own
+        with record.span('inner'):
+            depths.append(len(record._peaks))
+        closed.set()
+        thread.join()
+        assert len(record._peaks) == 1
+    assert depths == [1, 2]
+    assert record._peaks == []
+    assert {'worker.peak_memory', 'handler.peak_memory', 'inner.peak_memory'} <= set(record.values)
@@ -0,0 +1,28 @@
+import storage
+
+PREFIX = 's3://tests/output-transcribe/20210101/'
+MANIFEST = 's3://tests/listings/20210101.json'
+
+
+def test_list_changes_returns_new_changed_and_removed_objects(local_s3):
+    for name in ('a.json', 'b.json', 'c.json'):
+        storage.write_bytes(f'{PREFIX}{name}', name)
+    assert storage.list_changes(PREFIX, MANIFEST) == ([f'{PREFIX}a.json', f'{PREFIX}b.json', f'{PREFIX}c.json'], [])
+    assert storage.list_changes(PREFIX, MANIFEST) == ([], [])
+
+    storage.write_bytes(f'{PREFIX}b.json', 'changed')
+    storage.write_bytes(f'{PREFIX}d.json', 'd.json')
+    storage.delete(f'{PREFIX}a.json')
+    assert storage.list_changes(PREFIX, MANIFEST) == ([f'{PREFIX}b.json', f'{PREFIX}d.json'], [f'{PREFIX}a.json'])
+
+
+def test_list_changes_append_only_lists_after_the_last_key(local_s3):
+    storage.write_bytes(f'{PREFIX}0001.json', '1')
+    storage.list_changes(PREFIX, MANIFEST, append_only=True)
+    storage.write_bytes(f'{PREFIX}0002.json', '2')
+    assert storage.list_changes(PREFIX, MANIFEST, append_only=True) == ([f'{PREFIX}0002.json'], [])
+
+
+def test_sharded_listing_matches_the_sequential_one(local_s3):
+    storage.put_many({f'{PREFIX}{folder}/{i:04d}.json': '' for folder in 'abc' for i in range(50)})
+    assert storage.list_uris(PREFIX, workers=8) == storage.list_uris(PREFIX)
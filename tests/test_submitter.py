@@ -0,0 +1,124 @@
+import os
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import storage
+import idempotency
+import local_aws
+import submitter
+from conftest import ROOT
+
+
+@pytest.fixture
+def jobs(local_s3):
+    return submitter.Submitter('RAW', queue=submitter.StorageQueue('s3://tests/queue/', 's3://tests/failed/'),
+                               bucket=submitter.TokenBucket(1000, 100), client=local_aws.FakeTranscribeClient(),
+                               store=idempotency.IdempotencyStore(idempotency.SQLiteBackend(':memory:')))
+
+
+def test_enqueue_claims_an_upload_once(jobs):
+    item = jobs.enqueue('uploads', 'audios/a.wav', '"e1"')
+    assert item is not None
+    assert jobs.enqueue('uploads', 'audios/a.wav', '"e1"') is None
+    assert len(jobs.queue) == 1
+
+    record = jobs.store.get('RAW', 'uploads', 'audios/a.wav', 'e1')
+    assert record['state'] == idempotency.SUBMITTED
+    assert record['job_name'] == item['request']['TranscriptionJobName']
+    assert record['queue_uri'] in jobs.queue
+
+
+def test_a_new_etag_is_a_new_upload(jobs):
+    assert jobs.enqueue('uploads', 'audios/a.wav', '"e1"') is not None
+    assert jobs.enqueue('uploads', 'audios/a.wav', '"e2"') is not None
+    assert len(jobs.queue) == 2
+
+
+def test_concurrent_redeliveries_queue_one_item(jobs):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        items = list(pool.map(lambda _: jobs.enqueue('uploads', 'audios/a.wav', '"e1"'), range(16)))
+    assert sum(item is not None for item in items) == 1
+    assert len(jobs.queue) == 1
+
+
+def test_enqueue_releases_the_claim_when_the_put_fails(jobs, monkeypatch):
+    def put(item, uri=None):
+        raise OSError('storage unavailable')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(jobs.queue, 'put', put)
+        with pytest.raises(OSError):
+            jobs.enqueue('uploads', 'audios/a.wav', '"e1"')
+    assert jobs.store.get('RAW', 'uploads', 'audios/a.wav', 'e1') is None
+
+    assert jobs.enqueue('uploads', 'audios/a.wav', '"e1"') is not None
+    assert len(jobs.queue) == 1
+
+
+def test_redelivery_after_the_drain_starts_no_second_job(jobs):
+    jobs.enqueue('uploads', 'audios/a.wav', '"e1"')
+    assert jobs.drain()['submitted'] == 1
+    assert jobs.enqueue('uploads', 'audios/a.wav', '"e1"') is None
+    assert jobs.drain()['submitted'] == 0
+    assert len(jobs.client.jobs) == 1
+    assert len(jobs.queue) == 0
+
+
+def load_lambda(name):
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'),
+                                                  os.path.join(ROOT, 'Lambdas', f'{name}.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def fake_aws(local_s3, monkeypatch):
+    client = local_aws.FakeTranscribeClient()
+    monkeypatch.setitem(storage._clients, ('transcribe', None), client)
+    monkeypatch.setattr(idempotency, '_store', idempotency.IdempotencyStore(idempotency.SQLiteBackend(':memory:')))
+    monkeypatch.setattr(submitter, '_submitters', {})
+    return client
+
+
+def test_job_handler_queues_every_record_then_drains_once(fake_aws, monkeypatch):
+    drains = []
+    drain = submitter.Submitter.drain
+    monkeypatch.setattr(submitter.Submitter, 'drain', lambda self, *args, **kwargs: drains.append(1) or
+                        drain(self, *args, **kwargs))
+    records = [local_aws.s3_record('socofin-input', f'grabaciones-audio/20210118/llamada {i}.wav') for i in range(3)]
+    # a record without its object is counted as failed, the others are submitted
+    records.append({'s3': {'bucket': {'name': 'socofin-input'}}})
+    handler = load_lambda('create-transcription-job').lambda_handler
+    counts = handler(local_aws.s3_event(records), local_aws.FakeContext())
+    assert counts == {'submitted': 3, 'duplicate': 0, 'deferred': 0, 'failed': 1}
+    assert len(drains) == 1
+    assert len(fake_aws.jobs) == 3
+
+
+@pytest.mark.parametrize('profile, key', [('production', 'grabaciones-audio/20210118/2020-12-15 12-13-59.0569.wav'),
+                                          ('RAW', 'audios/Llamada prueba-1.wav'), ('IPA', 'audios/Llamada prueba-1.wav')])
+def test_output_keys_give_back_the_job_name(profile, key):
+    request = submitter.job_request(profile, 'socofin-input', key, timestamp=1610000000.25)
+    job_name = request['TranscriptionJobName']
+    assert submitter.job_profile(job_name) == profile
+    assert submitter.output_job_name(request['OutputBucketName'], request['OutputKey']) == job_name
+
+
+@pytest.mark.parametrize('job_name', ['DAILY-report', 'DA20210118', 'DA_2021_x', 'notes-RAW', 'Call-1610000000-IPA'])
+def test_other_jobs_have_no_profile(job_name):
+    assert submitter.job_profile(job_name) is None
+
+
+def test_completion_takes_the_job_name_from_the_transcript_key(fake_aws, monkeypatch):
+    key = 'grabaciones-audio/20210118/llamada 1.wav'
+    storage.write_bytes(storage.to_uri('socofin-input', key), b'RIFF')
+    request = submitter.job_request('production', 'socofin-input', key)
+    fake_aws.start_transcription_job(**request)
+    fake_aws.poll()
+    monkeypatch.setattr(storage, 'read_bytes', lambda *args, **kwargs: pytest.fail('the transcript was read'))
+    handler = load_lambda('transcription-completed').lambda_handler
+    records = [local_aws.s3_record(request['OutputBucketName'], request['OutputKey']),
+               local_aws.s3_record(request['OutputBucketName'], 'output-transcribe/.write_access_check_file.temp')]
+    assert handler(local_aws.s3_event(records), local_aws.FakeContext())['COMPLETED'] == 1
+    assert storage.head('s3://socofin-input/procesados/20210118/llamada 1.wav') is not None
@@ -0,0 +1,34 @@
+import gc
+import pytest
+import storage
+import uploads
+
+URI = 's3://tests/words/part.parquet'
+
+
+def stored():
+    backend, bucket, key = storage.get_backend(URI)
+    return storage.head(URI) is not None, backend.find_multipart(bucket, key) is not None
+
+
+def test_writer_completes_on_close(local_s3):
+    with uploads.MultipartWriter(URI, part_size=4) as writer:
+        writer.write(b'0123456789')
+    assert storage.read_bytes(URI) == b'0123456789'
+    assert stored() == (True, False)
+
+
+def test_writer_aborts_when_the_with_block_raises(local_s3):
+    with pytest.raises(RuntimeError):
+        with uploads.MultipartWriter(URI, part_size=4) as writer:
+            writer.write(b'0123456789')
+            raise RuntimeError('the pyarrow writer failed')
+    assert stored() == (False, False)
+
+
+def test_abandoned_writer_is_aborted_when_collected(local_s3):
+    writer = uploads.MultipartWriter(URI, part_size=4)
+    writer.write(b'0123456789')
+    del writer
+    gc.collect()
+    assert stored() == (False, False)
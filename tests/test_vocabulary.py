@@ -0,0 +1,35 @@
+import pytest
+import storage
+import cache
+import vocabulary
+
+URI = 's3://tests/customVocabIPA/dictionary.txt'
+
+
+@pytest.fixture
+def samplers(local_s3, tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'S3Backend', storage.LocalBackend)
+    monkeypatch.setattr(cache, '_cache', cache.DiskCache(str(tmp_path / 'cache')))
+    monkeypatch.setattr(vocabulary, '_samplers', {})
+    return vocabulary._samplers
+
+
+def test_empty_dictionary_has_no_lines(tmp_path):
+    path = tmp_path / 'empty.txt'
+    path.write_bytes(b'')
+    with vocabulary.VocabularySampler(str(path)) as sampler:
+        assert len(sampler) == 0 and sampler.header is None
+        assert sampler.sample(0) == []
+        with pytest.raises(ValueError, match='Cannot draw 1 distinct lines from 0'):
+            sampler.sample(1)
+
+
+def test_replaced_dictionary_closes_the_old_sampler(samplers):
+    storage.write_bytes(URI, 'Phrase\tIPA\nhola\to l a\n')
+    old = vocabulary.get_sampler(URI)
+    assert vocabulary.get_sampler(URI) is old
+    storage.write_bytes(URI, 'Phrase\tIPA\nadios\ta d i o s\nbanco\tb a n k o\n')
+    new = vocabulary.get_sampler(URI)
+    assert new is not old and old._file.closed
+    assert sorted(new.sample(2, seed=1)) == ['adios\ta d i o s', 'banco\tb a n k o']
+    assert list(samplers.values()) == [new]
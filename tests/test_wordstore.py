@@ -0,0 +1,82 @@
+import json
+import pytest
+import storage
+import wordstore
+import generators
+
+DAY = '20210101'
+FOLDER = wordstore.TRANSCRIPTS_URI.format(date=DAY)
+
+
+def write_transcript(name, words, seed):
+    storage.write_bytes(f'{FOLDER}{name}', json.dumps(generators.transcribe_json(words, seed=seed)))
+    return f"output-transcribe/{DAY}/{name}"
+
+
+def words_per_file():
+    return wordstore.read_day(DAY, ['file']).to_pandas()['file'].astype(object).value_counts().to_dict()
+
+
+def rollup_files():
+    return sorted(wordstore.read_rollups(DAY, columns=['file'])['file'].to_pylist())
+
+
+@pytest.fixture
+def day(local_s3):
+    first, second = write_transcript('a/call.json', 30, 1), write_transcript('b/call.json', 20, 2)
+    result = wordstore.update_day(DAY)
+    assert (result['rows'], result['files'], result['removed']) == (50, 2, 0)
+    return first, second
+
+
+def test_update_day_adds_the_new_transcripts(day):
+    first, second = day
+    assert words_per_file() == {first: 30, second: 20}
+    assert rollup_files() == sorted(day)
+
+    third = write_transcript('c.json', 10, 3)
+    result = wordstore.update_day(DAY)
+    assert (result['rows'], result['files']) == (10, 1)
+    assert words_per_file() == {first: 30, second: 20, third: 10}
+    assert set(wordstore.read_manifest(DAY)['objects']) == {f'{FOLDER}a/call.json', f'{FOLDER}b/call.json',
+                                                            f'{FOLDER}c.json'}
+
+
+def test_update_day_skips_the_unchanged_transcripts(day):
+    result = wordstore.update_day(DAY)
+    assert (result['rows'], result['files'], result['removed']) == (0, 0, 0)
+    assert sum(words_per_file().values()) == 50
+
+
+def test_update_day_replaces_a_modified_transcript(day):
+    first, second = day
+    write_transcript('a/call.json', 5, 9)
+    result = wordstore.update_day(DAY)
+    assert (result['rows'], result['files']) == (5, 1)
+    # the transcript with the same name in the other folder keeps its rows
+    assert words_per_file() == {first: 5, second: 20}
+    assert rollup_files() == sorted(day)
+
+
+def test_update_day_drops_a_removed_transcript(day):
+    first, second = day
+    storage.delete(f'{FOLDER}b/call.json')
+    result = wordstore.update_day(DAY)
+    assert result['removed'] == 1
+    assert words_per_file() == {first: 30}
+    assert rollup_files() == [first]
+    assert list(wordstore.read_manifest(DAY)['objects']) == [f'{FOLDER}a/call.json']
+
+
+def test_update_day_merges_the_objects_of_an_event(day):
+    first, _ = day
+    third = write_transcript('c.json', 10, 3)
+    objects = {f'{FOLDER}c.json': storage.head(f'{FOLDER}c.json')['ETag']}
+    wordstore.update_day(DAY, objects, removed=[f'{FOLDER}b/call.json'])
+    assert words_per_file() == {first: 30, third: 10}
+
+
+def test_full_rebuild_writes_the_day_again(day):
+    result = wordstore.update_day(DAY, full=True)
+    assert (result['rows'], result['files'], result['parts']) == (50, 2, 1)
+    assert sum(words_per_file().values()) == 50
@@ -0,0 +1,290 @@
+import os
+import json
+import logging
+from array import array
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+import storage
+import cache
+import metrics
+
+try:
+    # incremental parser, the C backend is used when available
+    import ijson
+except ImportError:
+    ijson = None
+
+
+ITEMS = 'results.items.item'
+CHANNEL = 'results.channel_labels.channels.item'
+CHANNEL_ITEMS = f'{CHANNEL}.items.item'
+
+# Threads used to fetch and parse the files of a day, the work is mostly S3 reads
+LOAD_WORKERS = 16
+
+# typecodes of array.array for the supported float dtypes
+_TYPECODES = {np.dtype(np.float32): 'f', np.dtype(np.float64): 'd'}
+
+
+class _ItemColumns:
+    ''' Typed, growing columns for Transcribe items with dictionary encoded strings '''
+
+    def __init__(self, dtype=np.float32):
+        self.dtype = np.dtype(dtype)
+        code = _TYPECODES[self.dtype]
+        self.start, self.end, self.confidence = array(code), array(code), array(code)
+        self.content, self.type, self.channel = array('i'), array('i'), array('i')
+        self.dictionaries = {'content': {}, 'type': {}, 'channel': {}}
+
+    def _encode(self, name, value):
+        """ Dictionary code of value, -1 for missing values """
+        if value is None:
+            return -1
+        dictionary = self.dictionaries[name]
+        code = dictionary.get(value)
+        if code is None:
+            code = dictionary[value] = len(dictionary)
+        return code
+
+    def append(self, start, end, confidence, content, kind):
+        self.start.append(start)
+        self.end.append(end)
+        self.confidence.append(confidence)
+        self.content.append(self._encode('content', content))
+        self.type.append(self._encode('type', kind))
+
+    def label_channel(self, label):
+        """ Set the channel of the rows appended since the last call """
+        code = self._encode('channel', label)
+        self.channel.extend([code] * (len(self.start) - len(self.channel)))
+
+    def _categorical(self, name):
+        codes = np.frombuffer(getattr(self, name), dtype=np.intc)
+        return pd.Categorical.from_codes(codes, categories=pd.Index(list(self.dictionaries[name]), dtype=object))
+
+    def frame(self, channels=False):
+        columns = {'start': np.frombuffer(self.start, dtype=self.dtype),
+                   'end': np.frombuffer(self.end, dtype=self.dtype),
+                   'confidence': np.frombuffer(self.confidence, dtype=self.dtype),
+                   'content': self._categorical('content'),
+                   'type': self._categorical('type')}
+        if channels:
+            columns['channel'] = self._categorical('channel')
+        return pd.DataFrame(columns)
+
+
+def _float(value):
+    """ Transcribe stores numbers as strings, missing values are NaN """
+    return float(value) if value not in (None, '') else np.nan
+
+
+def _slots(channels):
+    """ Map of the parse event prefixes that are read to their slot in the item buffer """
+    item_prefix = CHANNEL_ITEMS if channels else ITEMS
+    slots = {item_prefix: 'item',
+             f'{item_prefix}.start_time': 0,
+             f'{item_prefix}.end_time': 1,
+             f'{item_prefix}.type': 4,
+             f'{item_prefix}.alternatives.item.confidence': 'confidence',
+             f'{item_prefix}.alternatives.item.content': 'content',
+             f'{item_prefix}.alternatives.item': 'alternative'}
+    if channels:
+        slots[CHANNEL] = 'channel'
+        slots[f'{CHANNEL}.channel_label'] = 'label'
+    return slots
+
+
+def _parse_events(events, columns, channels):
+    """ Fill columns from ijson parse events, only one item is held in memory at a time """
+    slots = _slots(channels)
+    # start, end, confidence, content, type and number of alternatives of the current item
+    item = None
+    label = None
+    for prefix, event, value in events:
+        slot = slots.get(prefix)
+        if slot is None:
+            continue
+        if isinstance(slot, int):
+            item[slot] = _float(value) if slot < 2 else value
+        elif slot == 'confidence':
+            # only the first alternative is kept
+            if item[5] == 1:
+                item[2] = _float(value)
+        elif slot == 'content':
+            if item[5] == 1:
+                item[3] = value
+        elif slot == 'alternative':
+            if event == 'start_map':
+                item[5] += 1
+        elif slot == 'item':
+            if event == 'start_map':
+                item = [np.nan, np.nan, np.nan, None, None, 0]
+            elif event == 'end_map':
+                columns.append(*item[:5])
+        elif slot == 'label':
+            label = value
+        elif event == 'end_map':
+            columns.label_channel(label)
+            label = None
+
+
+def _append_items(items, columns):
+    """ Fill columns from an iterable of item dicts """
+    for value in items:
+        alternative = (value.get('alternatives') or [{}])[0]
+        columns.append(_float(value.get('start_time')), _float(value.get('end_time')),
+                       _float(alternative.get('confidence')), alternative.get('content'),
+                       value.get('type'))
+
+
+def _parse_document(data, columns, channels):
+    """ Fill columns from an already loaded document (used when ijson is not installed) """
+    if not channels:
+        _append_items(data['results'].get('items', []), columns)
+        return
+    for channel in data['results'].get('channel_labels', {}).get('channels', []):
+        _append_items(channel.get('items', []), columns)
+        columns.label_channel(channel.get('channel_label'))
+
+
+def _open_stream(filepath, aws_path=True):
+    """ Binary file-like object of a local or AWS S3 file """
+    if aws_path:
+        return storage.open_uri(filepath)
+    return open(filepath, 'rb')
+
+
+_warned = False
+
+
+def _json_fallback():
+    """ Count every document loaded whole because ijson is missing, warn on the first one """
+    global _warned
+    metrics.count('json_fallback')
+    if not _warned:
+        _warned = True
+        logging.warning('ijson is not installed, Transcribe documents are loaded whole with json.load; '
+                        'deploy the dependency layer (layer/build.sh)')
+
+
+def read_items(stream, channels=False, dtype=np.float32):
+    ''' Parse the items of an AWS Transcribe document into a columnar DataFrame
+
+    :param stream: Binary file-like object with the Transcribe json
+    :param channels: Read results.channel_labels.channels[*].items instead of results.items
+    :param dtype: float dtype of start, end and confidence, defaults to float32
+    :return: pandas DataFrame with columns 'start', 'end', 'confidence', 'content', 'type'
+             (categorical) and 'channel' (categorical) when channels is True
+    '''
+    columns = _ItemColumns(dtype)
+    if ijson is not None and not channels:
+        # items are built one at a time by the ijson backend
+        _append_items(ijson.items(stream, ITEMS, use_float=True), columns)
+    elif ijson is not None:
+        # channel labels may come after the items, follow the parse events instead
+        _parse_events(ijson.parse(stream, use_float=True), columns, channels)
+    else:
+        _json_fallback()
+        _parse_document(json.load(stream), columns, channels)
+    return columns.frame(channels)
+
+
+def _unlabelled(frame):
+    """ Add an empty 'channel' column to a frame read without channels """
+    codes = np.full(len(frame), -1, dtype=np.intc)
+    frame['channel'] = pd.Categorical.from_codes(codes, categories=pd.Index([], dtype=object))
+    return frame
+
+
+def transcribe2columns(filepath, aws_path=True, channels=False, dtype=np.float32, cached=False):
+    ''' Stream an AWS Transcribe (json) file into a columnar DataFrame
+
+    :param filepath: Path to AWS Transcribe file
+    :param aws_path: Shift to local file or AWS S3 file
+    :param channels: Read the items of every channel instead of results.items, 'auto' falls
+                     back to results.items (with an empty channel) when there are no channels
+    :param dtype: float dtype of start, end and confidence, defaults to float32
+    :param cached: Serve S3 files and their parsed columns from the local cache (see cache.py)
+    :return: pandas DataFrame, see read_items
+    '''
+    if channels == 'auto':
+        frame = transcribe2columns(filepath, aws_path, True, dtype, cached)
+        if len(frame):
+            return frame
+        return _unlabelled(transcribe2columns(filepath, aws_path, False, dtype, cached))
+    if aws_path and cached:
+        kind = f'transcribe2columns:{int(channels)}:{np.dtype(dtype).name}'
+        return cache.read_parsed(filepath, lambda stream: read_items(stream, channels, dtype), kind)
+    with closing(_open_stream(filepath, aws_path)) as stream:
+        return read_items(stream, channels=channels, dtype=dtype)
+
+
+def load_many(uris, parser, workers=LOAD_WORKERS):
+    ''' Fetch and parse many objects with a bounded thread pool, one failing file does not stop the others
+
+    :param uris: Iterable of s3:// or file:// URIs
+    :param parser: Function that takes an URI and returns its parsed form
+    :param workers: Max number of concurrent reads
+    :return: tuple (results, errors), results is a dict {uri: parsed} in the order of uris and
+             errors a dict {uri: exception} of the files that could not be read or parsed
+    '''
+    uris = list(uris)
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(uris)))) as pool:
+        futures = {pool.submit(parser, uri): uri for uri in uris}
+        for future in as_completed(futures):
+            uri = futures[future]
+            try:
+                results[uri] = future.result()
+            except Exception as e:
+                logging.warning('Could not load %s: %r', uri, e)
+                errors[uri] = e
+    metrics.count('files_failed', len(errors))
+    return {uri: results[uri] for uri in uris if uri in results}, errors
+
+
+def concat_items(frames, names, channels=False, dtype=np.float32):
+    ''' Concatenate read_items DataFrames into one table with a categorical 'file' column
+
+    :param frames: List of DataFrames returned by read_items
+    :param names: File id of each frame, repeated names share one category
+    :param channels: The frames have a 'channel' column
+    :param dtype: float dtype of the empty table when frames is empty
+    :return: pandas DataFrame with the read_items columns and 'file'
+    '''
+    if not frames:
+        columns = _ItemColumns(dtype).frame(channels)
+        columns['file'] = pd.Categorical([])
+        return columns
+    columns = {name: np.concatenate([frame[name].to_numpy() for frame in frames])
+               for name in ('start', 'end', 'confidence')}
+    for name in ('content', 'type', 'channel') if channels else ('content', 'type'):
+        columns[name] = union_categoricals([frame[name] for frame in frames])
+    codes, uniques = pd.factorize(pd.Series(names, dtype=object))
+    uniques = pd.Index(uniques, dtype=object)
+    lengths = [len(frame) for frame in frames]
+    columns['file'] = pd.Categorical.from_codes(np.repeat(codes, lengths), categories=uniques)
+    return pd.DataFrame(columns)
+
+
+def load_transcripts(uris, workers=LOAD_WORKERS, channels=False, dtype=np.float32, cached=False,
+                     name=os.path.basename):
+    ''' Load the AWS Transcribe files of a day (or any list of URIs) into one columnar table
+
+    :param uris: Iterable of s3:// or file:// URIs
+    :param workers: Max number of concurrent reads
+    :param channels: Read the items of every channel instead of results.items (or 'auto', see
+                     transcribe2columns)
+    :param dtype: float dtype of start, end and confidence, defaults to float32
+    :param cached: Serve the files from the local cache (see cache.py)
+    :param name: Function that turns an URI into the value of the 'file' column
+    :return: tuple (DataFrame, errors), the DataFrame has the read_items columns and 'file',
+             errors is a dict {uri: exception} of the files that were skipped
+    '''
+    frames, errors = load_many(uris, lambda uri: transcribe2columns(uri, channels=channels, dtype=dtype,
+                                                                    cached=cached), workers)
+    table = concat_items(list(frames.values()), [name(uri) for uri in frames], channels, dtype)
+    return table, errors
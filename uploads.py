@@ -0,0 +1,236 @@
+import io
+import os
+import filecmp
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import storage
+import metrics
+
+
+# Size of every part of a multipart upload, files up to this size are sent in one request
+PART_SIZE = 16 * 1024 ** 2
+# Files uploaded at the same time and parts sent at the same time for each of them,
+# UPLOAD_WORKERS * PART_WORKERS should not exceed storage.MAX_POOL_CONNECTIONS
+UPLOAD_WORKERS = 4
+PART_WORKERS = 8
+
+
+def _part_count(size, part_size):
+    return max(1, -(-size // part_size))
+
+
+def _read_part(file_name, number, part_size):
+    with open(file_name, 'rb') as f:
+        f.seek((number - 1) * part_size)
+        return f.read(part_size)
+
+
+def multipart_etag(file_name, part_size=PART_SIZE):
+    ''' ETag that S3 gives to file_name once uploaded with this module
+
+    :param file_name: Local file
+    :param part_size: Part size of the upload
+    :return: '"<md5>"' for a single request upload, '"<md5 of the part md5s>-<parts>"' otherwise
+    '''
+    size = os.path.getsize(file_name)
+    digests = []
+    with open(file_name, 'rb') as f:
+        for _ in range(_part_count(size, part_size)):
+            digests.append(hashlib.md5(f.read(part_size)).digest())
+    if size <= part_size:
+        return f'"{digests[0].hex()}"'
+    return f'"{hashlib.md5(b"".join(digests)).hexdigest()}-{len(digests)}"'
+
+
+def is_uploaded(file_name, uri, part_size=PART_SIZE):
+    ''' True when uri already holds the content of file_name (same size and checksum) '''
+    backend, bucket, key = storage.get_backend(uri)
+    remote = backend.head(bucket, key)
+    if remote is None or remote['Size'] != os.path.getsize(file_name):
+        return False
+    if isinstance(backend, storage.LocalBackend):
+        # local ETags are not content hashes, compare the files
+        return filecmp.cmp(file_name, backend.path(bucket, key), shallow=False)
+    return remote['ETag'] == multipart_etag(file_name, part_size)
+
+
+def _resume(backend, bucket, key, file_name, part_size, count):
+    """ Unfinished upload of key and the ETags of its parts that match file_name """
+    upload_id = backend.find_multipart(bucket, key)
+    if upload_id is None:
+        return None, {}
+    etags = {}
+    for number, part in backend.list_parts(bucket, key, upload_id).items():
+        if number > count:
+            continue
+        data = _read_part(file_name, number, part_size)
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        if part['Size'] == len(data) and part['ETag'] == etag:
+            etags[number] = etag
+    return upload_id, etags
+
+
+def upload(file_name, uri, part_size=PART_SIZE, part_workers=PART_WORKERS, skip_existing=True):
+    ''' Upload a file, large files are sent in concurrent parts and interrupted uploads resumed
+
+    :param file_name: Local file
+    :param uri: Destination s3:// or file:// URI
+    :param part_size: Size of every part, files up to this size are sent in one request
+    :param part_workers: Parts sent at the same time
+    :param skip_existing: Do nothing when uri already holds the same content
+    :return: 'skipped', 'uploaded' or 'resumed'
+    '''
+    if skip_existing and is_uploaded(file_name, uri, part_size):
+        return 'skipped'
+    backend, bucket, key = storage.get_backend(uri)
+    size = os.path.getsize(file_name)
+    if size <= part_size:
+        with open(file_name, 'rb') as f:
+            backend.put(bucket, key, f.read())
+        return 'uploaded'
+
+    count = _part_count(size, part_size)
+    upload_id, etags = _resume(backend, bucket, key, file_name, part_size, count)
+    status = 'resumed' if upload_id else 'uploaded'
+    if upload_id is None:
+        upload_id = backend.create_multipart(bucket, key)
+
+    def send(number):
+        etags[number] = backend.upload_part(bucket, key, upload_id, number,
+                                            _read_part(file_name, number, part_size))
+
+    missing = [number for number in range(1, count + 1) if number not in etags]
+    with ThreadPoolExecutor(max_workers=max(1, min(part_workers, len(missing)))) as pool:
+        # the upload is left open on failure so the next call can resume it
+        list(pool.map(send, missing))
+    backend.complete_multipart(bucket, key, upload_id, [etags[number] for number in range(1, count + 1)])
+    return status
+
+
+class MultipartWriter(io.RawIOBase):
+    ''' Writable file object that streams into an object part by part, only one part is kept in
+        memory (e.g. the sink of a pyarrow writer). Objects up to part_size are sent in one request.
+
+    The upload is completed by close (or the end of a with block) and aborted by abort, when the
+    with block raises or when the writer is garbage collected without being closed.
+
+    :param uri: Destination s3:// or file:// URI
+    :param part_size: Size of every part, S3 needs at least 5 MB
+    '''
+
+    def __init__(self, uri, part_size=PART_SIZE):
+        super().__init__()
+        self.uri = uri
+        self.backend, self.bucket, self.key = storage.get_backend(uri)
+        self.part_size = part_size
+        self.upload_id = None
+        self.etags = []
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('write to a closed MultipartWriter')
+        data = memoryview(data).cast('B')
+        self._buffer += data
+        self._position += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._send(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def _send(self, data):
+        if self.upload_id is None:
+            self.upload_id = self.backend.create_multipart(self.bucket, self.key)
+        self.etags.append(self.backend.upload_part(self.bucket, self.key, self.upload_id,
+                                                   len(self.etags) + 1, data))
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                self.backend.put(self.bucket, self.key, bytes(self._buffer))
+            else:
+                if self._buffer:
+                    self._send(bytes(self._buffer))
+                self.backend.complete_multipart(self.bucket, self.key, self.upload_id, self.etags)
+            metrics.count('files_written')
+            metrics.count('bytes_written', self._position, 'Bytes')
+        except BaseException:
+            if self.upload_id is not None:
+                self.backend.abort_multipart(self.bucket, self.key, self.upload_id)
+            raise
+        finally:
+            self._buffer = bytearray()
+            super().close()
+
+    def abort(self):
+        ''' Drop the data written so far, nothing is stored at uri '''
+        if self.closed:
+            return
+        if self.upload_id is not None:
+            self.backend.abort_multipart(self.bucket, self.key, self.upload_id)
+        self._buffer = bytearray()
+        super().close()
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None:
+            self.close()
+        else:
+            self.abort()
+
+    def __del__(self):
+        # IOBase would close, i.e. store the partial data of a writer abandoned after an error
+        try:
+            self.abort()
+        except Exception:
+            pass
+
+
+def _targets(files, prefix_uri):
+    """ {local file: destination URI} from a dict, a directory or a list of files """
+    if isinstance(files, dict):
+        return dict(files)
+    if isinstance(files, str) and os.path.isdir(files):
+        base = files
+        files = [os.path.join(dirpath, name) for dirpath, _, names in os.walk(base) for name in names]
+        relative = lambda file_name: os.path.relpath(file_name, base).replace(os.sep, '/')
+    else:
+        files = [files] if isinstance(files, str) else list(files)
+        relative = os.path.basename
+    prefix_uri = prefix_uri if prefix_uri.endswith('/') else f'{prefix_uri}/'
+    return {file_name: f'{prefix_uri}{relative(file_name)}' for file_name in sorted(files)}
+
+
+def upload_many(files, prefix_uri=None, part_size=PART_SIZE, workers=UPLOAD_WORKERS,
+                part_workers=PART_WORKERS, skip_existing=True):
+    ''' Upload many files concurrently, one failing file does not stop the others
+
+    :param files: Dict {local file: URI}, a directory (uploaded recursively) or a list of files
+    :param prefix_uri: Destination folder URI when files is a directory or a list
+    :param part_size: Size of every part of the multipart uploads
+    :param workers: Files uploaded at the same time
+    :param part_workers: Parts sent at the same time for each file
+    :param skip_existing: Skip the files already uploaded with the same content
+    :return: Dict {local file: 'skipped' | 'uploaded' | 'resumed' | exception}
+    '''
+    targets = _targets(files, prefix_uri)
+
+    def send(item):
+        file_name, uri = item
+        try:
+            return upload(file_name, uri, part_size, part_workers, skip_existing)
+        except Exception as e:
+            logging.error('Could not upload %s to %s: %r', file_name, uri, e)
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(targets)))) as pool:
+        return dict(zip(targets, pool.map(send, targets.items())))
@@ -0,0 +1,142 @@
+import os
+import mmap
+import numpy as np
+import cache
+
+
+# IPA dictionary used to build the shuffled custom vocabularies
+DICTIONARY_URI = 's3://awstranscribe-tests/customVocabIPA/big_ass_dictionary.txt'
+# Bytes scanned at a time while indexing the lines of a dictionary
+INDEX_CHUNK = 1 << 24
+
+# Sampler of the current version of every dictionary, by URI and header
+_samplers = {}
+
+
+def _file_version(stat):
+    """ Identity of a file, changes when it is replaced (the cache updates the times of its entries) """
+    return stat.st_dev, stat.st_ino, stat.st_size
+
+
+def _line_offsets(buffer, chunk=INDEX_CHUNK):
+    """ Start and end offsets of the non empty lines of a buffer, '\\r\\n' endings are trimmed """
+    view = np.frombuffer(buffer, dtype=np.uint8)
+    if not len(view):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    newlines = [np.flatnonzero(view[i:i + chunk] == 10) + i for i in range(0, len(view), chunk)]
+    ends = np.concatenate(newlines + [np.array([len(view)])]).astype(np.int64)
+    starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64)
+    crlf = (ends > starts) & (view[np.maximum(ends - 1, 0)] == 13)
+    ends = ends - crlf
+    keep = ends > starts
+    return starts[keep], ends[keep]
+
+
+class VocabularySampler:
+    ''' Random lines of a large vocabulary dictionary without loading it into memory
+
+    The file is memory-mapped and its line offsets are indexed once, every sample only reads
+    the lines that were drawn. An empty file has no lines, drawing from it raises ValueError.
+
+    :param path: Local path of the dictionary (see cache.local_path for S3 files)
+    :param header: The first line is the table header of the vocabulary, never sampled
+    '''
+
+    def __init__(self, path, header=True):
+        self.path = path
+        self._file = open(path, 'rb')
+        stat = os.fstat(self._file.fileno())
+        self._version = _file_version(stat)
+        # an empty file cannot be mapped
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b''
+        self._starts, self._ends = _line_offsets(self._map)
+        self.header = self._line(0) if header and len(self._starts) else None
+        if self.header is not None:
+            self._starts, self._ends = self._starts[1:], self._ends[1:]
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def _line(self, i):
+        return self._map[self._starts[i]:self._ends[i]].decode('utf8')
+
+    def _draw(self, rng, k, p):
+        if k > len(self):
+            raise ValueError(f'Cannot draw {k} distinct lines from {len(self)}')
+        return rng.choice(len(self), size=k, replace=False, p=p)
+
+    @staticmethod
+    def _probabilities(weights, n):
+        """ Normalized weights, None for a uniform draw """
+        if weights is None:
+            return None
+        p = np.asarray(weights, dtype=np.float64)
+        if p.shape != (n,):
+            raise ValueError(f'Expected {n} weights, got {p.shape}')
+        return p / p.sum()
+
+    def sample(self, k, weights=None, seed=None):
+        ''' Draw k distinct lines
+
+        :param k: Number of lines
+        :param weights: Optional weight of every line (same order as the file, header excluded)
+        :param seed: Seed of numpy.random.default_rng, fixed seeds give the same lines
+        :return: List of lines (str)
+        '''
+        return self.samples(1, k, weights=weights, seed=seed)[0]
+
+    def samples(self, n, k, weights=None, seed=None):
+        ''' Draw n candidate vocabularies of k distinct lines each in one pass, lines drawn by
+            several candidates are read from the file only once
+
+        :param n: Number of vocabularies
+        :param k: Lines per vocabulary
+        :param weights: Optional weight of every line (same order as the file, header excluded)
+        :param seed: Seed of numpy.random.default_rng
+        :return: List of n lists of lines (str)
+        '''
+        rng = np.random.default_rng(seed)
+        p = self._probabilities(weights, len(self))
+        drawn = np.array([self._draw(rng, k, p) for _ in range(n)], dtype=np.int64).reshape(n, k)
+        unique, inverse = np.unique(drawn, return_inverse=True)
+        lines = np.array([self._line(i) for i in unique], dtype=object)
+        return lines[inverse.reshape(n, k)].tolist()
+
+    def write(self, file_name, lines):
+        ''' Write a vocabulary file, the header line first '''
+        with open(file_name, 'w', encoding='utf8') as f:
+            if self.header is not None:
+                f.write(self.header)
+                f.write('\n')
+            for line in lines:
+                f.write(line)
+                f.write('\n')
+        return file_name
+
+
+def get_sampler(uri=DICTIONARY_URI, header=True):
+    ''' Shared VocabularySampler of a dictionary, downloaded and indexed once per version, the
+        sampler of the previous version is closed when the dictionary is replaced
+
+    :param uri: s3:// or file:// URI of the dictionary
+    :param header: The first line is the table header of the vocabulary
+    :return: VocabularySampler
+    '''
+    path = cache.local_path(uri)
+    sampler = _samplers.get((uri, header))
+    if sampler is None or sampler.path != path or sampler._version != _file_version(os.stat(path)):
+        if sampler is not None:
+            sampler.close()
+        sampler = _samplers[(uri, header)] = VocabularySampler(path, header)
+    return sampler
@@ -0,0 +1,526 @@
+''' Daily word confidence dataset of the speech-to-tile report
+
+Every day is a partition (date=YYYYMMDD/) of Parquet files, one row per transcribed word:
+file (the object key of the transcript), channel and content are dictionary encoded, the columns
+are compressed and every batch of transcripts is one row group, so readers only fetch the columns
+and row groups they need.
+
+Each partition has a checkpoint manifest (_manifest.json) with the ETag of every transcript
+already merged and the part file holding its rows. update_day only loads the transcripts that
+are new or changed since the last run, so it can run many times a day or on every S3 event.
+
+query reads a date range with filters: days outside the range are never listed, row groups whose
+min/max statistics cannot match are skipped and only the needed column chunks are fetched, with
+ranged reads.
+
+Every partition of the word dataset has a rollup partition (ROLLUP_URI) with one row per call,
+see rollups.py, replaced by update_day for the transcripts it merges.
+'''
+import os
+import json
+import time
+import uuid
+from urllib.parse import urlparse
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import storage
+import uploads
+import rollups
+from transcripts import load_transcripts, LOAD_WORKERS
+
+
+# Root of the dataset, one date=YYYYMMDD/ folder per day
+DATASET_URI = 's3://socofin-output/output-sagemaker/TranscribeReports/words/'
+# Per call rollups, one date=YYYYMMDD/calls.parquet per day
+ROLLUP_URI = 's3://socofin-output/output-sagemaker/TranscribeReports/calls/'
+# Transcribe output of a day and the CSV report of the previous versions
+TRANSCRIPTS_URI = 's3://socofin-output/output-transcribe/{date}/'
+CSV_URI = 's3://socofin-output/output-sagemaker/TranscribeReports/output_day_{date}.csv'
+# Transcripts loaded per batch, each batch is one row group
+ROW_GROUP_FILES = 200
+# Rows of the row groups merged by compact
+ROW_GROUP_ROWS = 200000
+COMPRESSION = 'zstd'
+# Checkpoint of every partition, and the number of part files that triggers a compaction
+MANIFEST = '_manifest.json'
+MAX_PARTS = 24
+# Lock of the runs of a day: seconds a run holds it at most (a Lambda runs up to 900) and seconds
+# another run waits for it
+LOCK = '_lock.json'
+LOCK_SECONDS = 900
+LOCK_TIMEOUT = 600
+
+_TEXT = pa.dictionary(pa.int32(), pa.string())
+SCHEMA = pa.schema([('file', _TEXT), ('channel', _TEXT), ('content', _TEXT),
+                    ('start_time', pa.float64()), ('end_time', pa.float64()),
+                    ('confidence', pa.float32())])
+
+
+def partition_uri(date, root=DATASET_URI):
+    ''' URI of the folder of a day '''
+    root = root if root.endswith('/') else f'{root}/'
+    return f'{root}date={date}/'
+
+
+def manifest_uri(date, root=DATASET_URI):
+    return f'{partition_uri(date, root)}{MANIFEST}'
+
+
+def read_manifest(date, root=DATASET_URI):
+    ''' Checkpoint of a day
+
+    :return: dict with 'objects' ({transcript URI: {'ETag', 'part'}}) and 'parts' (file names of
+             the partition), both empty when the day was never written
+    '''
+    return _read_manifest(date, root)[0]
+
+
+def _read_manifest(date, root):
+    """ Checkpoint of a day and its ETag, None when the day was never written """
+    uri = manifest_uri(date, root)
+    if storage.head(uri) is None:
+        return {'objects': {}, 'parts': []}, None
+    data, etag = storage.read_tagged(uri)
+    return json.loads(data), etag
+
+
+def _read_lock(uri):
+    """ Content and ETag of a lock, (None, None) when it is free """
+    if storage.head(uri) is None:
+        return None, None
+    try:
+        data, etag = storage.read_tagged(uri)
+    except Exception:
+        # released between the two requests
+        return None, None
+    return json.loads(data), etag
+
+
+@contextmanager
+def day_lock(date, root=DATASET_URI, timeout=LOCK_TIMEOUT, lease=LOCK_SECONDS):
+    ''' Hold the lock of a day, runs of update_day on the same day wait for each other
+
+    The lock is an object created with a conditional write (_lock.json in the partition); a lock
+    older than lease seconds (its run died) is taken over.
+
+    :param date: Day as YYYYMMDD
+    :param root: Root URI of the dataset
+    :param timeout: Seconds to wait for the lock
+    :param lease: Seconds after which the lock of another run is taken over
+    :raises TimeoutError: The lock was not free in time
+    '''
+    uri = f'{partition_uri(date, root)}{LOCK}'
+    owner = uuid.uuid4().hex
+    deadline = time.time() + timeout
+    while True:
+        body = json.dumps({'owner': owner, 'expires': time.time() + lease})
+        held, etag = _read_lock(uri)
+        if held is None or held['expires'] < time.time():
+            try:
+                storage.write_if(uri, body, etag)
+                break
+            except storage.PreconditionFailed:
+                # another run got it first
+                pass
+        if time.time() > deadline:
+            raise TimeoutError(f'{uri} is held by another run')
+        time.sleep(0.2)
+    try:
+        yield owner
+    finally:
+        held, _ = _read_lock(uri)
+        if held is not None and held['owner'] == owner:
+            storage.delete(uri)
+
+
+def list_parts(date, root=DATASET_URI):
+    ''' URIs of the Parquet files of a day, from its manifest (or a listing if there is none) '''
+    folder = partition_uri(date, root)
+    parts = read_manifest(date, root)['parts']
+    if parts:
+        return [f'{folder}{name}' for name in parts]
+    return sorted(uri for uri in storage.list_uris(folder) if uri.endswith('.parquet'))
+
+
+def file_key(uri):
+    ''' Value of the 'file' column of a transcript: its object key, names repeat across folders '''
+    return urlparse(uri).path.lstrip('/')
+
+
+def _new_part():
+    """ Name of a new part file, names of later parts sort last """
+    return f'part-{time.time_ns():x}.parquet'
+
+
+def _dictionary(categorical):
+    """ pandas Categorical as an Arrow dictionary array, -1 codes are nulls """
+    categorical = categorical.remove_unused_categories()
+    codes = np.asarray(categorical.codes, dtype=np.int32)
+    return pa.DictionaryArray.from_arrays(pa.array(codes, mask=codes < 0),
+                                          pa.array(categorical.categories.to_numpy(dtype=object), pa.string()))
+
+
+def to_table(items):
+    ''' Arrow table of the words of load_transcripts (channels='auto'), sorted by file and start
+
+    :param items: DataFrame returned by load_transcripts
+    :return: pyarrow Table with SCHEMA
+    '''
+    items = items[items['type'] != 'punctuation']
+    order = np.lexsort((items['start'].to_numpy(), items['file'].cat.codes.to_numpy()))
+    items = items.iloc[order]
+    return pa.Table.from_arrays([_dictionary(items['file'].array), _dictionary(items['channel'].array),
+                                 _dictionary(items['content'].array),
+                                 pa.array(items['start'].to_numpy(dtype=np.float64)),
+                                 pa.array(items['end'].to_numpy(dtype=np.float64)),
+                                 pa.array(items['confidence'].to_numpy(dtype=np.float32))], schema=SCHEMA)
+
+
+def write_part(uris, uri, batch_files=ROW_GROUP_FILES, workers=LOAD_WORKERS, compression=COMPRESSION):
+    ''' Load transcripts in batches and stream them into one Parquet file, one row group per batch
+
+    The file is sent with a multipart upload while it is written, nothing is stored if it fails.
+
+    :param uris: URIs of the Transcribe files
+    :param uri: Destination of the Parquet file
+    :param batch_files: Transcripts per row group
+    :param workers: Max number of concurrent reads
+    :param compression: Parquet compression codec
+    :return: dict with 'uri', 'rows', 'files', 'errors' ({uri: exception} of the skipped files)
+             and 'rollups' (rollups.rollup of the rows written)
+    '''
+    uris = list(uris)
+    rows, errors, calls = 0, {}, []
+    with uploads.MultipartWriter(uri) as sink:
+        with pq.ParquetWriter(sink, SCHEMA, compression=compression) as writer:
+            for start in range(0, len(uris), batch_files):
+                items, failed = load_transcripts(uris[start:start + batch_files], workers, channels='auto',
+                                                 dtype=np.float64, name=file_key)
+                errors.update(failed)
+                table = to_table(items)
+                if len(table):
+                    writer.write_table(table, row_group_size=len(table))
+                    calls.append(rollups.rollup(table))
+                rows += len(table)
+    return {'uri': uri, 'rows': rows, 'files': len(uris) - len(errors), 'errors': errors,
+            'rollups': rollups.merge(calls)}
+
+
+def _is_transcript(uri):
+    """ Transcribe results, not its access check files """
+    return uri.endswith('.json') and not os.path.basename(uri).startswith('.')
+
+
+def list_transcripts(date):
+    ''' {URI: ETag} of the Transcribe files of a day '''
+    prefix = TRANSCRIPTS_URI.format(date=date)
+    listed = storage.list_objects(prefix, workers=storage.LIST_WORKERS)
+    objects = {storage.object_uri(prefix, obj['Key']): obj['ETag'].strip('"') for obj in listed}
+    return {uri: etag for uri, etag in objects.items() if _is_transcript(uri)}
+
+
+def copy_parts(uris, uri, exclude=(), compression=COMPRESSION, rows=ROW_GROUP_ROWS):
+    ''' Stream the row groups of Parquet files into a new one, small row groups are merged
+
+    :param uris: URIs of the Parquet files, one is read at a time
+    :param uri: Destination of the Parquet file
+    :param exclude: Values of the 'file' column whose rows are dropped
+    :param compression: Parquet compression codec
+    :param rows: Row groups are merged until they have this many rows
+    :return: Number of rows written
+    '''
+    exclude = pa.array(sorted(exclude), pa.string())
+    written, pending = 0, []
+
+    def flush():
+        table = pa.concat_tables(pending).combine_chunks()
+        writer.write_table(table, row_group_size=len(table))
+        pending.clear()
+        return len(table)
+
+    with uploads.MultipartWriter(uri) as sink:
+        with pq.ParquetWriter(sink, SCHEMA, compression=compression) as writer:
+            for source in uris:
+                parquet = pq.ParquetFile(pa.BufferReader(storage.read_bytes(source)))
+                for group in range(parquet.num_row_groups):
+                    table = parquet.read_row_group(group).cast(SCHEMA)
+                    if len(exclude):
+                        table = table.filter(pc.invert(pc.is_in(table['file'].cast(pa.string()), exclude)))
+                    if len(table):
+                        pending.append(table)
+                    if sum(len(t) for t in pending) >= rows:
+                        written += flush()
+            if pending:
+                written += flush()
+    return written
+
+
+def update_day(date, objects=None, removed=(), root=DATASET_URI, full=False, batch_files=ROW_GROUP_FILES,
+               workers=LOAD_WORKERS, compression=COMPRESSION, max_parts=MAX_PARTS, rollup_root=ROLLUP_URI,
+               lock_timeout=LOCK_TIMEOUT):
+    ''' Merge the transcripts that are new or changed since the last run into the partition of a day
+
+    The new rows go to a new part file, the parts holding rows of changed or removed transcripts
+    are rewritten without them and the manifest is replaced last, so readers going through the
+    manifest (read_day) never see a half merged day. The rollups of the merged calls replace
+    theirs in the rollup partition of the day. Runs of the same day wait for each other
+    (day_lock), and the manifest is only replaced if no other run changed it meanwhile.
+
+    :param date: Day as YYYYMMDD
+    :param objects: {transcript URI: ETag} to merge (e.g. from S3 events), defaults to a listing of
+                    the day, which also finds the removed transcripts
+    :param removed: URIs of transcripts to drop from the day (e.g. from S3 events)
+    :param root: Root URI of the dataset
+    :param full: Ignore the checkpoint and rebuild the day
+    :param batch_files: Transcripts per row group
+    :param workers: Max number of concurrent reads
+    :param compression: Parquet compression codec
+    :param max_parts: The parts are compacted into one when the day has more
+    :param rollup_root: Root URI of the rollup dataset
+    :param lock_timeout: Seconds to wait for a run of the same day
+    :return: dict with 'rows' and 'files' (merged), 'removed', 'parts' (of the day) and 'errors'
+             ({uri: exception} of the transcripts that could not be read, retried on the next run)
+    :raises TimeoutError: Another run held the day for longer than lock_timeout
+    :raises storage.PreconditionFailed: The manifest changed during the run (the lock expired),
+                                        nothing was committed
+    '''
+    with day_lock(date, root, lock_timeout):
+        return _update_day(date, objects, removed, root, full, batch_files, workers, compression, max_parts,
+                           rollup_root)
+
+
+def _update_day(date, objects, removed, root, full, batch_files, workers, compression, max_parts, rollup_root):
+    folder = partition_uri(date, root)
+    previous, version = _read_manifest(date, root)
+    known = {} if full else dict(previous['objects'])
+    if objects is None:
+        objects = list_transcripts(date)
+        removed = [uri for uri in known if uri not in objects]
+    objects = {uri: etag.strip('"') for uri, etag in objects.items() if _is_transcript(uri)}
+    changed = [uri for uri in objects if known.get(uri, {}).get('ETag') != objects[uri]]
+    stale = [uri for uri in set(changed) | set(removed) if uri in known]
+
+    # parts with rows of changed or removed transcripts are rewritten without them
+    parts, dropped = list(previous['parts']), set()
+    if full:
+        dropped = {uri[len(folder):] for uri in storage.list_uris(folder) if uri.endswith('.parquet')}
+        parts = []
+    for part in sorted({known[uri]['part'] for uri in stale}):
+        name = _new_part()
+        copy_parts([f'{folder}{part}'], f'{folder}{name}', {file_key(uri) for uri in stale
+                                                             if known[uri]['part'] == part}, compression)
+        parts[parts.index(part)] = name
+        dropped.add(part)
+        for entry in known.values():
+            if entry['part'] == part:
+                entry['part'] = name
+    for uri in stale:
+        del known[uri]
+
+    result = {'rows': 0, 'files': 0, 'errors': {}, 'rollups': rollups.SCHEMA.empty_table()}
+    if changed:
+        name = _new_part()
+        result = write_part(changed, f'{folder}{name}', batch_files, workers, compression)
+        if len(result['errors']) < len(changed):
+            parts.append(name)
+        else:
+            dropped.add(name)
+        known.update({uri: {'ETag': objects[uri], 'part': name} for uri in changed if uri not in result['errors']})
+
+    if len(parts) > max_parts:
+        name = _new_part()
+        copy_parts([f'{folder}{part}' for part in parts], f'{folder}{name}', compression=compression)
+        dropped.update(parts)
+        parts = [name]
+        for entry in known.values():
+            entry['part'] = name
+
+    if changed or stale or full:
+        previous_calls = [] if full else [_read_rollup(rollup_uri(date, rollup_root))]
+        calls = rollups.merge(previous_calls + [result['rollups']],
+                              {file_key(uri) for uri in stale if uri not in known})
+        write_table(calls, rollup_uri(date, rollup_root), compression)
+        try:
+            # the commit of the run, refused if another run replaced the manifest meanwhile
+            storage.write_if(manifest_uri(date, root), json.dumps({'objects': known, 'parts': parts}), version)
+        except storage.PreconditionFailed:
+            for part in (set(parts) | dropped) - set(previous['parts']):
+                storage.delete(f'{folder}{part}')
+            raise
+    for part in dropped - set(parts):
+        storage.delete(f'{folder}{part}')
+    return {'rows': result['rows'], 'files': result['files'], 'removed': sum(uri not in objects for uri in stale),
+            'parts': len(parts), 'errors': result['errors']}
+
+
+def write_day(date, root=DATASET_URI, batch_files=ROW_GROUP_FILES, workers=LOAD_WORKERS, compression=COMPRESSION,
+              rollup_root=ROLLUP_URI):
+    ''' Rebuild the partition of a day from all its transcripts, see update_day '''
+    return update_day(date, root=root, full=True, batch_files=batch_files, workers=workers, compression=compression,
+                      rollup_root=rollup_root)
+
+
+def rollup_uri(date, root=ROLLUP_URI):
+    return f'{partition_uri(date, root)}calls.parquet'
+
+
+def write_table(table, uri, compression=COMPRESSION):
+    ''' Write a small table as one Parquet file '''
+    with uploads.MultipartWriter(uri) as sink:
+        pq.write_table(table, sink, compression=compression)
+
+
+def _read_rollup(uri, columns=None):
+    """ Rollups of one day, None if the day has none """
+    if storage.head(uri) is None:
+        return None
+    return pq.read_table(pa.BufferReader(storage.read_bytes(uri)), columns=columns)
+
+
+def read_rollups(start, end=None, columns=None, root=ROLLUP_URI):
+    ''' Per call rollups of a date range (see rollups.SCHEMA)
+
+    :param start: First day, YYYYMMDD (or a date)
+    :param end: Last day (included), defaults to start
+    :param columns: Columns to read, defaults to all of them
+    :param root: Root URI of the rollup dataset
+    :return: pyarrow Table with the columns and 'date'
+    '''
+    days = _days(start, end)
+    with ThreadPoolExecutor(max_workers=max(1, min(LOAD_WORKERS, len(days)))) as pool:
+        tables = list(pool.map(lambda day: _read_rollup(rollup_uri(day, root), columns), days))
+    tables = [table.append_column('date', pa.array(np.full(len(table), day, dtype=object), pa.string()))
+              for day, table in zip(days, tables) if table is not None]
+    if not tables:
+        empty = rollups.SCHEMA.empty_table()
+        empty = empty if columns is None else empty.select(columns)
+        return empty.append_column('date', pa.array([], pa.string()))
+    return pa.concat_tables(tables)
+
+
+def read_day(date, columns=None, root=DATASET_URI):
+    ''' Words of a day
+
+    :param date: Day as YYYYMMDD
+    :param columns: Columns to read, defaults to all of them
+    :param root: Root URI of the dataset
+    :return: pyarrow Table
+    '''
+    tables = [pq.read_table(pa.BufferReader(storage.read_bytes(uri)), columns=columns)
+              for uri in list_parts(date, root)]
+    if not tables:
+        return SCHEMA.empty_table() if columns is None else SCHEMA.empty_table().select(columns)
+    return pa.concat_tables(tables, promote_options='permissive')
+
+
+def export_csv(date, uri=None, root=DATASET_URI):
+    ''' Write a day in the CSV format of the previous reports ('|' separated, comma decimals,
+        sorted by confidence) for the tools that still read it
+
+    :param date: Day as YYYYMMDD
+    :param uri: Destination, defaults to CSV_URI
+    :return: URI of the CSV
+    '''
+    uri = uri or CSV_URI.format(date=date)
+    frame = read_day(date, ['confidence', 'content', 'start_time', 'end_time', 'file'], root).to_pandas()
+    frame = frame.astype({'content': object, 'file': object})
+    # the previous reports had the file names, not the object keys
+    frame['file'] = frame['file'].map(os.path.basename)
+    # back to the float64 values of the Transcribe json (4 decimals) before printing them
+    frame['confidence'] = frame['confidence'].astype(np.float64).round(6)
+    frame.sort_values(by=['confidence'], ascending=True, inplace=True, kind='stable')
+    storage.write_bytes(uri, frame.to_csv(decimal=',', sep='|', encoding='utf-8'))
+    return uri
+
+
+def _days(start, end=None):
+    """ YYYYMMDD of every day from start to end, both included """
+    return list(pd.date_range(pd.Timestamp(str(start)), pd.Timestamp(str(end or start)), freq='D').strftime('%Y%m%d'))
+
+
+def _may_match(statistics, low=None, high=None, values=None):
+    """ False when the min/max statistics of a column chunk prove that no row matches """
+    if statistics is None or not statistics.has_min_max:
+        return True
+    if low is not None and statistics.max < low:
+        return False
+    if high is not None and statistics.min >= high:
+        return False
+    if values is not None and not any(statistics.min <= value <= statistics.max for value in values):
+        return False
+    return True
+
+
+def _read_part(uri, date, bounds, expression, columns):
+    """ Matching rows of one part file, None when every row group is skipped """
+    with storage.RangeReader(uri) as source:
+        parquet = pq.ParquetFile(source, pre_buffer=True)
+        metadata = parquet.metadata
+        index = {metadata.schema.column(i).name: i for i in range(metadata.num_columns)}
+        groups = [group for group in range(metadata.num_row_groups)
+                  if all(_may_match(metadata.row_group(group).column(index[name]).statistics, **bound)
+                         for name, bound in bounds.items())]
+        if not groups:
+            return None
+        needed = sorted(set(columns) | set(bounds), key=SCHEMA.names.index)
+        table = parquet.read_row_groups(groups, columns=needed)
+    if expression is not None:
+        table = table.filter(expression)
+    table = table.select(columns)
+    return table.append_column('date', pa.array(np.full(len(table), date, dtype=object), pa.string()))
+
+
+def query(start, end=None, files=None, words=None, channels=None, min_confidence=None, max_confidence=None,
+          columns=None, root=DATASET_URI, workers=LOAD_WORKERS):
+    ''' Words of a date range that match every given filter
+
+    e.g. the words under 0.5 of confidence of a week, to tune the custom vocabulary:
+    query('20201201', '20201207', max_confidence=0.5, columns=['content', 'confidence'])
+
+    :param start: First day, YYYYMMDD (or a date)
+    :param end: Last day (included), defaults to start
+    :param files: Object keys of the transcripts (the 'file' column) to keep
+    :param words: Words (the 'content' column) to keep
+    :param channels: Channel labels to keep, e.g. ['ch_0']
+    :param min_confidence: Keep words with confidence >= min_confidence
+    :param max_confidence: Keep words with confidence < max_confidence
+    :param columns: Columns to return, defaults to all of them
+    :param root: Root URI of the dataset
+    :param workers: Max number of concurrent reads
+    :return: pyarrow Table with the columns and 'date'
+    '''
+    columns = list(columns or SCHEMA.names)
+    bounds, conditions = {}, []
+    for name, values in (('file', files), ('content', words), ('channel', channels)):
+        if values is not None:
+            values = sorted(set([values] if isinstance(values, str) else values))
+            bounds[name] = {'values': values}
+            conditions.append(pc.field(name).isin(values))
+    if min_confidence is not None or max_confidence is not None:
+        # thresholds are compared as float32, like the stored confidences (0.9 is 0.8999999762)
+        low, high = (None if value is None else float(np.float32(value)) for value in (min_confidence, max_confidence))
+        bounds['confidence'] = {'low': low, 'high': high}
+        if low is not None:
+            conditions.append(pc.field('confidence') >= pa.scalar(low, pa.float32()))
+        if high is not None:
+            conditions.append(pc.field('confidence') < pa.scalar(high, pa.float32()))
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    days = _days(start, end)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(days)))) as pool:
+        parts = [(uri, day) for day, uris in zip(days, pool.map(lambda day: list_parts(day, root), days))
+                 for uri in uris]
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(parts)))) as pool:
+        tables = [table for table in pool.map(lambda part: _read_part(*part, bounds, expression, columns), parts)
+                  if table is not None]
+    if not tables:
+        empty = SCHEMA.empty_table().select(columns)
+        return empty.append_column('date', pa.array([], pa.string()))
+    return pa.concat_tables(tables, promote_options='permissive')